@@ -1,9 +1,17 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
+import os
 import json
+import uuid
+import asyncio
 import logging
-from typing import Dict, Any
-from ..services.research import conduct_research_stream
+from typing import Dict, Any, Callable, Optional, Tuple
+from ..services.jobs import job_manager
+from ..services.runs import run_registry, ResearchRun, RUN_RESUME_GRACE_SECONDS
+from ..services.streaming import BufferedFrameWriter
+from ..services.protocol import negotiate_subprotocol, encoder_for
+from ..services.scheduler import current_client_id, llm_scheduler
+from ..services.deadline import parse_deadline_ms
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -11,9 +19,49 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 单个连接上同时进行的研究会话上限
+WS_MAX_SESSIONS_PER_CONNECTION = max(1, int(os.getenv("WS_MAX_SESSIONS_PER_CONNECTION", "4")))
+
 # 存储活跃的WebSocket连接
 active_connections: Dict[str, WebSocket] = {}
 
+async def receive_message(websocket: WebSocket, encoder) -> Dict[str, Any]:
+    """接收一条客户端消息，文本帧按 JSON 解析，二进制帧按协商的编码解析"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return encoder.loads(message["bytes"])
+    return json.loads(message["text"])
+
+def tag_session(frame: Dict[str, Any], session_id: Optional[str]) -> Dict[str, Any]:
+    """为发往客户端的帧标注会话 ID；未使用会话的旧客户端保持原帧格式。"""
+    if session_id is None:
+        return frame
+    return dict(frame, session_id=session_id)
+
+async def forward_run(writer: BufferedFrameWriter, run: ResearchRun, queue: asyncio.Queue,
+                      session_id: Optional[str] = None, on_finish: Optional[Callable[[], None]] = None):
+    """
+    把研究运行的帧转发给客户端；结束或被取消时退订。
+
+    退订后运行若已无订阅者，保留 RUN_RESUME_GRACE_SECONDS 等待客户端续传，之后取消。
+    on_finish 在发送结束帧（complete/error）之前调用，客户端收到结束帧后立即
+    在同一会话中提问不会被误判为研究仍在进行。
+    """
+    try:
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                break
+            if frame.get("type") in ("complete", "error") and on_finish is not None:
+                on_finish()
+            await writer.send_frame(tag_session(frame, session_id))
+    except Exception as e:
+        logger.error(f"转发研究帧失败: {e}")
+    finally:
+        run_registry.detach(run, queue, grace=RUN_RESUME_GRACE_SECONDS)
+
 @router.websocket("/research")
 async def websocket_research_endpoint(websocket: WebSocket):
     """
@@ -25,6 +73,23 @@ async def websocket_research_endpoint(websocket: WebSocket):
         "content": "用户的问题"
     }
 
+    研究在独立任务中进行，期间仍会处理 ping；发送 {"type": "cancel"} 会立即中止进行中的
+    研究（释放上游 LLM 调用），取消后服务器返回 cancelled 帧。断开连接不会立即中止研究，
+    研究继续运行 RUN_RESUME_GRACE_SECONDS 秒等待续传（见下文），期间无人续传才取消。
+
+    question / cancel 消息可携带客户端自选的 "session_id"，同一连接上的多个会话
+    并发研究（上限 WS_MAX_SESSIONS_PER_CONNECTION），服务器返回的帧带有相同的
+    session_id；不带 session_id 的消息属于默认会话，帧格式与之前一致。
+
+    研究帧带有递增的 seq，start 帧带有 run_id。断线后研究会继续运行一段宽限时间，
+    重连的客户端发送 {"type": "resume", "run_id": ..., "last_seq": n} 即可收到
+    序号 n 之后缺失的帧以及后续的实时帧。研究失败后发送 {"type": "retry", "run_id": ...}
+    以相同 run_id 重新执行，已完成的规划、子问题草稿和报告从检查点直接复用。
+
+    question 消息可携带 "deadline_ms"（延迟预算，毫秒）：研究会按预算限制子问题数量
+    和输出长度，必要时提前结束草稿以按时生成报告，complete 帧的 "budget" 字段
+    给出各阶段耗时及降级情况。
+
     服务器返回的消息格式:
     {
         "type": "status|plan|research|report|complete|error",
@@ -34,65 +99,166 @@ async def websocket_research_endpoint(websocket: WebSocket):
         "total_questions": int, # 可选，研究阶段使用
         "question": str         # 可选，研究阶段使用
     }
+
+    协议版本通过 WebSocket 子协议在连接时协商（见 services/protocol.py）：
+    未声明子协议的客户端使用上面的 v1 格式；声明 research.v2.json 或
+    research.v2.msgpack 的客户端使用紧凑格式，内容帧只携带流 ID 和文本。
     """
-    await websocket.accept()
+    subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
 
-    # 生成连接ID
-    connection_id = f"conn_{len(active_connections)}"
+    # 生成连接ID，同时作为 LLM 调度器公平排队的客户端标识
+    connection_id = f"conn_{uuid.uuid4().hex[:8]}"
     active_connections[connection_id] = websocket
+    current_client_id.set(connection_id)
 
     logger.info(f"WebSocket连接已建立: {connection_id}")
 
+    # 所有发往客户端的帧经缓冲写入器合并，并按协商的协议编码
+    encoder = encoder_for(subprotocol)
+    writer = BufferedFrameWriter(websocket, encoder=encoder)
+
+    # 会话 ID -> (转发该会话研究帧的任务, 研究运行)；None 为不带 session_id 的默认会话
+    sessions: Dict[Optional[str], Tuple[asyncio.Task, ResearchRun]] = {}
+
+    def session_done(session_id: Optional[str], task: asyncio.Task):
+        if session_id in sessions and sessions[session_id][0] is task:
+            del sessions[session_id]
+
     try:
+        if subprotocol:
+            await writer.send_frame({"type": "hello", "protocol": subprotocol, "stage": "connect"})
+
         while True:
-            # 接收客户端消息
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            # 接收客户端消息；研究在独立任务中进行，这里始终保持读取
+            message = await receive_message(websocket, encoder)
+            message_type = message.get("type")
+            session_id = message.get("session_id")
+            if session_id is not None:
+                session_id = str(session_id)
 
-            if message.get("type") == "question":
+            if message_type in ("question", "resume", "retry"):
                 user_question = message.get("content", "").strip()
 
-                if not user_question:
-                    await websocket.send_text(json.dumps({
+                if message_type == "question" and not user_question:
+                    await writer.send_frame(tag_session({
                         "type": "error",
                         "content": "问题不能为空",
                         "stage": "error"
-                    }))
+                    }, session_id))
+                    continue
+
+                if session_id in sessions:
+                    await writer.send_frame(tag_session({
+                        "type": "error",
+                        "content": "该会话已有研究在进行中，请等待完成或先取消",
+                        "stage": "error"
+                    }, session_id))
+                    continue
+
+                if len(sessions) >= WS_MAX_SESSIONS_PER_CONNECTION:
+                    await writer.send_frame(tag_session({
+                        "type": "error",
+                        "content": f"同一连接最多同时进行 {WS_MAX_SESSIONS_PER_CONNECTION} 个研究会话",
+                        "stage": "error"
+                    }, session_id))
                     continue
 
-                logger.info(f"接收到问题: {user_question}")
+                if message_type == "question":
+                    try:
+                        deadline_ms = parse_deadline_ms(message.get("deadline_ms"))
+                    except ValueError as e:
+                        await writer.send_frame(tag_session({
+                            "type": "error",
+                            "content": str(e),
+                            "stage": "error"
+                        }, session_id))
+                        continue
+                    logger.info(f"接收到问题 (会话 {session_id}, 延迟预算 {deadline_ms} ms): {user_question}")
+                    # 相同问题的并发请求共享同一次研究，帧流广播给所有订阅者
+                    run, queue = run_registry.attach(user_question, deadline_ms)
+                elif message_type == "retry":
+                    try:
+                        run, queue = await run_registry.retry(str(message.get("run_id")))
+                    except KeyError:
+                        await writer.send_frame(tag_session({
+                            "type": "error",
+                            "content": "要重试的研究不存在或检查点已过期，请重新提问",
+                            "stage": "error"
+                        }, session_id))
+                        continue
+                else:
+                    try:
+                        run, queue = run_registry.resume(str(message.get("run_id")), int(message.get("last_seq") or 0))
+                    except KeyError:
+                        await writer.send_frame(tag_session({
+                            "type": "error",
+                            "content": "要续传的研究不存在或已过期，请重新提问",
+                            "stage": "error"
+                        }, session_id))
+                        continue
+                    except ValueError as e:
+                        await writer.send_frame(tag_session({
+                            "type": "error",
+                            "content": f"无法续传: {e}，请重新提问",
+                            "stage": "error"
+                        }, session_id))
+                        continue
+
+                task = asyncio.create_task(forward_run(
+                    writer, run, queue, session_id,
+                    on_finish=lambda session_id=session_id: sessions.pop(session_id, None)
+                ))
+                sessions[session_id] = (task, run)
+                task.add_done_callback(lambda task, session_id=session_id: session_done(session_id, task))
 
-                # 执行研究并流式返回结果
-                try:
-                    # conduct_research_stream 是一个异步函数，会处理所有WebSocket通信
-                    await conduct_research_stream(user_question, websocket)
-                except Exception as e:
-                    logger.error(f"研究过程中发生错误: {e}")
-                    await websocket.send_text(json.dumps({
+            elif message_type == "cancel":
+                if session_id not in sessions:
+                    await writer.send_frame(tag_session({
                         "type": "error",
-                        "content": f"研究失败: {str(e)}",
+                        "content": "当前没有进行中的研究",
                         "stage": "error"
-                    }))
+                    }, session_id))
+                    continue
+
+                task, run = sessions[session_id]
+                logger.info(f"客户端取消研究: {connection_id} 会话 {session_id}")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                session_done(session_id, task)
+                # 主动取消不保留续传宽限时间
+                run_registry.cancel_if_idle(run)
+                await writer.send_frame(tag_session({
+                    "type": "cancelled",
+                    "content": "研究已取消",
+                    "stage": "cancelled"
+                }, session_id))
 
-            elif message.get("type") == "ping":
+            elif message_type == "ping":
                 # 心跳检测
-                await websocket.send_text(json.dumps({
+                await writer.send_frame({
                     "type": "pong",
                     "stage": "heartbeat"
-                }))
+                })
 
             else:
-                await websocket.send_text(json.dumps({
+                await writer.send_frame({
                     "type": "error",
-                    "content": f"未知的消息类型: {message.get('type')}",
+                    "content": f"未知的消息类型: {message_type}",
                     "stage": "error"
-                }))
+                })
 
     except WebSocketDisconnect:
         logger.info(f"WebSocket连接断开: {connection_id}")
     except Exception as e:
         logger.error(f"WebSocket连接错误: {e}")
     finally:
+        # 连接断开时停止转发；研究在宽限时间内继续运行，等待客户端续传
+        tasks = [task for task, _ in sessions.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await writer.aclose()
         # 清理连接
         if connection_id in active_connections:
             del active_connections[connection_id]
@@ -102,42 +268,113 @@ async def get_active_connections():
     """获取当前活跃连接数（用于监控）"""
     return {
         "active_connections": len(active_connections),
-        "connections": list(active_connections.keys())
+        "connections": list(active_connections.keys()),
+        "llm_active_calls": llm_scheduler.active,
+        "llm_queued_calls": llm_scheduler.waiting
     }
 
 # REST API端点，用于非WebSocket请求
 @router.post("/ask")
-async def ask_question(request: Dict[str, str]):
+async def ask_question(request: Dict[str, Any]):
     """
-    非流式的研究接口
+    提交异步研究任务，立即返回 job_id，研究在后台执行
 
     请求格式:
     {
-        "question": "用户的问题"
+        "question": "用户的问题",
+        "deadline_ms": 20000    # 可选，延迟预算（毫秒，从提交时算起）
     }
+
+    之后通过 GET /ws/ask/{job_id} 查询状态与结果
     """
+    question = str(request.get("question") or "").strip()
+    if not question:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "问题不能为空"}
+        )
+
     try:
-        question = request.get("question", "").strip()
-        if not question:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "问题不能为空"}
-            )
+        deadline_ms = parse_deadline_ms(request.get("deadline_ms"))
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
 
-        # 导入同步版本的研究函数
-        from ..services.research import conduct_research_sync
+    job = job_manager.submit(question, deadline_ms=deadline_ms)
 
-        # 执行研究
-        result = conduct_research_sync(question)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "success": True,
+            "job_id": job.job_id,
+            "status": job.status
+        }
+    )
 
-        return {
+@router.get("/ask/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    查询研究任务状态
+
+    wait: 长轮询等待秒数，任务结束或超时后返回；默认立即返回。
+    未结束的任务附带 partial（已生成的规划、草稿和报告片段）。
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"任务不存在: {job_id}"}
+        )
+
+    await job_manager.wait(job, wait)
+    return job.to_dict()
+
+@router.post("/ask/{job_id}/retry")
+async def retry_job(job_id: str):
+    """
+    重试失败或已取消的研究任务，返回新的 job_id
+
+    新任务沿用原任务的研究运行 ID 和延迟预算（deadline_ms），已完成的规划、子问题草稿和报告
+    从检查点直接复用，只重新执行失败的步骤。
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"任务不存在: {job_id}"}
+        )
+    if job.status not in ("failed", "cancelled"):
+        return JSONResponse(
+            status_code=409,
+            content={"error": f"只能重试失败或已取消的任务，当前状态: {job.status}"}
+        )
+
+    retry = job_manager.submit(job.question, retry_run_id=job.run_id, deadline_ms=job.deadline_ms)
+
+    return JSONResponse(
+        status_code=202,
+        content={
             "success": True,
-            "result": result
+            "job_id": retry.job_id,
+            "status": retry.status,
+            "retry_of": job.job_id
         }
+    )
 
-    except Exception as e:
-        logger.error(f"REST API研究错误: {e}")
+@router.get("/ask/{job_id}/drafts")
+async def get_job_drafts(job_id: str):
+    """获取研究任务目前已生成的子问题草稿"""
+    job = job_manager.get(job_id)
+    if job is None:
         return JSONResponse(
-            status_code=500,
-            content={"error": f"研究失败: {str(e)}"}
-        )
\ No newline at end of file
+            status_code=404,
+            content={"error": f"任务不存在: {job_id}"}
+        )
+
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "drafts": job.partial_drafts()
+    }
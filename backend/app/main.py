@@ -1,14 +1,38 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 import os
+import logging
 from .api.websocket import router as websocket_router
+from .services.metrics import registry as metrics_registry
+from .services.endpoints import endpoint_status
+from .services.http_pool import pool_status, close_llm_http_pool
+from .services.readiness import readiness, STARTUP_PRELOAD
+from .services.research import prepare
+
+logger = logging.getLogger(__name__)
+
+# 前端目录（项目根目录下的 frontend）
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "frontend")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 模型客户端创建与上游连接预热在后台进行，不阻塞启动；完成前 /api/ready 返回 503
+    if STARTUP_PRELOAD:
+        readiness.start(prepare)
+    yield
+    await readiness.stop()
+    await close_llm_http_pool()
+
 
 app = FastAPI(
     title="LangGraph Research Assistant",
     description="AI-powered research assistant with real-time streaming",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS配置
@@ -27,39 +51,47 @@ app.include_router(websocket_router, prefix="/ws")
 async def root():
     return {"message": "LangGraph Research Assistant API"}
 
+# 存活探测：进程能响应即返回 200，不依赖模型配置
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy"}
 
+# 就绪探测：模型客户端已创建、上游连接已预热时返回 200，否则返回 503（初始化失败时附带原因）
+@app.get("/api/ready")
+async def readiness_check():
+    readiness.start(prepare)
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
+
+# Prometheus 指标（文本格式 0.0.4）
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# 上游端点池的健康状态（延迟 EWMA、错误率、熔断状态）
+@app.get("/api/llm/endpoints")
+async def llm_endpoints():
+    return {"endpoints": endpoint_status()}
+
+# LLM 共享 HTTP 连接池的利用率与连接复用统计
+@app.get("/api/llm/http")
+async def llm_http_pool():
+    return pool_status()
+
 # 主页重定向到前端
 @app.get("/home", response_class=HTMLResponse)
 async def get_home():
-    frontend_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "frontend")
-    frontend_index = os.path.join(frontend_path, "index.html")
+    frontend_index = os.path.join(FRONTEND_DIR, "index.html")
     if os.path.exists(frontend_index):
         with open(frontend_index, "r", encoding="utf-8") as f:
             return HTMLResponse(content=f.read())
     return HTMLResponse("<h1>Frontend not found</h1>", status_code=404)
 
 # 挂载静态文件（最后挂载，确保其他路由优先）
-# 使用绝对路径
-import sys
-current_file = os.path.abspath(__file__)
-project_root = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(current_file))))
-frontend_path = os.path.join(project_root, "frontend")
-
-print(f"🔍 调试信息:")
-print(f"   当前文件: {current_file}")
-print(f"   项目根目录: {project_root}")
-print(f"   前端目录: {frontend_path}")
-print(f"   前端目录存在: {os.path.exists(frontend_path)}")
-
-if os.path.exists(frontend_path):
+if os.path.isdir(FRONTEND_DIR):
     # 挂载整个frontend目录到根路径
-    app.mount("/", StaticFiles(directory=frontend_path, html=True), name="frontend")
-    print("✅ 静态文件服务已挂载")
+    app.mount("/", StaticFiles(directory=FRONTEND_DIR, html=True), name="frontend")
 else:
-    print("❌ 前端目录不存在")
+    logger.warning(f"前端目录不存在: {FRONTEND_DIR}")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 是否启用研究结果缓存
+RESEARCH_CACHE_ENABLED = os.getenv("RESEARCH_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+# 缓存条目有效期（秒），内存与磁盘共用
+RESEARCH_CACHE_TTL_SECONDS = float(os.getenv("RESEARCH_CACHE_TTL_SECONDS", "86400"))
+# 内存 LRU 的最大条目数
+RESEARCH_CACHE_MAX_ENTRIES = int(os.getenv("RESEARCH_CACHE_MAX_ENTRIES", "1024"))
+# 磁盘缓存的最大行数，超出时按过期时间从早到晚删除
+RESEARCH_CACHE_MAX_ROWS = int(os.getenv("RESEARCH_CACHE_MAX_ROWS", "100000"))
+# 写入时清理磁盘缓存（删除过期行、执行行数上限）的最小间隔（秒）
+RESEARCH_CACHE_PRUNE_INTERVAL_SECONDS = float(os.getenv("RESEARCH_CACHE_PRUNE_INTERVAL_SECONDS", "300"))
+# 磁盘 SQLite 文件路径，设为空字符串则只使用内存缓存
+RESEARCH_CACHE_PATH = os.getenv(
+    "RESEARCH_CACHE_PATH",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", ".cache", "research_cache.sqlite3")),
+)
+
+
+def normalize_text(text: str) -> str:
+    """归一化问题文本：全半角统一、去除首尾空白、合并连续空白、转小写。"""
+    return " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+
+
+def make_key(*parts: str) -> str:
+    """由若干字符串片段生成稳定的缓存键。"""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResearchCache:
+    """
+    两级缓存：进程内 LRU（带 TTL）+ SQLite 持久化存储。
+
+    值需可 JSON 序列化。读取时先查内存，未命中再查磁盘并回填内存；
+    磁盘读写在线程池中执行，不阻塞事件循环。写入时每隔 prune_interval 秒清理一次磁盘：
+    删除过期行，并把行数限制在 max_rows 以内（先删除最早过期的）。
+    """
+
+    def __init__(self, path: Optional[str] = RESEARCH_CACHE_PATH,
+                 ttl_seconds: float = RESEARCH_CACHE_TTL_SECONDS,
+                 max_entries: int = RESEARCH_CACHE_MAX_ENTRIES,
+                 enabled: bool = RESEARCH_CACHE_ENABLED,
+                 max_rows: int = RESEARCH_CACHE_MAX_ROWS,
+                 prune_interval: float = RESEARCH_CACHE_PRUNE_INTERVAL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.prune_interval = prune_interval
+        # 上次清理磁盘的时间（time.monotonic）；启动后的首次写入即清理一次
+        self._pruned_at: Optional[float] = None
+        self._memory: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        entry = self._memory.get((namespace, key))
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end((namespace, key))
+                return value
+            del self._memory[(namespace, key)]
+
+        if not self.path:
+            return None
+
+        try:
+            row = await asyncio.to_thread(self._db_get, namespace, key, now)
+        except Exception as e:
+            logger.warning(f"读取磁盘缓存失败: {e}")
+            return None
+        if row is None:
+            return None
+
+        expires_at, value = row
+        self._remember(namespace, key, value, expires_at)
+        return value
+
+    async def set(self, namespace: str, key: str, value: Any):
+        if not self.enabled:
+            return
+
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(namespace, key, value, expires_at)
+
+        if not self.path:
+            return
+
+        try:
+            await asyncio.to_thread(self._db_set, namespace, key, value, expires_at)
+        except Exception as e:
+            logger.warning(f"写入磁盘缓存失败: {e}")
+
+    def _remember(self, namespace: str, key: str, value: Any, expires_at: float):
+        self._memory[(namespace, key)] = (expires_at, value)
+        self._memory.move_to_end((namespace, key))
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _db_get(self, namespace: str, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        with self._db_lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+                conn.commit()
+                return None
+            return row[1], json.loads(row[0])
+
+    def _db_set(self, namespace: str, key: str, value: Any, expires_at: float):
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            now = time.monotonic()
+            if self._pruned_at is None or now - self._pruned_at >= self.prune_interval:
+                self._pruned_at = now
+                self._db_prune(conn, time.time())
+            conn.commit()
+
+    def _db_prune(self, conn: sqlite3.Connection, now: float):
+        """删除过期行；行数超过 max_rows 时删除最早过期的行（TTL 相同，即最早写入的）。"""
+        expired = conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_rows
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY expires_at LIMIT ?)",
+                (excess,),
+            )
+        if expired or excess > 0:
+            logger.info(f"清理磁盘缓存：删除过期条目 {expired} 条，超出上限条目 {max(excess, 0)} 条")
+
+
+research_cache = ResearchCache()
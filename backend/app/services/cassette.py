@@ -0,0 +1,186 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from .cache import make_key
+
+logger = logging.getLogger(__name__)
+
+# 录制/回放模式：record 录制真实模型的每次调用；replay 离线回放录制结果；留空则不启用
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "").lower()
+# 录制文件路径（gzip 压缩的 JSON Lines，每行一次调用）
+LLM_CASSETTE_PATH = os.getenv(
+    "LLM_CASSETTE_PATH",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", ".cache", "llm_cassette.jsonl.gz")),
+)
+# 回放速度倍数：1 为原始节奏，2 为两倍速，0 表示不等待
+LLM_CASSETTE_SPEED = float(os.getenv("LLM_CASSETTE_SPEED", "1"))
+# 严格匹配：回放时找不到相同输入的录制即报错；否则按录制顺序轮流使用同类录制
+LLM_CASSETTE_STRICT = os.getenv("LLM_CASSETTE_STRICT", "0").lower() not in ("0", "false", "no")
+
+# 各阶段使用不同模型时有多个录制器写入同一文件，追加操作共用一把锁
+_append_lock = threading.Lock()
+
+
+class CassetteMissError(Exception):
+    """严格回放模式下没有与本次调用输入匹配的录制。"""
+
+
+def messages_key(messages, kind: str, schema: Optional[str] = None) -> str:
+    """由调用类型、结构化 schema 与消息（角色 + 内容）生成匹配键。"""
+    parts = [kind, schema or ""]
+    for m in messages:
+        parts += [m.type, str(m.content)]
+    return make_key(*parts)
+
+
+class CassetteRecorder:
+    """
+    包装真实模型，记录每次 astream / 结构化输出调用。
+
+    流式调用逐 chunk 记录文本与距上一个 chunk 的间隔（首个间隔即首 token 延迟），
+    结构化调用记录整体耗时与结果。只有完整结束的调用才会写入录制文件。
+    """
+
+    def __init__(self, model, path: str = LLM_CASSETTE_PATH):
+        self.model = model
+        self.path = path
+        self.model_name = getattr(model, "model_name", None)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    async def astream(self, messages, **kwargs) -> AsyncIterator[AIMessageChunk]:
+        chunks: List[list] = []
+        usage = None
+        last = time.perf_counter()
+        async for chunk in self.model.astream(messages, **kwargs):
+            now = time.perf_counter()
+            chunks.append([round((now - last) * 1000, 1), chunk.content])
+            last = now
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk
+
+        await self._write({
+            "k": messages_key(messages, "stream"),
+            "t": "stream",
+            "d": chunks,
+            "u": dict(usage) if usage else None,
+        })
+
+    async def ainvoke(self, messages, **kwargs) -> AIMessage:
+        chunks = [chunk async for chunk in self.astream(messages, **kwargs)]
+        return AIMessage(content="".join(c.content for c in chunks),
+                         usage_metadata=chunks[-1].usage_metadata if chunks else None)
+
+    def with_structured_output(self, schema, **kwargs) -> "_StructuredRecorder":
+        return _StructuredRecorder(self, schema, self.model.with_structured_output(schema, **kwargs))
+
+    async def _write(self, record: Dict[str, Any]):
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        await asyncio.to_thread(self._append, line)
+
+    def _append(self, line: bytes):
+        # 每次追加一个独立的 gzip member，多 member 文件可被 gzip 连续读取
+        with _append_lock, gzip.open(self.path, "ab") as f:
+            f.write(line)
+
+
+class _StructuredRecorder:
+    def __init__(self, recorder: CassetteRecorder, schema, runnable):
+        self.recorder = recorder
+        self.schema = schema
+        self.runnable = runnable
+
+    async def ainvoke(self, messages, **kwargs):
+        started = time.perf_counter()
+        result = await self.runnable.ainvoke(messages, **kwargs)
+        await self.recorder._write({
+            "k": messages_key(messages, "structured", self.schema.__name__),
+            "t": "structured",
+            "s": self.schema.__name__,
+            "d": round((time.perf_counter() - started) * 1000, 1),
+            "v": result.model_dump(),
+        })
+        return result
+
+
+class CassettePlayer:
+    """
+    离线回放录制文件，按原始（或缩放后的）时间间隔重现流式输出。
+
+    优先使用输入完全相同的录制，同一输入录制多次时按顺序轮流使用；
+    非严格模式下找不到匹配时，按录制顺序轮流使用同类型的录制，
+    使改动过提示词或问题的新版本也能用生产录制压测。
+    """
+
+    def __init__(self, path: str = LLM_CASSETTE_PATH, speed: float = LLM_CASSETTE_SPEED,
+                 strict: bool = LLM_CASSETTE_STRICT):
+        self.path = path
+        self.speed = speed
+        self.strict = strict
+        self.model_name = "cassette"
+        self._by_key: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._by_kind: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._by_key[record["k"]].append(record)
+                    self._by_kind[self._kind(record)].append(record)
+        logger.info(f"已加载 LLM 录制 {path}：{sum(len(q) for q in self._by_kind.values())} 次调用")
+
+    async def astream(self, messages, **kwargs) -> AsyncIterator[AIMessageChunk]:
+        record = self._take(messages_key(messages, "stream"), "stream")
+        for delay_ms, text in record["d"]:
+            await self._sleep(delay_ms)
+            yield AIMessageChunk(content=text)
+        if record.get("u"):
+            yield AIMessageChunk(content="", usage_metadata=record["u"])
+
+    async def ainvoke(self, messages, **kwargs) -> AIMessage:
+        chunks = [chunk async for chunk in self.astream(messages, **kwargs)]
+        return AIMessage(content="".join(c.content for c in chunks),
+                         usage_metadata=chunks[-1].usage_metadata if chunks else None)
+
+    def with_structured_output(self, schema, **kwargs) -> "_StructuredPlayer":
+        return _StructuredPlayer(self, schema)
+
+    def _take(self, key: str, kind: str) -> Dict[str, Any]:
+        records = self._by_key.get(key)
+        if not records:
+            if self.strict or not self._by_kind.get(kind):
+                raise CassetteMissError(f"录制中没有匹配的 {kind} 调用: {key[:12]}")
+            logger.debug(f"录制中没有完全匹配的 {kind} 调用，按顺序使用同类录制")
+            records = self._by_kind[kind]
+        record = records.popleft()
+        records.append(record)
+        return record
+
+    async def _sleep(self, delay_ms: float):
+        if self.speed > 0 and delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000 / self.speed)
+
+    @staticmethod
+    def _kind(record: Dict[str, Any]) -> str:
+        return f"structured:{record['s']}" if record["t"] == "structured" else record["t"]
+
+
+class _StructuredPlayer:
+    def __init__(self, player: CassettePlayer, schema):
+        self.player = player
+        self.schema = schema
+
+    async def ainvoke(self, messages, **kwargs):
+        name = self.schema.__name__
+        record = self.player._take(messages_key(messages, "structured", name), f"structured:{name}")
+        await self.player._sleep(record["d"])
+        return self.schema(**record["v"])
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 是否持久化研究运行的阶段结果（规划、子问题草稿、报告），用于失败后按 run_id 重试
+RUN_CHECKPOINT_ENABLED = os.getenv("RUN_CHECKPOINT_ENABLED", "1").lower() not in ("0", "false", "no")
+# 检查点保留时间（秒）
+RUN_CHECKPOINT_TTL_SECONDS = float(os.getenv("RUN_CHECKPOINT_TTL_SECONDS", "86400"))
+# SQLite 文件路径
+RUN_CHECKPOINT_PATH = os.getenv(
+    "RUN_CHECKPOINT_PATH",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", ".cache", "run_checkpoints.sqlite3")),
+)
+
+
+class RunCheckpoint:
+    """
+    单次研究运行的检查点：阶段名 -> 结果。
+
+    读操作直接访问内存中的值；save 同时写入内存与 CheckpointStore。
+    """
+
+    def __init__(self, run_id: str, store: "CheckpointStore", values: Optional[Dict[str, Any]] = None):
+        self.run_id = run_id
+        self.store = store
+        self.values: Dict[str, Any] = values or {}
+
+    @property
+    def restored(self) -> bool:
+        """是否有可复用的阶段结果（除问题本身及其延迟预算外）。"""
+        return any(name not in ("question", "deadline_ms") for name in self.values)
+
+    def get(self, name: str) -> Optional[Any]:
+        return self.values.get(name)
+
+    async def save(self, name: str, value: Any):
+        self.values[name] = value
+        await self.store.save(self.run_id, name, value)
+
+
+class CheckpointStore:
+    """
+    基于 SQLite 的阶段检查点存储，以 (run_id, 阶段名) 为键，值需可 JSON 序列化。
+
+    磁盘读写在线程池中执行，不阻塞事件循环；写入失败只记录日志，不影响研究本身。
+    """
+
+    def __init__(self, path: str = RUN_CHECKPOINT_PATH,
+                 ttl_seconds: float = RUN_CHECKPOINT_TTL_SECONDS,
+                 enabled: bool = RUN_CHECKPOINT_ENABLED):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled and bool(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    async def open(self, run_id: str, question: str, deadline_ms: Optional[int] = None) -> RunCheckpoint:
+        """加载运行已有的检查点；首次运行时记录问题与延迟预算，供进程重启后按 run_id 重试。"""
+        checkpoint = RunCheckpoint(run_id, self, await self.load(run_id))
+        if checkpoint.get("question") is None:
+            await checkpoint.save("question", question)
+            if deadline_ms is not None:
+                await checkpoint.save("deadline_ms", deadline_ms)
+        return checkpoint
+
+    async def load(self, run_id: str) -> Dict[str, Any]:
+        if not self.enabled:
+            return {}
+        try:
+            return await asyncio.to_thread(self._db_load, run_id, time.time())
+        except Exception as e:
+            logger.warning(f"读取检查点失败: {e}")
+            return {}
+
+    async def save(self, run_id: str, name: str, value: Any):
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._db_save, run_id, name, value, time.time() + self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"写入检查点失败: {e}")
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "run_id TEXT NOT NULL, name TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, PRIMARY KEY (run_id, name))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _db_load(self, run_id: str, now: float) -> Dict[str, Any]:
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM checkpoints WHERE expires_at <= ?", (now,))
+            conn.commit()
+            rows = conn.execute(
+                "SELECT name, value FROM checkpoints WHERE run_id = ?", (run_id,)
+            ).fetchall()
+            return {name: json.loads(value) for name, value in rows}
+
+    def _db_save(self, run_id: str, name: str, value: Any, expires_at: float):
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (run_id, name, value, expires_at) VALUES (?, ?, ?, ?)",
+                (run_id, name, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            conn.commit()
+
+
+checkpoint_store = CheckpointStore()
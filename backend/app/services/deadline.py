@@ -0,0 +1,113 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# 带截止时间（deadline_ms）的研究中，为报告阶段预留的预算比例；研究阶段必须在此之前结束
+DEADLINE_REPORT_RESERVE = min(max(float(os.getenv("DEADLINE_REPORT_RESERVE", "0.35")), 0.05), 0.9)
+# 规划阶段的预算比例：规划说明的流式输出在此之前结束，也用于估计研究阶段窗口以决定子问题数
+DEADLINE_PLAN_SHARE = min(max(float(os.getenv("DEADLINE_PLAN_SHARE", "0.15")), 0.0), 0.5)
+# 写一份草稿所需的最短时间（秒）；研究窗口内按 RESEARCH_MAX_CONCURRENCY 一批批研究，
+# 容不下的子问题直接舍弃
+DEADLINE_MIN_DRAFT_SECONDS = float(os.getenv("DEADLINE_MIN_DRAFT_SECONDS", "5"))
+# 估计的上游输出速率（token/秒），用于把剩余时间换算为 max_tokens 上限
+DEADLINE_TOKENS_PER_SECOND = float(os.getenv("DEADLINE_TOKENS_PER_SECOND", "40"))
+# max_tokens 的下限，避免时间很紧时输出过短而失去意义
+DEADLINE_MIN_OUTPUT_TOKENS = int(os.getenv("DEADLINE_MIN_OUTPUT_TOKENS", "64"))
+
+
+class ResearchBudget:
+    """
+    单次研究的延迟预算：从创建起 deadline_ms 毫秒内给出报告。
+
+    预算按阶段分配：规划说明在 DEADLINE_PLAN_SHARE 内结束，报告阶段预留
+    DEADLINE_REPORT_RESERVE，中间的时间用于研究。研究阶段据此限制子问题数量、为每份草稿设置 max_tokens，并在研究截止时间到达时
+    停止仍在生成的草稿；报告阶段按剩余时间设置 max_tokens，到达截止时间时停止输出。
+    summary() 汇总各阶段耗时与降级情况，附在 complete 帧中。
+    """
+
+    def __init__(self, deadline_ms: int, concurrency: int = 1):
+        self.deadline_ms = deadline_ms
+        self.concurrency = max(1, concurrency)
+        self.started = time.monotonic()
+        self.deadline = self.started + deadline_ms / 1000
+        self.plan_deadline = self.started + deadline_ms / 1000 * DEADLINE_PLAN_SHARE
+        self.research_deadline = self.started + deadline_ms / 1000 * (1 - DEADLINE_REPORT_RESERVE)
+        self.stages: Dict[str, float] = {}
+        self.max_questions: Optional[int] = None
+        self.dropped_questions = 0
+        self.truncated_drafts = 0
+        self.skipped_drafts = 0
+        self.truncated_plan = False
+        self.truncated_report = False
+
+    @property
+    def degraded(self) -> bool:
+        """是否因预算舍弃或截断了内容；降级的结果不写入缓存和检查点。"""
+        return bool(self.dropped_questions or self.truncated_drafts or self.skipped_drafts or self.truncated_report)
+
+    def remaining(self, until: Optional[float] = None) -> float:
+        """距截止时间（默认为整体截止时间）的剩余秒数，可能为负。"""
+        return (until or self.deadline) - time.monotonic()
+
+    def research_expired(self) -> bool:
+        return self.remaining(self.research_deadline) <= 0
+
+    def question_limit(self, planned: bool = True) -> int:
+        """
+        研究窗口内能容纳的子问题数（至少 1 个）。
+
+        planned 为 False 时（流水线模式在规划开始前计算）先扣除规划阶段的估计耗时。
+        """
+        window = self.remaining(self.research_deadline)
+        if not planned:
+            window -= self.deadline_ms / 1000 * DEADLINE_PLAN_SHARE
+        waves = int(window // DEADLINE_MIN_DRAFT_SECONDS) if DEADLINE_MIN_DRAFT_SECONDS > 0 else 1
+        self.max_questions = max(1, waves * self.concurrency)
+        return self.max_questions
+
+    def max_tokens(self, until: Optional[float] = None) -> int:
+        """按到截止时间为止的剩余时间估算输出 token 上限。"""
+        seconds = max(self.remaining(until), 0)
+        return max(int(seconds * DEADLINE_TOKENS_PER_SECOND), DEADLINE_MIN_OUTPUT_TOKENS)
+
+    @contextmanager
+    def stage(self, name: str):
+        """记录阶段耗时（包括异常退出）。"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.monotonic() - started
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        return {
+            "deadline_ms": self.deadline_ms,
+            "elapsed_ms": round(elapsed * 1000),
+            "remaining_ms": round(self.remaining() * 1000),
+            "met": elapsed * 1000 <= self.deadline_ms,
+            "stages_ms": {name: round(seconds * 1000) for name, seconds in self.stages.items()},
+            "report_reserve_ms": round(self.deadline_ms * DEADLINE_REPORT_RESERVE),
+            "max_questions": self.max_questions,
+            "truncated_plan": self.truncated_plan,
+            "dropped_questions": self.dropped_questions,
+            "truncated_drafts": self.truncated_drafts,
+            "skipped_drafts": self.skipped_drafts,
+            "truncated_report": self.truncated_report,
+        }
+
+
+def parse_deadline_ms(value: Any) -> Optional[int]:
+    """解析客户端传入的 deadline_ms；未提供时返回 None，非正整数时抛出 ValueError。"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("deadline_ms 必须是正整数（毫秒）")
+    try:
+        deadline_ms = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("deadline_ms 必须是正整数（毫秒）")
+    if deadline_ms <= 0 or isinstance(value, float) and value != deadline_ms:
+        raise ValueError("deadline_ms 必须是正整数（毫秒）")
+    return deadline_ms
@@ -0,0 +1,288 @@
+import os
+import time
+import random
+import logging
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from langchain_core.messages import AIMessage, HumanMessage
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# 上游端点池：逗号分隔的 OpenAI 兼容 API 地址，每项可写作 "地址|API Key|模型名"，
+# 省略的部分沿用 DEEPSEEK_API_KEY / DEEPSEEK_CHAT_MODEL；留空时只使用 DEEPSEEK_BASE_URL
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+# 延迟与错误率的指数加权平均系数，越大越偏向最近的调用
+LLM_ENDPOINT_EWMA_ALPHA = min(max(float(os.getenv("LLM_ENDPOINT_EWMA_ALPHA", "0.2")), 0.01), 1.0)
+# 熔断：连续失败达到该次数后暂停向端点路由
+LLM_ENDPOINT_FAILURE_THRESHOLD = max(1, int(os.getenv("LLM_ENDPOINT_FAILURE_THRESHOLD", "3")))
+# 熔断持续时间（秒），之后放行一次试探请求（半开），成功则恢复
+LLM_ENDPOINT_COOLDOWN_SECONDS = float(os.getenv("LLM_ENDPOINT_COOLDOWN_SECONDS", "30"))
+# 单次调用最多尝试的端点数（含流式中断后的续写）
+LLM_ENDPOINT_MAX_ATTEMPTS = max(1, int(os.getenv("LLM_ENDPOINT_MAX_ATTEMPTS", "3")))
+
+# 流式输出中断后在另一个端点续写时追加的指令
+CONTINUE_PROMPT = "上面的回答因网络中断被截断了。请从中断处直接接着写，不要重复已经输出的内容，也不要添加任何说明。"
+
+LLM_ENDPOINT_REQUESTS = registry.counter(
+    "llm_endpoint_requests_total", "各上游端点的调用数（outcome 为 success / error）",
+    ("endpoint", "outcome"))
+LLM_ENDPOINT_FAILOVERS = registry.counter(
+    "llm_endpoint_failovers_total", "调用失败后改用其他端点重试的次数（midstream 为流式输出中途失败后续写）",
+    ("kind",))
+
+
+class EndpointSpec:
+    """端点池中的一个上游端点。"""
+
+    def __init__(self, base_url: str, api_key: Optional[str], model: str):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+
+    @property
+    def label(self) -> str:
+        """指标与日志中的端点名（主机名 + 端口）。"""
+        return urlparse(self.base_url).netloc or self.base_url
+
+
+def parse_endpoints(spec: str, default_api_key: Optional[str], default_model: str) -> List[EndpointSpec]:
+    endpoints = []
+    for item in spec.split(","):
+        parts = [part.strip() for part in item.strip().split("|")]
+        if not parts[0]:
+            continue
+        api_key = parts[1] if len(parts) > 1 and parts[1] else default_api_key
+        model = parts[2] if len(parts) > 2 and parts[2] else default_model
+        endpoints.append(EndpointSpec(parts[0], api_key, model))
+    return endpoints
+
+
+def retryable(error: BaseException) -> bool:
+    """
+    调用失败是否应计入端点健康状态并改用其他端点重试：连接错误、超时、5xx 与 429。
+    其他 4xx（请求格式错误、超出上下文长度、鉴权失败等）换端点也不会成功，应直接抛出。
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    try:
+        # openai 只在真正创建模型时才会导入，这里按需加载
+        from openai import APIConnectionError
+    except ImportError:
+        return False
+    return isinstance(error, APIConnectionError)
+
+
+class EndpointHealth:
+    """
+    端点的被动健康状态，由实际调用的结果更新：
+
+    - 延迟：流式调用首 token 延迟的 EWMA
+    - 错误率：每次调用成功记 0、失败记 1 的 EWMA
+    - 熔断器：连续失败 LLM_ENDPOINT_FAILURE_THRESHOLD 次后打开（不再路由），
+      冷却 LLM_ENDPOINT_COOLDOWN_SECONDS 后半开，只放行一次试探请求，成功即关闭，失败则重新打开
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < LLM_ENDPOINT_COOLDOWN_SECONDS:
+            return "open"
+        return "half_open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or state == "half_open" and not self.trial_in_flight
+
+    def begin(self):
+        self.requests += 1
+        if self.state == "half_open":
+            self.trial_in_flight = True
+
+    def end(self):
+        """调用结束（包括被取消）时释放半开状态的试探名额。"""
+        self.trial_in_flight = False
+
+    def record_success(self, latency: Optional[float] = None):
+        if latency is not None:
+            self.latency = latency if self.latency is None else (
+                LLM_ENDPOINT_EWMA_ALPHA * latency + (1 - LLM_ENDPOINT_EWMA_ALPHA) * self.latency
+            )
+        self.error_rate *= 1 - LLM_ENDPOINT_EWMA_ALPHA
+        self.consecutive_failures = 0
+        if self.opened_at is not None:
+            logger.info(f"上游端点 {self.label} 恢复，关闭熔断")
+        self.opened_at = None
+        LLM_ENDPOINT_REQUESTS.inc(endpoint=self.label, outcome="success")
+
+    def record_failure(self):
+        self.failures += 1
+        self.error_rate = LLM_ENDPOINT_EWMA_ALPHA + (1 - LLM_ENDPOINT_EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures += 1
+        if self.state == "half_open" or (
+            self.opened_at is None and self.consecutive_failures >= LLM_ENDPOINT_FAILURE_THRESHOLD
+        ):
+            logger.warning(f"上游端点 {self.label} 连续失败 {self.consecutive_failures} 次，熔断 {LLM_ENDPOINT_COOLDOWN_SECONDS:.0f} 秒")
+            self.opened_at = time.monotonic()
+        LLM_ENDPOINT_REQUESTS.inc(endpoint=self.label, outcome="error")
+
+    def expected_latency(self, fallback: float) -> float:
+        """路由打分：EWMA 延迟按错误率放大；尚无样本时用 fallback（通常为已知最快端点的延迟）。"""
+        latency = self.latency if self.latency is not None else fallback
+        return max(latency, 0.001) * (1 + 4 * self.error_rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.label,
+            "state": self.state,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+# 端点地址 -> 健康状态；不同阶段的端点池共享同一个端点的健康状态
+_health: Dict[str, EndpointHealth] = {}
+_health_lock = threading.Lock()
+
+
+def health_for(spec: EndpointSpec) -> EndpointHealth:
+    with _health_lock:
+        health = _health.get(spec.base_url)
+        if health is None:
+            health = _health[spec.base_url] = EndpointHealth(spec.label)
+        return health
+
+
+def endpoint_status() -> List[Dict[str, Any]]:
+    return [health.snapshot() for health in list(_health.values())]
+
+
+registry.gauge(
+    "llm_endpoints_open", "熔断中（open）的上游端点数",
+    lambda: sum(1 for health in list(_health.values()) if health.state == "open"))
+
+
+class EndpointPool:
+    """
+    由多个 OpenAI 兼容端点组成的聊天模型，实现 research.py 用到的 astream / ainvoke /
+    with_structured_output。
+
+    每次调用按健康状态加权随机选择端点（权重与预期延迟成反比，熔断中的端点不参与）；
+    调用因连接错误、超时、5xx 或 429 失败时改用其他端点重试，其他错误直接抛出且不影响熔断器。流式输出中途失败时，已产出的文本保留（已发送给客户端），
+    在另一个端点上把已输出部分作为助手消息、要求从中断处续写，之后的 chunk 接在后面。
+    """
+
+    def __init__(self, endpoints: List[Tuple[EndpointSpec, Any]], model_name: str,
+                 max_attempts: int = LLM_ENDPOINT_MAX_ATTEMPTS):
+        self.endpoints = [(health_for(spec), client) for spec, client in endpoints]
+        self.model_name = model_name
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def build(cls, specs: List[EndpointSpec], factory: Callable[[EndpointSpec], Any],
+              model_name: str) -> "EndpointPool":
+        return cls([(spec, factory(spec)) for spec in specs], model_name)
+
+    def choose(self, tried: Set[str]) -> Tuple[EndpointHealth, Any]:
+        """选择一个端点：优先未尝试过且可用的端点；都不可用时选择最早熔断的（最可能已恢复）。"""
+        candidates = [(h, c) for h, c in self.endpoints if h.label not in tried and h.available()]
+        if not candidates:
+            untried = [(h, c) for h, c in self.endpoints if h.label not in tried] or self.endpoints
+            return min(untried, key=lambda item: item[0].opened_at or 0)
+        known = [h.latency for h, _ in candidates if h.latency is not None]
+        fallback = min(known) if known else 1.0
+        weights = [1 / h.expected_latency(fallback) for h, _ in candidates]
+        return random.choices(candidates, weights=weights)[0]
+
+    async def astream(self, messages, **kwargs) -> AsyncIterator[Any]:
+        sent = ""
+        tried: Set[str] = set()
+        for attempt in range(1, self.max_attempts + 1):
+            health, client = self.choose(tried)
+            tried.add(health.label)
+            request = messages if not sent else list(messages) + [
+                AIMessage(content=sent), HumanMessage(content=CONTINUE_PROMPT),
+            ]
+            started = time.monotonic()
+            first_token: Optional[float] = None
+            health.begin()
+            try:
+                async for chunk in client.astream(request, **kwargs):
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                    sent += chunk.content
+                    yield chunk
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                health.record_failure()
+                if attempt >= self.max_attempts:
+                    raise
+                kind = "midstream" if sent else "stream"
+                LLM_ENDPOINT_FAILOVERS.inc(kind=kind)
+                logger.warning(f"上游端点 {health.label} 调用失败（已输出 {len(sent)} 字）: {e}，改用其他端点")
+                continue
+            finally:
+                health.end()
+            health.record_success(first_token)
+            return
+
+    async def ainvoke(self, messages, **kwargs) -> AIMessage:
+        chunks = [chunk async for chunk in self.astream(messages, **kwargs)]
+        return AIMessage(content="".join(c.content for c in chunks),
+                         usage_metadata=getattr(chunks[-1], "usage_metadata", None) if chunks else None)
+
+    def with_structured_output(self, schema, **kwargs) -> "_StructuredPool":
+        return _StructuredPool(self, schema, kwargs)
+
+
+class _StructuredPool:
+    def __init__(self, pool: EndpointPool, schema, options: Dict[str, Any]):
+        self.pool = pool
+        self.schema = schema
+        self.options = options
+
+    async def ainvoke(self, messages, **kwargs):
+        tried: Set[str] = set()
+        for attempt in range(1, self.pool.max_attempts + 1):
+            health, client = self.pool.choose(tried)
+            tried.add(health.label)
+            health.begin()
+            try:
+                result = await client.with_structured_output(self.schema, **self.options).ainvoke(messages, **kwargs)
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                health.record_failure()
+                if attempt >= self.pool.max_attempts:
+                    raise
+                LLM_ENDPOINT_FAILOVERS.inc(kind="structured")
+                logger.warning(f"上游端点 {health.label} 结构化调用失败: {e}，改用其他端点")
+                continue
+            finally:
+                health.end()
+            health.record_success()
+            return result
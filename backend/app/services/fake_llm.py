@@ -0,0 +1,128 @@
+import os
+import random
+import asyncio
+import typing
+from typing import Any, AsyncIterator, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk, SystemMessage
+
+# 离线假模型的延迟与输出配置，用于压测和本地开发，不消耗真实 token
+FAKE_LLM_TTFT_MS = float(os.getenv("FAKE_LLM_TTFT_MS", "300"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50"))
+FAKE_LLM_OUTPUT_TOKENS = int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "200"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_SEED = os.getenv("FAKE_LLM_SEED")
+# 模拟上游首 token 卡顿：每次流式调用以 FAKE_LLM_STALL_RATE 的概率额外等待 FAKE_LLM_STALL_MS
+FAKE_LLM_STALL_RATE = float(os.getenv("FAKE_LLM_STALL_RATE", "0"))
+FAKE_LLM_STALL_MS = float(os.getenv("FAKE_LLM_STALL_MS", "5000"))
+
+_FILLER = "这是离线假模型生成的示例文本，用于压测流式链路的吞吐与延迟。"
+
+
+class FakeLLMError(Exception):
+    """假模型按配置的错误率模拟的上游失败（视为 503，会触发端点池的故障转移）。"""
+
+    status_code = 503
+
+
+class FakeChatModel:
+    """
+    模拟流式聊天模型，实现 research.py 用到的 astream / ainvoke / with_structured_output。
+
+    首 token 延迟、输出速率、输出长度、错误率和首 token 卡顿均可配置。规划类提示词会输出
+    "【子问题N】" 行，使单次调用规划和流水线模式也能正常解析。
+    """
+
+    def __init__(self, ttft_ms: float = FAKE_LLM_TTFT_MS,
+                 tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND,
+                 output_tokens: int = FAKE_LLM_OUTPUT_TOKENS,
+                 error_rate: float = FAKE_LLM_ERROR_RATE,
+                 seed: Optional[str] = FAKE_LLM_SEED,
+                 stall_rate: float = FAKE_LLM_STALL_RATE,
+                 stall_ms: float = FAKE_LLM_STALL_MS):
+        self.ttft = ttft_ms / 1000
+        self.token_interval = 1 / tokens_per_second if tokens_per_second > 0 else 0
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall = stall_ms / 1000
+        self.model_name = "fake"
+        self._random = random.Random(seed)
+
+    async def astream(self, messages, **kwargs) -> AsyncIterator[AIMessageChunk]:
+        all_tokens = self._tokens(messages)
+        tokens = all_tokens[:kwargs.get("max_tokens")]
+        fail_at = self._fail_at(len(tokens))
+        stalled = self.stall_rate > 0 and self._random.random() < self.stall_rate
+        await asyncio.sleep(self.ttft + (self.stall if stalled else 0))
+
+        for i, token in enumerate(tokens):
+            if i == fail_at:
+                raise FakeLLMError("假模型模拟的上游错误")
+            if i:
+                await asyncio.sleep(self.token_interval)
+            yield AIMessageChunk(content=token)
+
+        # 与 OpenAI 兼容接口一致：最后一个 chunk 带结束原因，被 max_tokens 截断时为 length
+        finish_reason = "length" if len(tokens) < len(all_tokens) else "stop"
+        yield AIMessageChunk(content="", usage_metadata=self._usage(messages, tokens),
+                             response_metadata={"finish_reason": finish_reason})
+
+    async def ainvoke(self, messages, **kwargs) -> AIMessage:
+        tokens = self._tokens(messages)[:kwargs.get("max_tokens")]
+        if self._fail_at(len(tokens)) is not None:
+            await asyncio.sleep(self.ttft)
+            raise FakeLLMError("假模型模拟的上游错误")
+        await asyncio.sleep(self.ttft + self.token_interval * max(len(tokens) - 1, 0))
+        return AIMessage(content="".join(tokens), usage_metadata=self._usage(messages, tokens))
+
+    def with_structured_output(self, schema, **kwargs) -> "_FakeStructuredModel":
+        return _FakeStructuredModel(self, schema)
+
+    def _tokens(self, messages) -> List[str]:
+        system = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+        lines: List[str] = []
+        if "规划" in system and "子问题" in system:
+            lines = ["我将围绕以下子问题展开研究：\n"] + [
+                f"【子问题{i}】{self._sentence(i)}\n" for i in range(1, 4)
+            ]
+        text = "".join(lines)
+        body_tokens = max(self.output_tokens - len(text) // 2, 0)
+        tokens = [text[i:i + 2] for i in range(0, len(text), 2)]
+        tokens += [_FILLER[(i * 2) % len(_FILLER):(i * 2) % len(_FILLER) + 2] for i in range(body_tokens)]
+        return tokens
+
+    def _sentence(self, i: int) -> str:
+        return f"示例子问题 {i}：{_FILLER[:12]}（{self._random.randint(1000, 9999)}）"
+
+    def _fail_at(self, length: int) -> Optional[int]:
+        if self.error_rate <= 0 or self._random.random() >= self.error_rate:
+            return None
+        return self._random.randrange(max(length, 1))
+
+    @staticmethod
+    def _usage(messages, tokens: List[str]) -> dict:
+        input_tokens = sum(len(str(m.content)) for m in messages) // 2
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": len(tokens),
+            "total_tokens": input_tokens + len(tokens),
+        }
+
+
+class _FakeStructuredModel:
+    """with_structured_output 的假实现：按 schema 字段类型填充示例值。"""
+
+    def __init__(self, model: FakeChatModel, schema):
+        self.model = model
+        self.schema = schema
+
+    async def ainvoke(self, messages, **kwargs) -> Any:
+        await self.model.ainvoke(messages)
+        values = {}
+        for name, field in self.schema.model_fields.items():
+            if typing.get_origin(field.annotation) in (list, List):
+                values[name] = [self.model._sentence(i) for i in range(1, 4)]
+            else:
+                values[name] = self.model._sentence(1)
+        return self.schema(**values)
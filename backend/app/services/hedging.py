@@ -0,0 +1,165 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# 是否对流式 LLM 调用启用对冲请求：首个 chunk 迟迟未到时再发一次相同请求，先出 token 的一方胜出
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0").lower() not in ("0", "false", "no")
+# 启用对冲的阶段（逗号分隔）
+LLM_HEDGE_STAGES = frozenset(
+    stage.strip() for stage in os.getenv("LLM_HEDGE_STAGES", "plan,research").split(",") if stage.strip()
+)
+# 固定的对冲阈值（毫秒）；设为 0 时使用各阶段最近首 token 延迟的分位数
+LLM_HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS", "0"))
+# 动态阈值使用的分位数
+LLM_HEDGE_QUANTILE = min(max(float(os.getenv("LLM_HEDGE_QUANTILE", "0.9")), 0.5), 0.999)
+# 计算分位数的滑动窗口大小（最近的调用数），样本不足 LLM_HEDGE_MIN_SAMPLES 时使用 LLM_HEDGE_DEFAULT_MS
+LLM_HEDGE_WINDOW = max(10, int(os.getenv("LLM_HEDGE_WINDOW", "200")))
+LLM_HEDGE_MIN_SAMPLES = max(1, int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")))
+LLM_HEDGE_DEFAULT_MS = float(os.getenv("LLM_HEDGE_DEFAULT_MS", "2000"))
+# 动态阈值的下限（毫秒），避免正常波动也触发对冲
+LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "500"))
+
+LLM_HEDGED_CALLS = registry.counter(
+    "llm_hedged_calls_total", "首 token 超过阈值而发出对冲请求的流式调用数",
+    ("stage", "model"))
+LLM_HEDGES_SKIPPED = registry.counter(
+    "llm_hedges_skipped_total", "首 token 超过阈值、但调度器没有空闲名额而放弃对冲的流式调用数",
+    ("stage", "model"))
+LLM_HEDGE_WINS = registry.counter(
+    "llm_hedge_wins_total", "对冲调用中先产出首个 chunk 的一方（primary 为原请求，hedge 为对冲请求）",
+    ("stage", "model", "winner"))
+
+
+class TTFTTracker:
+    """按阶段记录最近的首 token 延迟，给出对冲阈值。"""
+
+    def __init__(self, window: int = LLM_HEDGE_WINDOW, quantile: float = LLM_HEDGE_QUANTILE):
+        self.window = window
+        self.quantile = quantile
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, stage: str, seconds: float):
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def threshold(self, stage: str) -> float:
+        """对冲阈值（秒）：固定阈值，或最近首 token 延迟的分位数（不低于 LLM_HEDGE_MIN_MS）。"""
+        if LLM_HEDGE_AFTER_MS > 0:
+            return LLM_HEDGE_AFTER_MS / 1000
+        samples = self._samples.get(stage)
+        if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_MS / 1000
+        ordered = sorted(samples)
+        value = ordered[min(int(len(ordered) * self.quantile), len(ordered) - 1)]
+        return max(value, LLM_HEDGE_MIN_MS / 1000)
+
+
+ttft_tracker = TTFTTracker()
+
+
+def should_hedge(stage: str) -> bool:
+    return LLM_HEDGE_ENABLED and stage in LLM_HEDGE_STAGES
+
+
+def _failed(task: asyncio.Task) -> bool:
+    """等待首个 chunk 的任务是否以错误结束（流正常结束不算失败）。"""
+    error = task.exception()
+    return error is not None and not isinstance(error, StopAsyncIteration)
+
+
+async def _close(stream: AsyncIterator, task: Optional[asyncio.Task] = None):
+    """取消等待首个 chunk 的任务并关闭流，释放上游连接。"""
+    if task is not None and not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    try:
+        await stream.aclose()
+    except Exception as e:
+        logger.debug(f"关闭对冲流失败: {e}")
+
+
+async def hedged_stream(start: Callable[[], AsyncIterator], delay: float, stage: str = "", model: str = "",
+                        admit_hedge: Optional[Callable[[], Optional[Callable[[], None]]]] = None) -> AsyncIterator[Any]:
+    """
+    对冲流式调用：start() 发起一次流式请求；delay 秒内没有收到首个 chunk 时再调用一次，
+    两个流中先产出首个 chunk 的一方胜出，另一方被取消，之后只转发胜出方的 chunk。
+    落败方在胜出方的首个 chunk 发出之后才等待关闭，其清理耗时不计入首 token 延迟。
+
+    一方在首个 chunk 之前失败时继续等待另一方；两方都失败时抛出错误。
+    对冲请求需要单独的准入：发出前调用 admit_hedge()，返回释放函数时才发出对冲请求，
+    并在落败方关闭、只剩一个上游请求后释放；返回 None（如调度器没有空闲名额）时不对冲，继续等待原请求。
+    """
+    primary = start()
+    primary_task = asyncio.ensure_future(primary.__anext__())
+    streams = {primary_task: (primary, "primary")}
+    release_hedge: Optional[Callable[[], None]] = None
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if not done:
+            release_hedge = admit_hedge() if admit_hedge is not None else lambda: None
+            if release_hedge is None:
+                LLM_HEDGES_SKIPPED.inc(stage=stage, model=model)
+                logger.info(f"{stage} 阶段首 token 超过 {delay * 1000:.0f} ms，但没有空闲的调用名额，不发出对冲请求")
+            else:
+                LLM_HEDGED_CALLS.inc(stage=stage, model=model)
+                hedge = start()
+                hedge_task = asyncio.ensure_future(hedge.__anext__())
+                streams[hedge_task] = (hedge, "hedge")
+                logger.info(f"{stage} 阶段首 token 超过 {delay * 1000:.0f} ms，发出对冲请求")
+
+        pending = set(streams)
+        winner_task = None
+        while winner_task is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if not _failed(task)]
+            if succeeded:
+                winner_task = succeeded[0]
+            elif not pending:
+                # 两方都在首个 chunk 前失败，抛出最后失败一方的错误
+                winner_task = done.pop()
+    except BaseException:
+        for task, (stream, _) in streams.items():
+            await _close(stream, task)
+        if release_hedge is not None:
+            release_hedge()
+        raise
+
+    winner, role = streams[winner_task]
+    losers = [(stream, task) for task, (stream, _) in streams.items() if task is not winner_task]
+    # 先只发出取消（不等待），落败方的清理放到胜出方首个 chunk 发出之后
+    for _, task in losers:
+        task.cancel()
+    if len(streams) > 1 and not _failed(winner_task):
+        LLM_HEDGE_WINS.inc(stage=stage, model=model, winner=role)
+
+    async def close_losers():
+        nonlocal release_hedge
+        while losers:
+            stream, task = losers.pop()
+            await _close(stream, task)
+        # 落败方已关闭，剩下的一个上游请求由调用方的准入名额覆盖
+        if release_hedge is not None:
+            release_hedge()
+            release_hedge = None
+
+    try:
+        try:
+            first = winner_task.result()
+        except StopAsyncIteration:
+            return
+        # 落败方取消较慢时也不拖慢首 token
+        yield first
+        await close_losers()
+        async for chunk in winner:
+            yield chunk
+    finally:
+        await close_losers()
+        await _close(winner)
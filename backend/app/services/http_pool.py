@@ -0,0 +1,323 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter as TallyCounter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# LLM 上游调用共用的 HTTP 客户端：每个进程一个 httpx.AsyncClient，所有模型客户端（含端点池、各阶段客户端）共享；
+# 连接池按事件循环分开（连接绑定创建它的事件循环），同一事件循环内的调用复用连接
+# 连接池的最大连接数，应不小于 LLM 调用的并发上限
+LLM_HTTP_MAX_CONNECTIONS = max(1, int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100")))
+# 最多保留的空闲 keep-alive 连接数
+LLM_HTTP_MAX_KEEPALIVE = max(0, int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20")))
+# 空闲连接保留时间（秒），超过后关闭
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+# 是否启用 HTTP/2（需要安装 h2：pip install "httpx[http2]"），未安装时退回 HTTP/1.1
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "0").lower() not in ("0", "false", "no")
+# 超时（秒）：建立连接、读取（两个 chunk 之间的最长间隔）、写入、等待连接池空闲连接
+LLM_HTTP_CONNECT_TIMEOUT = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10"))
+LLM_HTTP_READ_TIMEOUT = float(os.getenv("LLM_HTTP_READ_TIMEOUT", "120"))
+LLM_HTTP_WRITE_TIMEOUT = float(os.getenv("LLM_HTTP_WRITE_TIMEOUT", "30"))
+LLM_HTTP_POOL_TIMEOUT = float(os.getenv("LLM_HTTP_POOL_TIMEOUT", "30"))
+# 提前关闭的响应（如 OpenAI SDK 读到 data: [DONE] 即关闭流，HTTP/1.1 的分块结束标记尚未读取）在关闭前
+# 最多继续读取的时间（毫秒）与字节数；读完的连接回到池中复用，超出则关闭连接。设为 0 关闭该行为
+LLM_HTTP_DRAIN_MS = float(os.getenv("LLM_HTTP_DRAIN_MS", "100"))
+LLM_HTTP_DRAIN_BYTES = int(os.getenv("LLM_HTTP_DRAIN_BYTES", "65536"))
+# 启动时为每个上游地址预先建立的连接数，设为 0 关闭预热
+LLM_HTTP_WARMUP_CONNECTIONS = max(0, int(os.getenv("LLM_HTTP_WARMUP_CONNECTIONS", "2")))
+# 预热的最长等待时间（秒），超时不影响启动
+LLM_HTTP_WARMUP_TIMEOUT = float(os.getenv("LLM_HTTP_WARMUP_TIMEOUT", "5"))
+
+LLM_HTTP_REQUESTS = registry.counter(
+    "llm_http_requests_total", "发往 LLM 上游的 HTTP 请求数（connection 为 reused 复用连接 / new 新建连接）",
+    ("connection", "http_version"))
+LLM_HTTP_CONNECT = registry.histogram(
+    "llm_http_connect_seconds", "新建上游连接的耗时（TCP 连接 + TLS 握手）")
+
+
+class PoolStats:
+    """连接复用统计：新建连接的请求数、复用连接的请求数、各 HTTP 版本的请求数。"""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.reused = 0
+        self.connect_seconds = 0.0
+        self.http_versions: TallyCounter = TallyCounter()
+        self.warmed_up = 0
+
+    def record(self, trace: "_RequestTrace", http_version: str):
+        self.requests += 1
+        self.http_versions[http_version] += 1
+        if trace.connected_at is None:
+            self.reused += 1
+            connection = "reused"
+        else:
+            self.new_connections += 1
+            seconds = (trace.ready_at or trace.connected_at) - trace.connect_started
+            self.connect_seconds += seconds
+            LLM_HTTP_CONNECT.observe(seconds)
+            connection = "new"
+        LLM_HTTP_REQUESTS.inc(connection=connection, http_version=http_version)
+
+
+class _RequestTrace:
+    """httpcore 的 trace 回调：记录单个请求是否新建了连接及建连耗时。"""
+
+    def __init__(self):
+        self.connect_started: Optional[float] = None
+        self.connected_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+
+    async def __call__(self, event: str, info: Dict[str, Any]):
+        if event == "connection.connect_tcp.started":
+            self.connect_started = time.monotonic()
+        elif event == "connection.connect_tcp.complete":
+            self.connected_at = time.monotonic()
+        elif event == "connection.start_tls.complete":
+            self.ready_at = time.monotonic()
+
+
+class _DrainingStream(httpx.AsyncByteStream):
+    """
+    响应体包装：未读完就关闭时，先在限定的时间和字节数内读完剩余内容。
+
+    HTTP/1.1 下未读完的响应会使 httpcore 直接关闭连接。流式补全结束时剩余的通常只有分块结束标记，
+    读完后连接即可回到池中复用；被提前中止的长输出（对冲落败、截止时间截断）超出限额时照常关闭连接。
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self._stream = stream
+        self._iterator = None
+        self._finished = False
+
+    async def __aiter__(self):
+        if self._iterator is None:
+            self._iterator = self._stream.__aiter__()
+        async for chunk in self._iterator:
+            yield chunk
+        self._finished = True
+
+    async def _drain(self):
+        if self._iterator is None:
+            self._iterator = self._stream.__aiter__()
+        drained = 0
+        async with asyncio.timeout(LLM_HTTP_DRAIN_MS / 1000):
+            async for chunk in self._iterator:
+                drained += len(chunk)
+                if drained > LLM_HTTP_DRAIN_BYTES:
+                    return
+        self._finished = True
+
+    async def aclose(self):
+        if not self._finished and LLM_HTTP_DRAIN_MS > 0:
+            try:
+                await self._drain()
+            except Exception as e:
+                # 超时或读取失败：连接随 aclose 关闭，不影响调用方
+                logger.debug(f"读取剩余响应失败，关闭连接: {e!r}")
+        await self._stream.aclose()
+
+
+class _LoopTransport(httpx.AsyncBaseTransport):
+    """
+    按事件循环分配连接池的传输层：每个运行中的事件循环使用自己的 AsyncHTTPTransport，
+    已关闭的事件循环的连接池被丢弃。这样共享客户端可以跨事件循环使用
+    （如多次 asyncio.run、同一进程中先后启动的多个应用生命周期），而不会复用属于旧事件循环的连接。
+
+    响应体包装为 _DrainingStream，提前关闭的响应读完剩余内容后连接可以复用。
+    """
+
+    def __init__(self, limits: httpx.Limits, http2: bool):
+        self.limits = limits
+        self.http2 = http2
+        self._transports: Dict[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport] = {}
+        self._lock = threading.Lock()
+
+    def current(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for stale in [other for other in self._transports if other.is_closed()]:
+                del self._transports[stale]
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+            return transport
+
+    def transports(self) -> List[httpx.AsyncHTTPTransport]:
+        with self._lock:
+            return [transport for loop, transport in self._transports.items() if not loop.is_closed()]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.current().handle_async_request(request)
+        response.stream = _DrainingStream(response.stream)
+        return response
+
+    async def aclose(self):
+        """关闭当前事件循环的连接池；之后在该事件循环中的请求会新建连接池。"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+
+stats = PoolStats()
+
+_client: Optional[httpx.AsyncClient] = None
+_transport: Optional[_LoopTransport] = None
+_client_lock = threading.Lock()
+# 实际是否启用了 HTTP/2（LLM_HTTP2 开启且已安装 h2）
+_http2 = False
+
+
+def _http2_available() -> bool:
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("LLM_HTTP2 已开启但未安装 h2（pip install \"httpx[http2]\"），使用 HTTP/1.1")
+        return False
+    return True
+
+
+async def _on_request(request: httpx.Request):
+    request.extensions.setdefault("trace", _RequestTrace())
+
+
+async def _on_response(response: httpx.Response):
+    trace = response.request.extensions.get("trace")
+    if isinstance(trace, _RequestTrace):
+        version = response.extensions.get("http_version", b"")
+        stats.record(trace, version.decode() if isinstance(version, bytes) else str(version))
+
+
+def llm_http_client() -> httpx.AsyncClient:
+    """
+    进程内共享的上游 HTTP 客户端，首次调用时创建。
+
+    客户端本身从不关闭（缓存的模型客户端一直引用它），应用退出时只关闭连接池，见 close_llm_http_pool。
+    """
+    global _client, _transport, _http2
+    with _client_lock:
+        if _client is None:
+            limits = httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+            )
+            timeout = httpx.Timeout(
+                connect=LLM_HTTP_CONNECT_TIMEOUT, read=LLM_HTTP_READ_TIMEOUT,
+                write=LLM_HTTP_WRITE_TIMEOUT, pool=LLM_HTTP_POOL_TIMEOUT,
+            )
+            _http2 = _http2_available()
+            _transport = _LoopTransport(limits, _http2)
+            _client = httpx.AsyncClient(
+                transport=_transport, timeout=timeout,
+                event_hooks={"request": [_on_request], "response": [_on_response]},
+            )
+            logger.info(
+                f"创建 LLM 共享 HTTP 连接池: 最大连接 {LLM_HTTP_MAX_CONNECTIONS}，"
+                f"keep-alive {LLM_HTTP_MAX_KEEPALIVE}（{LLM_HTTP_KEEPALIVE_EXPIRY:.0f} 秒），"
+                f"HTTP/2 {'开启' if _http2 else '关闭'}"
+            )
+        return _client
+
+
+def _connections() -> List[Any]:
+    """各事件循环连接池中当前的连接（httpcore 连接对象）；尚未创建客户端时为空。"""
+    if _transport is None:
+        return []
+    connections = []
+    for transport in _transport.transports():
+        pool = getattr(transport, "_pool", None)
+        connections.extend(getattr(pool, "connections", None) or [])
+    return connections
+
+
+def pool_status() -> Dict[str, Any]:
+    """连接池利用率与连接复用统计，供 /api/llm/http 与容量规划使用。"""
+    connections = _connections()
+    idle = sum(1 for connection in connections if connection.is_idle())
+    active = len(connections) - idle
+    return {
+        "created": _client is not None,
+        "http2": _http2,
+        "max_connections": LLM_HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": LLM_HTTP_MAX_KEEPALIVE,
+        "keepalive_expiry": LLM_HTTP_KEEPALIVE_EXPIRY,
+        "connections": len(connections),
+        "active_connections": active,
+        "idle_connections": idle,
+        "utilization": round(active / LLM_HTTP_MAX_CONNECTIONS, 3),
+        "requests": stats.requests,
+        "new_connections": stats.new_connections,
+        "reused_connections": stats.reused,
+        "reuse_ratio": round(stats.reused / stats.requests, 3) if stats.requests else None,
+        "avg_connect_ms": (round(stats.connect_seconds / stats.new_connections * 1000, 1)
+                           if stats.new_connections else None),
+        "http_versions": dict(stats.http_versions),
+        "warmed_up_connections": stats.warmed_up,
+    }
+
+
+registry.gauge(
+    "llm_http_pool_connections", "LLM 共享连接池中的连接数（含空闲 keep-alive 连接）",
+    lambda: len(_connections()))
+registry.gauge(
+    "llm_http_pool_active_connections", "LLM 共享连接池中正在处理请求的连接数",
+    lambda: sum(1 for connection in _connections() if not connection.is_idle()))
+
+
+async def _open_connection(client: httpx.AsyncClient, url: str) -> bool:
+    """发一个轻量请求（GET /models）建立连接，连接随后留在池中复用；响应状态不影响预热。"""
+    try:
+        response = await client.get(url)
+        await response.aclose()
+        return True
+    except httpx.HTTPError as e:
+        logger.warning(f"预热上游连接失败 {url}: {e}")
+        return False
+
+
+async def warm_up(base_urls: List[str], connections: int = LLM_HTTP_WARMUP_CONNECTIONS,
+                  timeout: float = LLM_HTTP_WARMUP_TIMEOUT) -> int:
+    """
+    为每个上游地址并发建立 connections 个连接（TCP + TLS），使首批请求不必等待建连。
+    返回成功建立的连接数；超时或失败只记录日志，不影响启动。
+    """
+    if connections <= 0 or not base_urls:
+        return 0
+    client = llm_http_client()
+    connections = min(connections, LLM_HTTP_MAX_KEEPALIVE or 1)
+    started = time.monotonic()
+    tasks = [
+        asyncio.ensure_future(_open_connection(client, base_url.rstrip("/") + "/models"))
+        for base_url in dict.fromkeys(base_urls)
+        for _ in range(connections)
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    opened = sum(1 for task in done if not task.cancelled() and task.result())
+    stats.warmed_up += opened
+    logger.info(f"预热上游连接 {opened}/{len(tasks)} 个，耗时 {(time.monotonic() - started) * 1000:.0f} ms")
+    return opened
+
+
+async def close_llm_http_pool():
+    """
+    关闭当前事件循环的连接池（应用生命周期结束时）。共享客户端保持可用，
+    之后的请求（包括新的事件循环中的请求）会新建连接池。
+    """
+    if _transport is not None:
+        await _transport.aclose()
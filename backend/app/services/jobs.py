@@ -0,0 +1,190 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, Any, Optional, List
+
+from .runs import run_registry
+from .scheduler import current_client_id
+
+logger = logging.getLogger(__name__)
+
+# 同时在后台执行的研究任务上限，超出的任务排队等待
+JOB_MAX_CONCURRENCY = max(1, int(os.getenv("JOB_MAX_CONCURRENCY", "4")))
+# 已结束任务在内存中保留的时间（秒）
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+# 长轮询单次最长等待时间（秒）
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", "60"))
+
+
+class ResearchJob:
+    """
+    一次后台研究任务。
+
+    订阅共享的研究运行（与 WebSocket 上的相同问题合并执行），
+    从帧流中累积规划说明、子问题草稿和报告，供轮询时返回部分结果。
+    """
+
+    def __init__(self, question: str, retry_run_id: Optional[str] = None, deadline_ms: Optional[int] = None):
+        self.job_id = uuid.uuid4().hex
+        self.question = question
+        # 延迟预算（毫秒），从提交时算起，排队时间也计入
+        self.deadline_ms = deadline_ms
+        # 订阅的研究运行 ID；重试任务沿用原任务的运行 ID 以复用其检查点
+        self.run_id: Optional[str] = retry_run_id
+        self.retry_run_id = retry_run_id
+        self.status = "queued"  # queued | running | completed | failed | cancelled
+        self.stage: Optional[str] = None
+        self.message: Optional[str] = None
+        self.plan_text = ""
+        self.questions: Dict[int, str] = {}
+        self.drafts: Dict[int, str] = {}
+        self.report = ""
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    async def send_frame(self, frame: Dict[str, Any]):
+        frame_type = frame.get("type")
+        self.stage = frame.get("stage", self.stage)
+
+        if frame_type == "status":
+            self.message = frame.get("content")
+        elif frame_type == "plan":
+            self.plan_text += frame.get("content", "")
+        elif frame_type == "research":
+            idx = frame["question_index"]
+            self.questions[idx] = frame.get("question", self.questions.get(idx, ""))
+            self.drafts[idx] = self.drafts.get(idx, "") + frame.get("content", "")
+        elif frame_type == "report":
+            self.report += frame.get("content", "")
+
+    def partial_drafts(self) -> List[Dict[str, Any]]:
+        """按子问题顺序返回目前已生成的草稿。"""
+        return [
+            {
+                "question_index": idx,
+                "question": self.questions.get(idx, ""),
+                "draft": self.drafts[idx],
+            }
+            for idx in sorted(self.drafts)
+        ]
+
+    def to_dict(self, include_partial: bool = True) -> Dict[str, Any]:
+        data = {
+            "job_id": self.job_id,
+            "question": self.question,
+            "run_id": self.run_id,
+            "deadline_ms": self.deadline_ms,
+            "status": self.status,
+            "stage": self.stage,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "completed":
+            data["result"] = self.result
+        elif self.status == "failed":
+            data["error"] = self.error
+        elif include_partial:
+            data["partial"] = {
+                "plan": self.plan_text,
+                "drafts": self.partial_drafts(),
+                "report": self.report,
+            }
+        return data
+
+
+class JobManager:
+    """在后台以有限并发执行研究任务，并按 job_id 提供查询。"""
+
+    def __init__(self, max_concurrency: int = JOB_MAX_CONCURRENCY, ttl_seconds: int = JOB_TTL_SECONDS):
+        self.jobs: Dict[str, ResearchJob] = {}
+        self.ttl_seconds = ttl_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def submit(self, question: str, retry_run_id: Optional[str] = None,
+               deadline_ms: Optional[int] = None) -> ResearchJob:
+        """
+        创建任务并立即返回，研究在后台执行；retry_run_id 给定时重试该研究运行，
+        deadline_ms 给定时按延迟预算执行。
+        """
+        self._evict_expired()
+        job = ResearchJob(question, retry_run_id, deadline_ms)
+        self.jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run(job))
+        logger.info(f"研究任务已提交: {job.job_id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[ResearchJob]:
+        return self.jobs.get(job_id)
+
+    async def wait(self, job: ResearchJob, timeout: float) -> ResearchJob:
+        """长轮询：等待任务结束或超时，返回任务本身。"""
+        timeout = min(max(timeout, 0.0), JOB_MAX_WAIT_SECONDS)
+        if timeout and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _run(self, job: ResearchJob):
+        async with self._semaphore:
+            job.status = "running"
+            job.started_at = time.time()
+            current_client_id.set(f"job_{job.job_id}")
+            deadline_ms = job.deadline_ms
+            if deadline_ms is not None:
+                # 扣除排队等待的时间，研究只使用剩余的预算
+                waited_ms = int((job.started_at - job.created_at) * 1000)
+                deadline_ms = max(deadline_ms - waited_ms, 1)
+            if job.retry_run_id:
+                try:
+                    # 重试的运行沿用原运行的延迟预算
+                    run, queue = await run_registry.retry(job.retry_run_id)
+                except KeyError:
+                    # 检查点已过期，按原任务的延迟预算重新发起研究
+                    run, queue = run_registry.attach(job.question, deadline_ms)
+            else:
+                run, queue = run_registry.attach(job.question, deadline_ms)
+            job.run_id = run.run_id
+            try:
+                while True:
+                    frame = await queue.get()
+                    if frame is None:
+                        break
+                    await job.send_frame(frame)
+                if run.error is not None:
+                    raise run.error
+                job.result = run.result
+                job.status = "completed"
+            except Exception as e:
+                logger.error(f"研究任务 {job.job_id} 失败: {e}")
+                job.error = str(e)
+                job.status = "failed"
+            except asyncio.CancelledError:
+                job.status = "cancelled"
+                raise
+            finally:
+                run_registry.detach(run, queue)
+                job.finished_at = time.time()
+                job.done.set()
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_at and now - job.finished_at > self.ttl_seconds
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+job_manager = JobManager()
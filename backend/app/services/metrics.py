@@ -0,0 +1,176 @@
+import time
+import bisect
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 延迟类直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 时间较长的阶段耗时分桶（秒）
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+# token 数与 chunk 数分桶
+COUNT_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """按标签分组的累积直方图，输出 Prometheus 文本格式的 _bucket / _sum / _count。"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各分桶计数..., 总和, 总数]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """采集时通过回调读取当前值的仪表。"""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(self.read())}",
+        ]
+
+
+class Counter:
+    """按标签分组的单调递增计数器。"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内指标登记表，render() 生成 /metrics 返回的 Prometheus 文本。"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics[name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics[name] = metric
+        return metric
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], float]) -> Gauge:
+        metric = Gauge(name, documentation, read)
+        self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "research_stage_duration_seconds", "研究各阶段（plan/research/report）的耗时",
+    ("stage", "model"), STAGE_BUCKETS)
+LLM_TIME_TO_FIRST_TOKEN = registry.histogram(
+    "llm_time_to_first_token_seconds", "LLM 流式调用从准入到首个 chunk 的耗时",
+    ("stage", "model"))
+LLM_CALL_DURATION = registry.histogram(
+    "llm_call_duration_seconds", "单次 LLM 调用从准入到结束的耗时",
+    ("stage", "model"), STAGE_BUCKETS)
+LLM_QUEUE_WAIT = registry.histogram(
+    "llm_queue_wait_seconds", "LLM 调用在全局调度器中排队等待准入的时间",
+    ("stage", "model"))
+LLM_INPUT_TOKENS = registry.histogram(
+    "llm_input_tokens", "单次 LLM 调用的输入 token 数（来自 usage metadata）",
+    ("stage", "model"), COUNT_BUCKETS)
+LLM_OUTPUT_TOKENS = registry.histogram(
+    "llm_output_tokens", "单次 LLM 调用的输出 token 数（来自 usage metadata）",
+    ("stage", "model"), COUNT_BUCKETS)
+LLM_STREAM_CHUNKS = registry.histogram(
+    "llm_stream_chunks", "单次 LLM 流式调用产出的 chunk 数",
+    ("stage", "model"), COUNT_BUCKETS)
+WS_SEND_LATENCY = registry.histogram(
+    "ws_send_seconds", "向 WebSocket 写入一帧的耗时",
+    ("stage",))
+
+
+@contextmanager
+def observe_duration(histogram: Histogram, **labels: str):
+    """记录 with 块的耗时（包括异常退出）。"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+def observe_usage(stage: str, model: str, usage: Optional[dict]):
+    if not usage:
+        return
+    if usage.get("input_tokens") is not None:
+        LLM_INPUT_TOKENS.observe(usage["input_tokens"], stage=stage, model=model)
+    if usage.get("output_tokens") is not None:
+        LLM_OUTPUT_TOKENS.observe(usage["output_tokens"], stage=stage, model=model)
@@ -0,0 +1,125 @@
+import os
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 可单独配置模型的阶段：plan 为流式规划说明，plan_structured 为结构化规划，
+# research 为子问题草稿，report 为最终报告。每个阶段通过 LLM_<阶段>_MODEL / _BASE_URL /
+# _API_KEY / _MAX_TOKENS / _TEMPERATURE 配置，未配置的项沿用默认模型（DEEPSEEK_*）
+MODEL_STAGES = ("plan", "plan_structured", "research", "report")
+# 其他调用点归入的阶段：提炼要点与草稿同档，报告大纲与报告同档
+STAGE_ALIASES = {"digest": "research", "outline": "report"}
+
+
+def _optional_int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+def _optional_float(value: Optional[str]) -> Optional[float]:
+    return float(value) if value else None
+
+
+class StageModelConfig:
+    """单个阶段的模型配置；未设置的项为 None，表示沿用默认模型的设置。"""
+
+    def __init__(self, stage: str, model: Optional[str] = None, base_url: Optional[str] = None,
+                 api_key: Optional[str] = None, max_tokens: Optional[int] = None,
+                 temperature: Optional[float] = None):
+        self.stage = stage
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    @classmethod
+    def from_env(cls, stage: str) -> "StageModelConfig":
+        prefix = f"LLM_{stage.upper()}_"
+        return cls(
+            stage,
+            model=os.getenv(prefix + "MODEL") or None,
+            base_url=os.getenv(prefix + "BASE_URL") or None,
+            api_key=os.getenv(prefix + "API_KEY") or None,
+            max_tokens=_optional_int(os.getenv(prefix + "MAX_TOKENS")),
+            temperature=_optional_float(os.getenv(prefix + "TEMPERATURE")),
+        )
+
+    @property
+    def customized(self) -> bool:
+        """是否需要单独的客户端（模型、地址、密钥、输出上限或温度与默认不同）。"""
+        return any(value is not None for value in (
+            self.model, self.base_url, self.api_key, self.max_tokens, self.temperature,
+        ))
+
+    def client_key(self) -> Tuple:
+        """客户端复用键：配置完全相同的阶段共享一个客户端。"""
+        return (self.model, self.base_url, self.api_key, self.max_tokens, self.temperature)
+
+
+class ModelRouter:
+    """
+    按阶段选择模型客户端。
+
+    阶段没有单独配置（或没有提供 build，如离线假模型和回放）时使用默认客户端；
+    否则在首次使用时调用 build(config) 创建客户端，之后复用，配置相同的阶段共享同一个客户端。
+    """
+
+    def __init__(self, default: Any, default_name: str,
+                 build: Optional[Callable[[StageModelConfig], Any]] = None,
+                 configs: Optional[Dict[str, StageModelConfig]] = None):
+        self.default = default
+        self.default_name = default_name
+        self.build = build
+        self.configs = configs if configs is not None else {
+            stage: StageModelConfig.from_env(stage) for stage in MODEL_STAGES
+        }
+        self._clients: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    def config(self, stage: str) -> StageModelConfig:
+        stage = STAGE_ALIASES.get(stage, stage)
+        return self.configs.get(stage) or StageModelConfig(stage)
+
+    def model_name(self, stage: str) -> str:
+        """阶段实际使用的模型名（指标标签、缓存键）。"""
+        config = self.config(stage)
+        if self.build is None or not config.customized:
+            return self.default_name
+        return config.model or self.default_name
+
+    def max_tokens(self, stage: str) -> Optional[int]:
+        return self.config(stage).max_tokens
+
+    def client(self, stage: str) -> Any:
+        config = self.config(stage)
+        if self.build is None or not config.customized:
+            return self.default
+        key = config.client_key()
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                logger.info(f"为阶段 {config.stage} 创建模型客户端: {config.model or self.default_name}")
+                client = self._clients[key] = self.build(config)
+        return client
+
+    async def aclient(self, stage: str) -> Any:
+        """在事件循环中获取客户端：需要新建时在线程中创建（导入模型库较慢），不阻塞事件循环。"""
+        config = self.config(stage)
+        if self.build is None or not config.customized or config.client_key() in self._clients:
+            return self.client(stage)
+        return await asyncio.to_thread(self.client, stage)
+
+    def describe(self) -> Dict[str, Dict[str, Any]]:
+        """各阶段的路由结果，供日志与监控查看。"""
+        return {
+            stage: {
+                "model": self.model_name(stage),
+                "max_tokens": self.config(stage).max_tokens,
+                "temperature": self.config(stage).temperature,
+                "dedicated": self.build is not None and self.config(stage).customized,
+            }
+            for stage in MODEL_STAGES
+        }
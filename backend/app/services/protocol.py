@@ -0,0 +1,119 @@
+import json
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack 为可选依赖，未安装时不提供二进制协议
+    msgpack = None
+
+# /ws/research 的帧协议版本，通过 WebSocket 子协议（Sec-WebSocket-Protocol）在连接时协商。
+# 客户端未声明子协议时使用 v1：每帧都是完整的 JSON 对象（保持旧客户端兼容）。
+PROTOCOL_V2_JSON = "research.v2.json"
+PROTOCOL_V2_MSGPACK = "research.v2.msgpack"
+
+# 可以合并、并在 v2 中压缩为短帧的流式内容帧类型
+MERGEABLE_FRAME_TYPES = {"plan", "research", "report"}
+
+Payload = Union[str, bytes]
+
+
+def supported_subprotocols() -> List[str]:
+    """服务器支持的子协议，msgpack 仅在安装了依赖时可用。"""
+    protocols = [PROTOCOL_V2_JSON]
+    if msgpack is not None:
+        protocols.insert(0, PROTOCOL_V2_MSGPACK)
+    return protocols
+
+
+def negotiate_subprotocol(offered: List[str]) -> Optional[str]:
+    """按客户端给出的优先级选择第一个服务器支持的子协议，没有则返回 None（v1）。"""
+    supported = supported_subprotocols()
+    for protocol in offered:
+        if protocol in supported:
+            return protocol
+    return None
+
+
+def encoder_for(subprotocol: Optional[str]) -> "JsonFrameEncoder":
+    if subprotocol == PROTOCOL_V2_MSGPACK:
+        return CompactFrameEncoder(binary=True)
+    if subprotocol == PROTOCOL_V2_JSON:
+        return CompactFrameEncoder(binary=False)
+    return JsonFrameEncoder()
+
+
+class JsonFrameEncoder:
+    """v1 协议：每帧独立、完整的 JSON 文本。"""
+
+    subprotocol: Optional[str] = None
+
+    def encode(self, frame: Dict[str, Any]) -> List[Payload]:
+        return [self.dumps(frame)]
+
+    def dumps(self, frame: Dict[str, Any]) -> Payload:
+        return json.dumps(frame, ensure_ascii=False)
+
+    def loads(self, data: Payload) -> Dict[str, Any]:
+        return json.loads(data)
+
+
+class CompactFrameEncoder(JsonFrameEncoder):
+    """
+    v2 紧凑协议。
+
+    内容帧的不变字段（type/stage/session_id/question_index/question/total_questions）
+    只在流首次出现或发生变化时通过一帧声明发送：
+        {"type": "stream", "id": 1, "stream_type": "research", "stage": ..., ...}
+    之后的内容帧只携带流 ID、文本和帧序号（有序号时）：
+        {"s": 1, "c": "文本", "q": 42}
+    其他帧（start/status/complete/error/pong 等）与 v1 相同。
+    binary=True 时以 msgpack 二进制帧发送，否则为 JSON 文本。
+    """
+
+    def __init__(self, binary: bool = False):
+        self.binary = binary
+        self.subprotocol = PROTOCOL_V2_MSGPACK if binary else PROTOCOL_V2_JSON
+        self._streams: Dict[Tuple[Any, Any, Any], Tuple[int, Dict[str, Any]]] = {}
+        self._next_id = 1
+
+    def encode(self, frame: Dict[str, Any]) -> List[Payload]:
+        frame_type = frame.get("type")
+        if frame_type not in MERGEABLE_FRAME_TYPES:
+            if frame_type == "start":
+                # 该会话新的一次研究开始，其之前的流不会再出现
+                session_id = frame.get("session_id")
+                for key in [key for key in self._streams if key[0] == session_id]:
+                    del self._streams[key]
+            return [self.dumps(frame)]
+
+        payloads: List[Payload] = []
+        key = (frame.get("session_id"), frame_type, frame.get("question_index"))
+        meta = {k: v for k, v in frame.items() if k not in ("type", "content", "seq")}
+        stream = self._streams.get(key)
+        if stream is None or stream[1] != meta:
+            stream_id = stream[0] if stream else self._allocate_id()
+            self._streams[key] = (stream_id, meta)
+            payloads.append(self.dumps(dict(meta, type="stream", id=stream_id, stream_type=frame_type)))
+        else:
+            stream_id = stream[0]
+
+        content = {"s": stream_id, "c": frame.get("content", "")}
+        if "seq" in frame:
+            content["q"] = frame["seq"]
+        payloads.append(self.dumps(content))
+        return payloads
+
+    def dumps(self, frame: Dict[str, Any]) -> Payload:
+        if self.binary:
+            return msgpack.packb(frame, use_bin_type=True)
+        return super().dumps(frame)
+
+    def loads(self, data: Payload) -> Dict[str, Any]:
+        if isinstance(data, bytes) and self.binary:
+            return msgpack.unpackb(data, raw=False)
+        return super().loads(data)
+
+    def _allocate_id(self) -> int:
+        stream_id = self._next_id
+        self._next_id += 1
+        return stream_id
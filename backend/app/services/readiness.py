@@ -0,0 +1,74 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 启动后是否立即在后台完成首个请求所需的初始化（创建模型客户端、预热上游连接）；
+# 设为 0 时推迟到首次就绪探测或首个请求
+STARTUP_PRELOAD = os.getenv("STARTUP_PRELOAD", "1").lower() not in ("0", "false", "no")
+
+# 进程启动时间（本模块首次导入时），用于计算就绪耗时
+_process_started = time.monotonic()
+
+
+class Readiness:
+    """
+    服务就绪状态，与 /api/health（进程存活）分开：
+
+    - pending：尚未开始初始化
+    - initializing：后台初始化中
+    - ready：可以立即处理请求
+    - failed：初始化失败（如缺少 API Key），error 为原因；修正配置并重启前一直保持
+
+    初始化在后台任务中进行，不阻塞服务启动；就绪探测在 pending 时触发初始化。
+    """
+
+    def __init__(self):
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.ready_after: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self, prepare: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """开始后台初始化；已经开始过时返回原来的任务。"""
+        if self._task is None:
+            self.state = "initializing"
+            self._task = asyncio.create_task(self._run(prepare))
+        return self._task
+
+    async def _run(self, prepare: Callable[[], Awaitable[Any]]):
+        started = time.monotonic()
+        try:
+            await prepare()
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"服务初始化失败: {e}")
+            return
+        self.state = "ready"
+        self.ready_after = time.monotonic() - _process_started
+        logger.info(f"服务就绪：初始化耗时 {(time.monotonic() - started) * 1000:.0f} ms，"
+                    f"进程启动后 {self.ready_after * 1000:.0f} ms")
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "status": self.state,
+            "error": self.error,
+            "ready_after_ms": round(self.ready_after * 1000) if self.ready_after is not None else None,
+            "uptime_ms": round((time.monotonic() - _process_started) * 1000),
+        }
+
+
+readiness = Readiness()
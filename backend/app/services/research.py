@@ -1,29 +1,282 @@
 import os
-from typing import List, Optional, AsyncGenerator, Dict, Any
+import re
+import time
+import asyncio
+import logging
+import threading
+from functools import lru_cache
+from contextlib import aclosing, nullcontext
+from contextvars import ContextVar
+from typing import List, Optional, AsyncGenerator, Dict, Any, Tuple
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from typing_extensions import TypedDict
+from langchain_core.messages import AnyMessage, HumanMessage, AIMessage, SystemMessage
 from pydantic import BaseModel, Field
-from langgraph.graph import StateGraph, START, END, MessagesState
-from langchain.chat_models import init_chat_model
-import json
+
+from .streaming import send_frame
+from .cache import research_cache, normalize_text, make_key
+from .similarity import near_dup_index, NEAR_DUP_ENABLED
+from .scheduler import llm_scheduler, estimate_message_tokens, estimate_tokens
+from .cassette import LLM_CASSETTE_MODE
+from .checkpoints import checkpoint_store, RunCheckpoint
+from .deadline import ResearchBudget
+from .models import ModelRouter, StageModelConfig
+from .endpoints import LLM_ENDPOINTS, EndpointPool, EndpointSpec, parse_endpoints
+from .hedging import hedged_stream, should_hedge, ttft_tracker
+from .http_pool import llm_http_client, warm_up
+from .metrics import (
+    STAGE_DURATION, LLM_TIME_TO_FIRST_TOKEN, LLM_CALL_DURATION, LLM_QUEUE_WAIT,
+    LLM_STREAM_CHUNKS, observe_duration, observe_usage,
+)
 
 # 加载环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # 从环境变量读取配置
+# LLM 提供方：deepseek 为真实模型；fake 为离线假模型（压测/本地开发用，不需要 API Key）
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "deepseek").lower()
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
 DEEPSEEK_CHAT_MODEL = os.getenv("DEEPSEEK_CHAT_MODEL", "deepseek-chat")
 
-if not DEEPSEEK_API_KEY:
-    raise ValueError("DEEPSEEK_API_KEY 环境变量未设置，请在 .env 文件中配置")
+# 子问题并行研究的最大并发数，设为 1 即退化为逐个顺序研究
+RESEARCH_MAX_CONCURRENCY = max(1, int(os.getenv("RESEARCH_MAX_CONCURRENCY", "3")))
+
+# 规划模式：dual 为流式说明 + 结构化输出两次调用；single 为单次流式调用并从文本中解析子问题
+PLAN_MODE = os.getenv("PLAN_MODE", "dual").lower()
+
+# 执行模式：staged 为规划完成后再研究；pipeline 为规划流中每解析出一个子问题就立即开始研究
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "staged").lower()
+
+# 报告模式：single 为单次流式生成整篇报告；sectioned 为先生成大纲，再并发撰写各小节并按文档顺序流式输出
+REPORT_MODE = os.getenv("REPORT_MODE", "single").lower()
+
+# 报告输入（子问题 + 草稿）的 token 预算（估算值）。超出时先并行把草稿提炼为要点摘要，
+# 再据摘要生成报告，使报告的输入规模与首 token 延迟不随草稿数量和长度增长
+REPORT_INPUT_TOKEN_BUDGET = int(os.getenv("REPORT_INPUT_TOKEN_BUDGET", "6000"))
+# 单条要点摘要的最小目标长度（字符）；草稿过多时先分组再提炼，逐层汇总
+REPORT_DIGEST_MIN_CHARS = int(os.getenv("REPORT_DIGEST_MIN_CHARS", "300"))
+# 逐层汇总时每组合并的摘要数
+REPORT_DIGEST_FAN_IN = max(2, int(os.getenv("REPORT_DIGEST_FAN_IN", "4")))
+
+# 提示词版本，修改任意阶段的提示词后需递增，使旧缓存失效
+PROMPT_VERSION = "1"
+
+# 上游端点池（LLM_ENDPOINTS）；为空时只使用 DEEPSEEK_BASE_URL
+ENDPOINT_SPECS = parse_endpoints(LLM_ENDPOINTS, DEEPSEEK_API_KEY, DEEPSEEK_CHAT_MODEL)
+
+
+def _chat_model(model: Optional[str] = None, api_key: Optional[str] = None,
+                base_url: Optional[str] = None, **options):
+    """
+    创建 DeepSeek（OpenAI 兼容）聊天模型。
+
+    配置了端点池且未指定 base_url 时返回 EndpointPool：model / api_key 给定时覆盖各端点的设置，
+    端点客户端关闭内置重试，失败直接交给端点池换端点重试。
+    所有客户端共用进程内的 HTTP 连接池（见 http_pool.py）。
+    """
+    # 延迟导入：langchain_deepseek / openai 的导入耗时较长，只在真正创建模型时加载
+    from langchain.chat_models import init_chat_model
+
+    if base_url is None and ENDPOINT_SPECS:
+        def factory(spec: EndpointSpec):
+            if not (api_key or spec.api_key):
+                raise ValueError(f"上游端点 {spec.label} 的 API Key 未设置（LLM_ENDPOINTS 或 DEEPSEEK_API_KEY）")
+            return init_chat_model(
+                model=model or spec.model,
+                model_provider="deepseek",
+                api_key=api_key or spec.api_key,
+                base_url=spec.base_url,
+                max_retries=0,
+                http_async_client=llm_http_client(),
+                **options,
+            )
+
+        return EndpointPool.build(ENDPOINT_SPECS, factory, model or DEEPSEEK_CHAT_MODEL)
+
+    if not (api_key or DEEPSEEK_API_KEY):
+        raise ValueError("DEEPSEEK_API_KEY 环境变量未设置，请在 .env 文件中配置")
+    return init_chat_model(
+        model=model or DEEPSEEK_CHAT_MODEL,
+        model_provider="deepseek",
+        api_key=api_key or DEEPSEEK_API_KEY,
+        base_url=base_url or DEEPSEEK_BASE_URL,
+        http_async_client=llm_http_client(),
+        **options,
+    )
+
+
+def _build_default_model():
+    """
+    创建默认模型。LLM_CASSETTE_MODE=replay 时离线回放录制，不需要 API Key；
+    record 时包装真实模型录制每次调用。
+    """
+    if LLM_CASSETTE_MODE == "replay":
+        from .cassette import CassettePlayer
+
+        model = CassettePlayer()
+    elif LLM_PROVIDER == "fake":
+        from .fake_llm import FakeChatModel
+
+        model = FakeChatModel()
+    else:
+        model = _chat_model()
+
+    if LLM_CASSETTE_MODE == "record":
+        from .cassette import CassetteRecorder
+
+        model = CassetteRecorder(model)
+    return model
+
+
+def _build_stage_model(config: StageModelConfig):
+    """
+    为单独配置了模型的阶段创建客户端，未配置的项沿用 DEEPSEEK_* 设置；
+    未单独指定 base_url 时使用端点池（如已配置）。
+    """
+    options = {}
+    if config.max_tokens is not None:
+        options["max_tokens"] = config.max_tokens
+    if config.temperature is not None:
+        options["temperature"] = config.temperature
+    model = _chat_model(config.model, config.api_key, config.base_url, **options)
+    if LLM_CASSETTE_MODE == "record":
+        from .cassette import CassetteRecorder
+
+        model = CassetteRecorder(model)
+    return model
+
+
+_model_router: Optional[ModelRouter] = None
+_model_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    """
+    按阶段路由模型：规划、结构化规划、草稿和报告可以使用不同的模型，客户端在首次使用时创建。
+    离线假模型与回放模式下所有阶段共用默认模型，阶段配置只有 max_tokens 生效。
+
+    默认模型在首次调用时创建（而不是导入模块时），缺少 API Key 等配置错误在此处抛出，
+    失败后下次调用会重新尝试。创建时会同步导入模型库，事件循环中请使用 aget_model_router。
+    """
+    global _model_router
+    with _model_router_lock:
+        if _model_router is None:
+            llm = _build_default_model()
+            router = ModelRouter(
+                # 指标中的模型标签
+                llm, getattr(llm, "model_name", None) or DEEPSEEK_CHAT_MODEL,
+                build=_build_stage_model if LLM_PROVIDER != "fake" and LLM_CASSETTE_MODE != "replay" else None,
+            )
+            for stage, route in router.describe().items():
+                if route["dedicated"]:
+                    logger.info(f"阶段 {stage} 使用单独配置的模型: {route}")
+            _model_router = router
+        return _model_router
+
+
+async def aget_model_router() -> ModelRouter:
+    """
+    在事件循环中获取模型路由：尚未创建时（启动预热未完成或 STARTUP_PRELOAD=0）在线程中创建，
+    不阻塞事件循环；并发的首批请求在线程中依次等待同一次创建。
+    """
+    if _model_router is not None:
+        return _model_router
+    return await asyncio.to_thread(get_model_router)
+
+
+def llm_base_urls() -> List[str]:
+    """需要预热连接的上游地址：端点池（或 DEEPSEEK_BASE_URL）及各阶段单独配置的地址；离线模式下为空。"""
+    if LLM_PROVIDER == "fake" or LLM_CASSETTE_MODE == "replay":
+        return []
+    urls = [spec.base_url for spec in ENDPOINT_SPECS] or [DEEPSEEK_BASE_URL]
+    urls += [config.base_url for config in get_model_router().configs.values() if config.base_url]
+    return list(dict.fromkeys(urls))
+
+
+async def prepare():
+    """
+    完成首个请求需要的初始化：创建模型客户端（导入 langchain_deepseek / openai 较慢，放到线程中，
+    不阻塞事件循环），并预热到上游的连接。配置错误（如缺少 API Key）在此抛出。
+    """
+    await aget_model_router()
+    await warm_up(llm_base_urls())
+
+
+def _stage_model_id(*stages: str) -> str:
+    """缓存键中的模型标识：各阶段配置的模型名（去重），未单独配置时为 DEEPSEEK_CHAT_MODEL。"""
+    names = dict.fromkeys(get_model_router().config(stage).model or DEEPSEEK_CHAT_MODEL for stage in stages)
+    return "+".join(names)
+
+
+def _stage_kwargs(stage: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """合并阶段配置的 max_tokens 与调用方（如延迟预算）给出的 max_tokens，取较小值。"""
+    limits = [n for n in (get_model_router().max_tokens(stage), kwargs.get("max_tokens")) if n is not None]
+    if limits:
+        kwargs = dict(kwargs, max_tokens=min(limits))
+    return kwargs
+
+
+# 所有上游调用都经过全局调度器准入（并发上限、token 预算、按客户端公平排队）
+async def _astream(messages, websocket=None, stage: str = "", **kwargs):
+    """
+    流式调用 stage 对应的模型，逐个产出 chunk；stage 同时用于指标标签，
+    kwargs（如 max_tokens）透传给模型。
+
+    启用对冲（LLM_HEDGE_ENABLED）的阶段在首个 chunk 超过阈值仍未到达时再发一次相同请求，
+    先出 token 的一方胜出；对冲请求单独向调度器申请准入，没有空闲名额时不对冲。
+    """
+    router = await aget_model_router()
+    model = await router.aclient(stage)
+    model_name = router.model_name(stage)
+    kwargs = _stage_kwargs(stage, kwargs)
+    async with llm_scheduler.slot(estimate_message_tokens(messages), websocket) as slot:
+        LLM_QUEUE_WAIT.observe(slot.queue_wait, stage=stage, model=model_name)
+
+        def admit_hedge():
+            release = llm_scheduler.try_admit(slot.input_tokens)
+            if release is not None:
+                _count("hedged_calls")
+            return release
+
+        if should_hedge(stage):
+            stream = hedged_stream(lambda: model.astream(messages, **kwargs), ttft_tracker.threshold(stage),
+                                   stage, model_name, admit_hedge)
+        else:
+            stream = model.astream(messages, **kwargs)
+
+        started = time.perf_counter()
+        chunks = 0
+        usage = None
+        try:
+            async with aclosing(stream):
+                async for chunk in stream:
+                    if chunks == 0:
+                        ttft = time.perf_counter() - started
+                        LLM_TIME_TO_FIRST_TOKEN.observe(ttft, stage=stage, model=model_name)
+                        ttft_tracker.observe(stage, ttft)
+                    chunks += 1
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    slot.record_output(chunk.content, usage)
+                    yield chunk
+        finally:
+            LLM_CALL_DURATION.observe(time.perf_counter() - started, stage=stage, model=model_name)
+            LLM_STREAM_CHUNKS.observe(chunks, stage=stage, model=model_name)
+            observe_usage(stage, model_name, usage)
+
+
+async def _ainvoke_structured(schema, messages, websocket=None, stage: str = ""):
+    """以结构化输出方式调用 stage 对应的模型。"""
+    router = await aget_model_router()
+    model = await router.aclient(stage)
+    model_name = router.model_name(stage)
+    async with llm_scheduler.slot(estimate_message_tokens(messages), websocket) as slot:
+        LLM_QUEUE_WAIT.observe(slot.queue_wait, stage=stage, model=model_name)
+        with observe_duration(LLM_CALL_DURATION, stage=stage, model=model_name):
+            return await model.with_structured_output(schema).ainvoke(messages)
 
-llm = init_chat_model(
-    model=DEEPSEEK_CHAT_MODEL,
-    model_provider="deepseek",
-    api_key=DEEPSEEK_API_KEY,
-    base_url=DEEPSEEK_BASE_URL,
-)
 
 # ===================== 1. 定义结构化 Plan =====================
 class ResearchPlan(BaseModel):
@@ -32,15 +285,174 @@ class ResearchPlan(BaseModel):
         max_items=3,
     )
 
+
+class ReportOutline(BaseModel):
+    title: str = Field(description="Title of the final report")
+    sections: List[str] = Field(
+        description="Section headings in order: introduction, one per research question, conclusion",
+    )
+
+
+# 单次调用规划时，要求模型把每个子问题单独写成一行并以固定标记开头
+_PLAN_QUESTION_RE = re.compile(r"^[\s\-*#>]*【\s*子问题\s*(\d+)\s*】[\s:：]*(.+?)[\s*]*$")
+
+
+class PlanQuestionParser:
+    """从流式规划文本中增量解析 "【子问题N】..." 行。"""
+
+    def __init__(self, max_questions: int = 3):
+        self.max_questions = max_questions
+        self.questions: List[str] = []
+        self._buffer = ""
+
+    def feed(self, piece: str) -> List[str]:
+        """追加一段流式文本，返回本次新解析出的完整子问题。"""
+        self._buffer += piece
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse_lines(lines)
+
+    def close(self, truncated: bool = False) -> List[str]:
+        """
+        流结束时解析缓冲区中剩余的最后一行。流被提前截断（截止时间、max_tokens）时
+        最后一行可能只有半句，直接丢弃。
+        """
+        lines, self._buffer = [] if truncated else [self._buffer], ""
+        return self._parse_lines(lines)
+
+    def _parse_lines(self, lines: List[str]) -> List[str]:
+        found = []
+        for line in lines:
+            if len(self.questions) >= self.max_questions:
+                break
+            match = _PLAN_QUESTION_RE.match(line)
+            if match:
+                question = match.group(2).strip()
+                self.questions.append(question)
+                found.append(question)
+        return found
+
 # ===================== 2. 定义 State =====================
-class ResearchState(MessagesState):
-    # 继承 MessagesState：已经有 messages: list[AnyMessage]
-    plan: Optional[ResearchPlan] = None   # 第一步产生的研究问题
-    drafts: Optional[List[str]] = None    # 第二步每个子问题的分析
-    report: Optional[str] = None          # 第三步最终报告
+class ResearchState(TypedDict):
+    # 与 LangGraph 的 MessagesState 相同的 messages 字段；编译图时再合并 MessagesState（带 add_messages 归并），
+    # 以免导入本模块时加载 langgraph
+    # TypedDict 不支持默认值，构建初始状态时需显式给出 None
+    messages: List[AnyMessage]
+    plan: Optional[ResearchPlan]   # 第一步产生的研究问题
+    drafts: Optional[List[str]]    # 第二步每个子问题的分析
+    report: Optional[str]          # 第三步最终报告
 
 # ===================== 3. 三个节点的实现 =====================
 
+def _cut_short(chunk) -> bool:
+    """chunk 是否表明输出因 max_tokens 上限被截断。"""
+    return (getattr(chunk, "response_metadata", None) or {}).get("finish_reason") == "length"
+
+
+def _cache_key(*parts: str, stages: Tuple[str, ...]) -> str:
+    """缓存键：生成结果的阶段所用的模型名 + 提示词版本 + 归一化后的文本片段。"""
+    return make_key(_stage_model_id(*stages), PROMPT_VERSION, *(normalize_text(p) for p in parts))
+
+
+def _plan_cache_key(user_query: str) -> str:
+    """
+    规划缓存键：流水线模式与 PLAN_MODE=single 使用单次调用的规划提示词（规划说明中含子问题行），
+    与 dual 模式的提示词和规划说明不同，分开缓存。
+    """
+    variant = "single" if PLAN_MODE == "single" or EXECUTION_MODE == "pipeline" else "dual"
+    return _cache_key(user_query, variant, stages=("plan", "plan_structured"))
+
+
+def _report_cache_key(joined: str) -> str:
+    """报告缓存键：分节模式生成的报告结构不同，使用独立的缓存键。"""
+    if REPORT_MODE == "sectioned":
+        return _cache_key(joined, "sectioned", stages=("report",))
+    return _cache_key(joined, stages=("report",))
+
+
+# 单次研究请求内的统计计数，由 conduct_research_stream 初始化；
+# 并行 worker 任务继承同一个 dict，计数在请求内共享
+_request_stats: ContextVar[Optional[Dict[str, int]]] = ContextVar("research_request_stats", default=None)
+
+
+def _count(name: str, amount: int = 1):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + amount
+
+
+# 当前研究运行的阶段检查点，由 conduct_research_stream 按 run_id 加载；重试时已完成的阶段直接复用
+_run_checkpoint: ContextVar[Optional[RunCheckpoint]] = ContextVar("research_run_checkpoint", default=None)
+
+
+def _checkpoint_get(name: str) -> Optional[Any]:
+    checkpoint = _run_checkpoint.get()
+    value = checkpoint.get(name) if checkpoint is not None else None
+    if value is not None:
+        _count("checkpoint_hits")
+    return value
+
+
+async def _checkpoint_save(name: str, value: Any):
+    checkpoint = _run_checkpoint.get()
+    if checkpoint is not None:
+        await checkpoint.save(name, value)
+
+
+def _draft_checkpoint_name(q: str) -> str:
+    return f"draft:{make_key(normalize_text(q))}"
+
+
+# 带 deadline_ms 的请求的延迟预算，由 conduct_research_stream 初始化；未设置截止时间时为 None
+_request_budget: ContextVar[Optional[ResearchBudget]] = ContextVar("research_request_budget", default=None)
+
+
+def _output_limit(until: Optional[float] = None) -> Dict[str, int]:
+    """有延迟预算时，按到 until（默认为整体截止时间）的剩余时间给出 max_tokens。"""
+    budget = _request_budget.get()
+    return {} if budget is None else {"max_tokens": budget.max_tokens(until)}
+
+
+def _past(until: Optional[float] = None) -> bool:
+    """有延迟预算且已到达 until（默认为整体截止时间）。"""
+    budget = _request_budget.get()
+    return budget is not None and budget.remaining(until) <= 0
+
+
+def _cut_by_budget(chunk, until: Optional[float] = None) -> bool:
+    """有延迟预算，且已到达 until 或输出被预算给出的 max_tokens 上限截断。"""
+    return _past(until) or (_request_budget.get() is not None and _cut_short(chunk))
+
+
+def _budget_stage(stage: str):
+    """有延迟预算时把阶段耗时计入预算统计。"""
+    budget = _request_budget.get()
+    return nullcontext() if budget is None else budget.stage(stage)
+
+
+SINGLE_CALL_PLAN_PROMPT = (
+    "你是一个研究规划助手。\n"
+    "根据用户提出的问题，拆分出 1-3 个关键研究子问题。\n"
+    "注意：子问题要具体、互补、覆盖原始问题的核心维度。\n"
+    "请直接输出你的规划说明，说明你将围绕哪些子问题展开研究。\n"
+    "每个子问题必须单独占一行，并严格以 \"【子问题N】\" 开头（N 为序号），"
+    "例如：【子问题1】……。除子问题行外，不要在其他地方使用该标记。"
+)
+
+
+async def _structured_plan(user_query: str, websocket=None) -> ResearchPlan:
+    """通过结构化输出单独生成 ResearchPlan。"""
+    return await _ainvoke_structured(ResearchPlan, [
+        SystemMessage(
+            content=(
+                "你是一个研究规划助手。\n"
+                "根据用户提出的问题，拆分出 1-3 个关键研究子问题。\n"
+                "注意：子问题要具体、互补、覆盖原始问题的核心维度。"
+            )
+        ),
+        HumanMessage(content=user_query),
+    ], websocket, stage="plan_structured")
+
+
 async def plan_node(state: ResearchState, websocket=None) -> dict:
     """根据用户输入生成 1-3 个子问题的 ResearchPlan。"""
     # 取最后一条用户消息作为"研究目标"
@@ -48,49 +460,102 @@ async def plan_node(state: ResearchState, websocket=None) -> dict:
     user_query = user_messages[-1].content if user_messages else "帮我做一个研究"
 
     # 发送状态消息
-    if websocket:
-        await websocket.send_text(json.dumps({
-            "type": "status",
-            "content": "正在生成研究计划...",
+    await send_frame(websocket, {
+        "type": "status",
+        "content": "正在生成研究计划...",
+        "stage": "plan"
+    })
+
+    # 命中检查点或缓存时按相同帧格式回放规划说明，跳过 LLM 调用
+    cache_key = _plan_cache_key(user_query)
+    cached = _checkpoint_get("plan") or await research_cache.get("plan", cache_key)
+    if cached is not None:
+        await _checkpoint_save("plan", cached)
+        await send_frame(websocket, {
+            "type": "plan",
+            "content": cached["plan_text"],
             "stage": "plan"
-        }))
+        })
+        return {
+            "plan": ResearchPlan(questions=cached["questions"]),
+            "messages": state["messages"] + [
+                AIMessage(content=f"我将围绕以下子问题展开研究：\n{cached['plan_text']}")
+            ],
+        }
 
-    # 先流式输出规划说明
+    # 先流式输出规划说明；single 模式下同一次输出中还包含可解析的子问题行
+    single_call = PLAN_MODE == "single"
+    parser = PlanQuestionParser() if single_call else None
     plan_text = ""
-    async for chunk in llm.astream([
-        SystemMessage(
-            content=(
+    truncated = False
+    # 有延迟预算时，dual 模式的结构化输出与规划说明并发进行，规划说明在规划预算内结束
+    budget = _request_budget.get()
+    plan_deadline = budget.plan_deadline if budget is not None else None
+    structured_task = (
+        asyncio.create_task(_structured_plan(user_query, websocket))
+        if budget is not None and not single_call else None
+    )
+    try:
+        async with aclosing(_astream([
+            SystemMessage(content=SINGLE_CALL_PLAN_PROMPT if single_call else (
                 "你是一个研究规划助手。\n"
                 "根据用户提出的问题，拆分出 1-3 个关键研究子问题。\n"
                 "注意：子问题要具体、互补、覆盖原始问题的核心维度。\n"
                 "请直接输出你的规划说明，说明你将围绕哪些子问题展开研究。"
-            )
-        ),
-        HumanMessage(content=user_query),
-    ]):
-        piece = chunk.content
-        plan_text += piece
+            )),
+            HumanMessage(content=user_query),
+        ], websocket, stage="plan", **_output_limit(plan_deadline))) as stream:
+            async for chunk in stream:
+                piece = chunk.content
+                plan_text += piece
+                truncated = truncated or _cut_short(chunk)
+                if parser:
+                    parser.feed(piece)
 
-        # 通过WebSocket实时发送
-        if websocket:
-            await websocket.send_text(json.dumps({
-                "type": "plan",
-                "content": piece,
-                "stage": "plan"
-            }))
+                # 通过WebSocket实时发送
+                await send_frame(websocket, {
+                    "type": "plan",
+                    "content": piece,
+                    "stage": "plan"
+                })
 
-    # 然后获取结构化输出用于后续处理
-    planner_llm = llm.with_structured_output(ResearchPlan)
-    plan = await planner_llm.ainvoke([
-        SystemMessage(
-            content=(
-                "你是一个研究规划助手。\n"
-                "根据用户提出的问题，拆分出 1-3 个关键研究子问题。\n"
-                "注意：子问题要具体、互补、覆盖原始问题的核心维度。"
-            )
-        ),
-        HumanMessage(content=user_query),
-    ])
+                if _past(plan_deadline):
+                    budget.truncated_plan = True
+                    truncated = True
+                    break
+
+        if truncated and budget is not None:
+            # 规划说明被截断（到达规划截止时间或达到预算给出的 max_tokens），不写入缓存
+            budget.truncated_plan = True
+
+        plan = None
+        if parser:
+            parser.close(truncated)
+            if parser.questions:
+                plan = ResearchPlan(questions=parser.questions)
+            else:
+                logger.warning("单次规划输出中未解析到子问题，回退到结构化输出")
+
+        # 然后获取结构化输出用于后续处理
+        if plan is None and structured_task is not None:
+            try:
+                plan = await asyncio.wait_for(structured_task, max(budget.remaining(budget.research_deadline), 0))
+            except asyncio.TimeoutError:
+                # 研究窗口内拿不到结构化计划时，直接以原问题作为唯一的子问题
+                logger.warning("结构化规划超出延迟预算，以原问题作为子问题")
+                budget.truncated_plan = True
+                plan = ResearchPlan(questions=[user_query])
+        if plan is None:
+            plan = await _structured_plan(user_query, websocket)
+    except BaseException:
+        if structured_task is not None:
+            structured_task.cancel()
+        raise
+
+    # 截断的规划说明不写入缓存，检查点仍保存供本次运行重试
+    if not (budget and budget.truncated_plan):
+        await research_cache.set("plan", cache_key, {"plan_text": plan_text, "questions": plan.questions})
+    await _checkpoint_save("plan", {"plan_text": plan_text, "questions": plan.questions})
 
     # 在对话历史里加一条"规划说明"
     plan_msg = AIMessage(
@@ -103,88 +568,376 @@ async def plan_node(state: ResearchState, websocket=None) -> dict:
     }
 
 
-async def research_node(state: ResearchState, websocket=None) -> dict:
-    if state["plan"] is None or not state["plan"].questions:
-        warn_msg = AIMessage(content="未找到研究计划，无法展开研究。")
-        return {"messages": state["messages"] + [warn_msg]}
+async def _research_question(idx: int, q: str, questions: List[str], websocket=None) -> str:
+    """
+    对单个子问题流式生成分析草稿，返回完整文本。
 
-    drafts: List[str] = []
+    total_questions 取 len(questions)：流水线模式下该列表仍在增长，
+    帧中的数量为当前已知的子问题数。
+    """
+    # 发送状态消息
+    await send_frame(websocket, {
+        "type": "status",
+        "content": f"正在分析子问题 {idx}: {q}",
+        "stage": "research",
+        "question_index": idx,
+        "total_questions": len(questions)
+    })
 
-    for idx, q in enumerate(state["plan"].questions, start=1):
-        # 发送状态消息
-        if websocket:
-            await websocket.send_text(json.dumps({
+    # 重试时复用本次运行已完成的草稿；同一子问题的草稿也可跨请求复用，
+    # 完全相同未命中时再查相似子问题
+    cache_key = _cache_key(q, stages=("research",))
+    near_dup_scope = f"{_stage_model_id('research')}:{PROMPT_VERSION}"
+    checkpoint_name = _draft_checkpoint_name(q)
+    cached = _checkpoint_get(checkpoint_name) or await research_cache.get("draft", cache_key)
+    if cached is None and NEAR_DUP_ENABLED:
+        match = near_dup_index.query(near_dup_scope, q)
+        if match is None:
+            _count("near_dup_misses")
+        else:
+            similar_q, cached, similarity = match
+            _count("near_dup_hits")
+            logger.info(f"子问题 {idx} 复用相似子问题的草稿 (相似度 {similarity:.2f}): {similar_q}")
+            await send_frame(websocket, {
                 "type": "status",
-                "content": f"正在分析子问题 {idx}: {q}",
+                "content": f"子问题 {idx} 与已研究过的子问题相似，复用其分析: {similar_q}",
                 "stage": "research",
                 "question_index": idx,
-                "total_questions": len(state["plan"].questions)
-            }))
+                "total_questions": len(questions)
+            })
+    elif cached is not None and NEAR_DUP_ENABLED:
+        near_dup_index.add(near_dup_scope, q, cached)
 
-        # 累积完整内容
-        full_text = ""
+    if cached is not None:
+        await _checkpoint_save(checkpoint_name, cached)
+        await send_frame(websocket, {
+            "type": "research",
+            "content": cached,
+            "stage": "research",
+            "question_index": idx,
+            "question": q,
+            "total_questions": len(questions)
+        })
+        return cached
 
-        # 异步流式输出
-        async for chunk in llm.astream([
-            SystemMessage(
-                content=(
-                    "你是一名严谨的研究助理。\n"
-                    "请对给定的子问题做一段深入分析，包含：背景、关键因素、"
-                    "当前现状、潜在问题或挑战。不要写成报告，只写该子问题的分析段落。"
-                )
-            ),
-            HumanMessage(content=f"子问题 {idx}: {q}"),
-        ]):
+    # 累积完整内容
+    full_text = ""
+    budget = _request_budget.get()
+    research_deadline = budget.research_deadline if budget is not None else None
+    truncated = False
+
+    # 异步流式输出；有延迟预算时限制输出长度，并在报告阶段必须开始时停止
+    async with aclosing(_astream([
+        SystemMessage(
+            content=(
+                "你是一名严谨的研究助理。\n"
+                "请对给定的子问题做一段深入分析，包含：背景、关键因素、"
+                "当前现状、潜在问题或挑战。不要写成报告，只写该子问题的分析段落。"
+            )
+        ),
+        HumanMessage(content=f"子问题 {idx}: {q}"),
+    ], websocket, stage="research", **_output_limit(research_deadline))) as stream:
+        async for chunk in stream:
             piece = chunk.content
             full_text += piece
 
-            # 通过WebSocket实时发送
-            if websocket:
-                await websocket.send_text(json.dumps({
-                    "type": "research",
-                    "content": piece,
-                    "stage": "research",
-                    "question_index": idx,
-                    "question": q,
-                    "total_questions": len(state["plan"].questions)
-                }))
+            # 通过WebSocket实时发送（并行时不同子问题的帧按 question_index 交错）
+            await send_frame(websocket, {
+                "type": "research",
+                "content": piece,
+                "stage": "research",
+                "question_index": idx,
+                "question": q,
+                "total_questions": len(questions)
+            })
+
+            if _cut_by_budget(chunk, research_deadline):
+                truncated = True
+                break
+
+    if truncated:
+        # 截断（到达研究截止时间或达到预算给出的 max_tokens）的草稿不写入缓存、检查点和相似子问题索引，
+        # 重试或再次提问时完整生成
+        logger.info(f"子问题 {idx} 的草稿因延迟预算被截断")
+        budget.truncated_drafts += 1
+        return full_text
 
-        drafts.append(full_text)
+    await research_cache.set("draft", cache_key, full_text)
+    await _checkpoint_save(checkpoint_name, full_text)
+    if NEAR_DUP_ENABLED:
+        near_dup_index.add(near_dup_scope, q, full_text)
+    return full_text
+
+
+# 子问题失败时的占位草稿前缀，含失败草稿的报告不写入缓存
+FAILED_DRAFT_PREFIX = "（该子问题分析失败："
+# 研究窗口用完、未开始分析的子问题的占位草稿
+SKIPPED_DRAFT = "（因时间预算不足，该子问题未展开分析）"
+
+
+async def _research_worker(idx: int, q: str, questions: List[str], semaphore: asyncio.Semaphore,
+                           errors: List[Exception], websocket=None) -> str:
+    """在并发上限内研究单个子问题；失败时记录错误并返回占位草稿。"""
+    async with semaphore:
+        budget = _request_budget.get()
+        if budget is not None and budget.research_expired():
+            # 排队期间研究窗口已用完，为报告阶段留出时间
+            budget.skipped_drafts += 1
+            await send_frame(websocket, {
+                "type": "status",
+                "content": f"子问题 {idx} 因时间预算不足未展开分析",
+                "stage": "research",
+                "question_index": idx,
+                "total_questions": len(questions)
+            })
+            return SKIPPED_DRAFT
+        try:
+            return await _research_question(idx, q, questions, websocket)
+        except Exception as e:
+            # 单个子问题失败不影响其他子问题，用占位草稿保证顺序与数量不变
+            logger.error(f"子问题 {idx} 分析失败: {e}")
+            errors.append(e)
+            await send_frame(websocket, {
+                "type": "status",
+                "content": f"子问题 {idx} 分析失败: {str(e)}",
+                "stage": "research",
+                "question_index": idx,
+                "total_questions": len(questions)
+            })
+            return f"{FAILED_DRAFT_PREFIX}{str(e)}）"
+
+
+async def research_node(state: ResearchState, websocket=None) -> dict:
+    """并行研究每个子问题，并发数受 RESEARCH_MAX_CONCURRENCY 限制。"""
+    if state["plan"] is None or not state["plan"].questions:
+        warn_msg = AIMessage(content="未找到研究计划，无法展开研究。")
+        return {"messages": state["messages"] + [warn_msg]}
+
+    plan = state["plan"]
+    budget = _request_budget.get()
+    if budget is not None and len(plan.questions) > budget.question_limit():
+        # 研究窗口容不下全部子问题时只研究前几个，报告与结果中的计划随之缩减
+        budget.dropped_questions = len(plan.questions) - budget.max_questions
+        logger.info(f"延迟预算内最多研究 {budget.max_questions} 个子问题，舍弃 {budget.dropped_questions} 个")
+        plan = ResearchPlan(questions=plan.questions[:budget.max_questions])
+
+    questions = plan.questions
+    semaphore = asyncio.Semaphore(RESEARCH_MAX_CONCURRENCY)
+    errors: List[Exception] = []
+
+    # gather 按提交顺序返回结果，drafts 与 plan.questions 一一对应
+    drafts: List[str] = list(await asyncio.gather(*(
+        _research_worker(idx, q, questions, semaphore, errors, websocket)
+        for idx, q in enumerate(questions, start=1)
+    )))
+
+    if len(errors) == len(questions):
+        raise errors[0]
 
     summary_msg = AIMessage(
         content="我已经针对每个子问题分别写好了分析草稿。"
     )
 
     return {
+        "plan": plan,
         "drafts": drafts,
         "messages": state["messages"] + [summary_msg],
     }
 
 
-async def report_node(state: ResearchState, websocket=None) -> dict:
-    """根据 plan.questions + drafts 生成最终报告。"""
-    if state["drafts"] is None or state["plan"] is None:
-        err_msg = AIMessage(content="缺少 drafts 或 plan，无法生成最终报告。")
-        return {"messages": state["messages"] + [err_msg]}
+async def plan_research_pipeline(state: ResearchState, websocket=None) -> dict:
+    """
+    流水线模式的规划 + 研究。
 
-    # 把子问题和对应草稿组织成一个 prompt
-    bullets = []
-    for i, (q, d) in enumerate(zip(state["plan"].questions, state["drafts"]), start=1):
-        bullets.append(f"【子问题 {i}】{q}\n【分析草稿】{d}")
+    使用单次调用规划提示词流式生成计划，每解析出一个完整的子问题行，
+    立即交给研究 worker，不等待规划结束。返回值同时包含 plan 和 drafts。
+    """
+    user_messages = [m for m in state["messages"] if isinstance(m, HumanMessage)]
+    user_query = user_messages[-1].content if user_messages else "帮我做一个研究"
 
-    joined = "\n\n".join(bullets)
+    await send_frame(websocket, {
+        "type": "status",
+        "content": "正在生成研究计划...",
+        "stage": "plan"
+    })
 
-    # 发送状态消息
-    if websocket:
-        await websocket.send_text(json.dumps({
-            "type": "status",
-            "content": "正在生成最终报告...",
-            "stage": "report"
-        }))
+    parser = PlanQuestionParser()
+    # planned 为规划出的全部子问题（写入缓存）；有延迟预算时只研究研究窗口容得下的前几个
+    planned: List[str] = []
+    questions: List[str] = []
+    budget = _request_budget.get()
+    max_questions: Optional[int] = None
+    semaphore = asyncio.Semaphore(RESEARCH_MAX_CONCURRENCY)
+    errors: List[Exception] = []
+    tasks: List[asyncio.Task] = []
+
+    def launch(new_questions: List[str]):
+        for q in new_questions:
+            planned.append(q)
+            if max_questions is not None and len(questions) >= max_questions:
+                budget.dropped_questions += 1
+                continue
+            questions.append(q)
+            tasks.append(asyncio.create_task(
+                _research_worker(len(questions), q, questions, semaphore, errors, websocket)
+            ))
+
+    cache_key = _plan_cache_key(user_query)
+    cached = _checkpoint_get("plan") or await research_cache.get("plan", cache_key)
+    if budget is not None:
+        # 规划来自缓存或检查点时不再需要规划时间，研究窗口按当前剩余时间计算
+        max_questions = budget.question_limit(planned=cached is not None)
+    plan_text = ""
+    truncated = False
+    try:
+        if cached is not None:
+            # 命中检查点或缓存：回放规划说明后一次性启动所有子问题的研究
+            await _checkpoint_save("plan", cached)
+            plan_text = cached["plan_text"]
+            await send_frame(websocket, {
+                "type": "plan",
+                "content": plan_text,
+                "stage": "plan"
+            })
+            launch(cached["questions"])
+        else:
+            # 有延迟预算时，已解析出子问题后规划说明在规划预算内结束
+            plan_deadline = budget.plan_deadline if budget is not None else None
+            async with aclosing(_astream([
+                SystemMessage(content=SINGLE_CALL_PLAN_PROMPT),
+                HumanMessage(content=user_query),
+            ], websocket, stage="plan", **_output_limit(plan_deadline))) as stream:
+                async for chunk in stream:
+                    piece = chunk.content
+                    plan_text += piece
+                    truncated = truncated or _cut_short(chunk)
+
+                    await send_frame(websocket, {
+                        "type": "plan",
+                        "content": piece,
+                        "stage": "plan"
+                    })
+
+                    launch(parser.feed(piece))
+
+                    if planned and _past(plan_deadline):
+                        budget.truncated_plan = True
+                        truncated = True
+                        break
+
+            if truncated and budget is not None:
+                budget.truncated_plan = True
+            launch(parser.close(truncated))
+
+            if not planned:
+                logger.warning("流水线规划未解析到子问题，回退到结构化输出")
+                launch((await _structured_plan(user_query, websocket)).questions)
+
+            # 截断的规划说明不写入缓存，检查点仍保存供本次运行重试
+            if not (budget and budget.truncated_plan):
+                await research_cache.set("plan", cache_key, {"plan_text": plan_text, "questions": list(planned)})
+            await _checkpoint_save("plan", {"plan_text": plan_text, "questions": list(planned)})
+
+        drafts: List[str] = list(await asyncio.gather(*tasks))
+    except BaseException:
+        # 规划失败或被取消时，停止已启动的研究 worker
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if questions and len(errors) == len(questions):
+        raise errors[0]
+
+    plan_msg = AIMessage(
+        content=f"我将围绕以下子问题展开研究：\n{plan_text}"
+    )
+    summary_msg = AIMessage(
+        content="我已经针对每个子问题分别写好了分析草稿。"
+    )
+
+    return {
+        "plan": ResearchPlan(questions=questions),
+        "drafts": drafts,
+        "messages": state["messages"] + [plan_msg, summary_msg],
+    }
+
+
+async def _condense(text: str, max_chars: int, semaphore: asyncio.Semaphore, websocket=None) -> str:
+    """把一段（或一组）子问题草稿提炼为不超过 max_chars 字的要点摘要，不向客户端流式输出。"""
+    cache_key = _cache_key(text, str(max_chars), stages=("digest",))
+    digest = await research_cache.get("digest", cache_key)
+    if digest is not None:
+        return digest
+
+    async with semaphore:
+        digest = ""
+        async for chunk in _astream([
+            SystemMessage(
+                content=(
+                    "你是一名研究助理，负责为撰写最终报告提炼材料。\n"
+                    f"请把给定的子问题分析压缩为不超过 {max_chars} 字的要点摘要：\n"
+                    "1. 保留每个子问题的【子问题 N】标题行。\n"
+                    "2. 只保留关键结论、因素、数据和挑战，删去铺垫与重复表述。\n"
+                    "3. 不要添加原文没有的事实。"
+                )
+            ),
+            HumanMessage(content=text),
+        ], websocket, stage="digest"):
+            digest += chunk.content
+
+    await research_cache.set("digest", cache_key, digest)
+    return digest
+
+
+async def _digest_for_report(sections: List[str], budget_tokens: int, websocket=None) -> List[str]:
+    """
+    map-reduce 压缩报告输入，直到总量不超过 budget_tokens：
+
+    第一轮把每个子问题的草稿并行提炼为摘要，每条目标长度为预算均分（不低于
+    REPORT_DIGEST_MIN_CHARS）；仍超出预算时把相邻摘要按 REPORT_DIGEST_FAN_IN 分组
+    再提炼，逐层汇总。模型未遵守长度要求时按预算截断，保证输入有上界。
+    """
+    budget_chars = budget_tokens * 2
+    semaphore = asyncio.Semaphore(RESEARCH_MAX_CONCURRENCY)
+    items = sections
+    rounds = 0
+    while estimate_tokens("\n\n".join(items)) > budget_tokens and rounds < 3:
+        if rounds > 0 and len(items) > 1:
+            items = [
+                "\n\n".join(items[i:i + REPORT_DIGEST_FAN_IN])
+                for i in range(0, len(items), REPORT_DIGEST_FAN_IN)
+            ]
+        target = max(budget_chars // len(items), REPORT_DIGEST_MIN_CHARS)
+        items = list(await asyncio.gather(*(_condense(item, target, semaphore, websocket) for item in items)))
+        _count("report_digests", len(items))
+        rounds += 1
 
-    # 异步流式输出
+    return _truncate_for_report(items, budget_tokens)
+
+
+def _truncate_for_report(items: List[str], budget_tokens: int) -> List[str]:
+    """总量超出 budget_tokens 时把每一项按预算均分截断。"""
+    if estimate_tokens("\n\n".join(items)) > budget_tokens:
+        per_item = max(budget_tokens * 2 // len(items) - 2, 1)
+        items = [item[:per_item] for item in items]
+    return items
+
+
+REPORT_SECTION_PROMPT = (
+    "你是一名擅长写结构化研究报告的写作者。\n"
+    "一篇中文研究报告按大纲分节、由多位作者并行撰写，你只负责其中一节。\n"
+    "要求：\n"
+    "1. 只输出本节正文，不要输出本节标题，也不要写其他小节的内容。\n"
+    "2. 语言要自然流畅，逻辑清晰，不要逐句照抄材料，可以适当重写和融合。\n"
+    "3. 不要添加与材料无关的硬事实；可以做合理的概括与归纳。"
+)
+
+
+async def _single_report(report_input: str, material: str, websocket=None) -> str:
+    """单次流式生成整篇报告。"""
+    # 异步流式输出；有延迟预算时按剩余时间限制输出长度，到达截止时间时停止
     final_report = ""
-    async for chunk in llm.astream([
+    async with aclosing(_astream([
         SystemMessage(
             content=(
                 "你是一名擅长写结构化研究报告的写作者。\n"
@@ -198,21 +951,166 @@ async def report_node(state: ResearchState, websocket=None) -> dict:
         ),
         HumanMessage(
             content=(
-                "以下是子问题及对应分析草稿，请据此生成最终报告：\n\n"
-                f"{joined}"
+                f"以下是子问题及对应{material}，请据此生成最终报告：\n\n"
+                f"{report_input}"
             )
         ),
-    ]):
-        piece = chunk.content
-        final_report += piece
+    ], websocket, stage="report", **_output_limit())) as stream:
+        async for chunk in stream:
+            piece = chunk.content
+            final_report += piece
 
-        # 通过WebSocket实时发送
-        if websocket:
-            await websocket.send_text(json.dumps({
+            # 通过WebSocket实时发送
+            await send_frame(websocket, {
                 "type": "report",
                 "content": piece,
                 "stage": "report"
-            }))
+            })
+
+            if _cut_by_budget(chunk):
+                _request_budget.get().truncated_report = True
+                break
+    return final_report
+
+
+async def _report_outline(questions: List[str], websocket=None) -> ReportOutline:
+    """生成报告大纲：引言、每个子问题一节、结论。模型给出的节数不符时使用默认标题。"""
+    outline = await _ainvoke_structured(ReportOutline, [
+        SystemMessage(
+            content=(
+                "你是一名研究报告的主编。\n"
+                f"请为一篇围绕以下 {len(questions)} 个子问题的中文研究报告拟定标题和大纲：\n"
+                f"共 {len(questions) + 2} 节，依次为引言、每个子问题各一节、小结与展望。只给出各节标题。"
+            )
+        ),
+        HumanMessage(content="\n".join(f"【子问题 {i}】{q}" for i, q in enumerate(questions, start=1))),
+    ], websocket, stage="outline")
+
+    if len(outline.sections) != len(questions) + 2:
+        logger.warning(f"报告大纲节数为 {len(outline.sections)}，与子问题数不符，使用默认标题")
+        outline.sections = ["引言"] + list(questions) + ["小结与展望"]
+    return outline
+
+
+async def _write_section(messages, semaphore: asyncio.Semaphore, queue: asyncio.Queue, websocket=None):
+    """撰写一节并把文本片段放入 queue，结束时放入 None；失败时放入异常。"""
+    try:
+        async with semaphore, aclosing(_astream(messages, websocket, stage="report", **_output_limit())) as stream:
+            async for chunk in stream:
+                queue.put_nowait(chunk.content)
+                if _cut_by_budget(chunk):
+                    _request_budget.get().truncated_report = True
+                    break
+        queue.put_nowait(None)
+    except Exception as e:
+        queue.put_nowait(e)
+
+
+async def _sectioned_report(questions: List[str], sections: List[str], overview: str,
+                            websocket=None) -> str:
+    """
+    分节并行生成报告：先生成大纲，再并发撰写各节，按文档顺序流式发送。
+
+    当前节之后的小节提前完成的内容缓冲在各自的队列中，轮到时一次性发出。
+    引言与结论参考全部材料（overview），正文各节只参考对应子问题的草稿。
+    """
+    outline = await _report_outline(questions, websocket)
+    outline_text = "\n".join(f"{i}. {heading}" for i, heading in enumerate(outline.sections, start=1))
+    materials = [overview] + sections + [overview]
+
+    semaphore = asyncio.Semaphore(RESEARCH_MAX_CONCURRENCY)
+    queues = [asyncio.Queue() for _ in outline.sections]
+    tasks = [
+        asyncio.create_task(_write_section([
+            SystemMessage(content=REPORT_SECTION_PROMPT),
+            HumanMessage(
+                content=(
+                    f"报告标题：{outline.title}\n报告大纲：\n{outline_text}\n\n"
+                    f"你负责的小节：{heading}\n\n参考材料：\n{material}"
+                )
+            ),
+        ], semaphore, queue, websocket))
+        for heading, material, queue in zip(outline.sections, materials, queues)
+    ]
+
+    final_report = ""
+    try:
+        for index, (heading, queue) in enumerate(zip(outline.sections, queues)):
+            prefix = f"# {outline.title}\n\n" if index == 0 else "\n\n"
+            piece = f"{prefix}## {heading}\n\n"
+            while True:
+                final_report += piece
+                await send_frame(websocket, {
+                    "type": "report",
+                    "content": piece,
+                    "stage": "report"
+                })
+                piece = await queue.get()
+                if piece is None:
+                    break
+                if isinstance(piece, Exception):
+                    raise piece
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return final_report
+
+
+async def report_node(state: ResearchState, websocket=None) -> dict:
+    """根据 plan.questions + drafts 生成最终报告。"""
+    if state["drafts"] is None or state["plan"] is None:
+        err_msg = AIMessage(content="缺少 drafts 或 plan，无法生成最终报告。")
+        return {"messages": state["messages"] + [err_msg]}
+
+    # 把子问题和对应草稿组织成一个 prompt
+    bullets = []
+    for i, (q, d) in enumerate(zip(state["plan"].questions, state["drafts"]), start=1):
+        bullets.append(f"【子问题 {i}】{q}\n【分析草稿】{d}")
+
+    joined = "\n\n".join(bullets)
+
+    # 发送状态消息
+    await send_frame(websocket, {
+        "type": "status",
+        "content": "正在生成最终报告...",
+        "stage": "report"
+    })
+
+    # 报告由全部子问题及草稿决定，命中缓存时整段回放
+    cache_key = _report_cache_key(joined)
+    final_report = _checkpoint_get("report") or await research_cache.get("report", cache_key)
+    if final_report is not None:
+        await send_frame(websocket, {
+            "type": "report",
+            "content": final_report,
+            "stage": "report"
+        })
+    else:
+        # 草稿总量超出预算时先提炼要点摘要，报告输入规模保持有界
+        report_input, material = joined, "分析草稿"
+        budget = _request_budget.get()
+        if budget is not None and estimate_tokens(joined) > REPORT_INPUT_TOKEN_BUDGET:
+            # 有延迟预算时不再花一轮 LLM 调用提炼，直接按预算截断草稿
+            report_input = "\n\n".join(_truncate_for_report(bullets, REPORT_INPUT_TOKEN_BUDGET))
+        elif estimate_tokens(joined) > REPORT_INPUT_TOKEN_BUDGET:
+            await send_frame(websocket, {
+                "type": "status",
+                "content": "分析草稿较长，正在并行提炼要点...",
+                "stage": "report"
+            })
+            report_input = "\n\n".join(await _digest_for_report(bullets, REPORT_INPUT_TOKEN_BUDGET, websocket))
+            material = "分析要点（由草稿提炼）"
+
+        if REPORT_MODE == "sectioned":
+            final_report = await _sectioned_report(state["plan"].questions, bullets, report_input, websocket)
+        else:
+            final_report = await _single_report(report_input, material, websocket)
+
+        # 含失败草稿或因延迟预算降级的报告不写入缓存和检查点
+        if not any(d.startswith(FAILED_DRAFT_PREFIX) for d in state["drafts"]) and not (budget and budget.degraded):
+            await research_cache.set("report", cache_key, final_report)
+            await _checkpoint_save("report", final_report)
 
     report_msg = AIMessage(
         content="下面是根据分析草稿整合出的最终报告：\n\n" + final_report
@@ -223,94 +1121,183 @@ async def report_node(state: ResearchState, websocket=None) -> dict:
         "messages": state["messages"] + [report_msg],
     }
 
+
 # ===================== 4. 搭建 LangGraph =====================
 
-workflow = StateGraph(ResearchState)
+@lru_cache(maxsize=None)
+def get_graph():
+    """
+    编译后的 LangGraph（plan -> research -> report），首次调用时编译。
+
+    conduct_research_stream 直接调用各节点函数以保持流式输出，不经过该图；
+    需要以 LangGraph 方式运行或可视化时使用。
+    """
+    from langgraph.graph import StateGraph, START, END, MessagesState
+
+    class GraphState(ResearchState, MessagesState):
+        pass
+
+    workflow = StateGraph(GraphState)
+
+    workflow.add_node("plan", plan_node)
+    workflow.add_node("research", research_node)
+    workflow.add_node("report", report_node)
+
+    workflow.add_edge(START, "plan")
+    workflow.add_edge("plan", "research")
+    workflow.add_edge("research", "report")
+    workflow.add_edge("report", END)
+
+    return workflow.compile()
 
-workflow.add_node("plan", plan_node)
-workflow.add_node("research", research_node)
-workflow.add_node("report", report_node)
 
-workflow.add_edge(START, "plan")
-workflow.add_edge("plan", "research")
-workflow.add_edge("research", "report")
-workflow.add_edge("report", END)
+def __getattr__(name: str):
+    # 兼容旧的模块级属性（现在按需创建）：app 为编译后的图，llm / MODEL_NAME / model_router 为模型
+    if name == "app":
+        return get_graph()
+    if name == "model_router":
+        return get_model_router()
+    if name == "llm":
+        return get_model_router().default
+    if name == "MODEL_NAME":
+        return get_model_router().default_name
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-app = workflow.compile()
 
 # ===================== 5. 主要的异步研究函数 =====================
 
-async def conduct_research_stream(user_question: str, websocket=None):
+def _result_dict(state: ResearchState) -> Dict[str, Any]:
+    """把最终状态整理成可 JSON 序列化的结果。"""
+    return {
+        "plan": state["plan"].dict() if state.get("plan") else None,
+        "drafts": state.get("drafts"),
+        "report": state.get("report"),
+        "messages": [msg.content for msg in state["messages"]]
+    }
+
+
+async def conduct_research_stream(user_question: str, websocket=None, run_id: Optional[str] = None,
+                                  deadline_ms: Optional[int] = None) -> Dict[str, Any]:
     """
     进行研究并通过WebSocket流式返回结果
 
     Args:
         user_question: 用户问题
-        websocket: WebSocket连接对象
+        websocket: WebSocket连接对象，也可以是任何实现了 send_frame 或 send_text 的对象
+        run_id: 研究运行 ID。给定时各阶段结果持久化为检查点，以相同 run_id 重试时
+            跳过已完成的规划、子问题草稿和报告
+        deadline_ms: 延迟预算（毫秒）。给定时按预算限制子问题数量和输出长度，
+            必要时提前结束草稿以保证报告按时完成，complete 帧附带预算使用情况
+
+    Returns:
+        研究结果（plan / drafts / report / messages），有延迟预算时附带 budget
     """
+    stats: Dict[str, int] = {}
+    stats_token = _request_stats.set(stats)
+    checkpoint_token = _run_checkpoint.set(None)
+    budget = ResearchBudget(deadline_ms, RESEARCH_MAX_CONCURRENCY) if deadline_ms is not None else None
+    budget_token = _request_budget.set(budget)
+
     try:
         # 发送开始消息
-        if websocket:
-            await websocket.send_text(json.dumps({
-                "type": "start",
-                "content": "开始分析您的问题...",
-                "stage": "start"
-            }))
+        await send_frame(websocket, {
+            "type": "start",
+            "content": "开始分析您的问题...",
+            "stage": "start"
+        })
+
+        # 模型客户端尚未创建时在线程中创建；之后各节点（缓存键、阶段配置）同步获取路由不再阻塞事件循环
+        router = await aget_model_router()
+
+        if run_id is not None:
+            checkpoint = await checkpoint_store.open(run_id, user_question, deadline_ms)
+            _run_checkpoint.set(checkpoint)
+            if checkpoint.restored:
+                logger.info(f"研究运行 {run_id} 从检查点恢复，已完成的阶段将直接复用")
+                await send_frame(websocket, {
+                    "type": "status",
+                    "content": "从上次中断处继续，已完成的阶段将直接复用...",
+                    "stage": "start"
+                })
 
         # 创建初始状态
         initial_state = ResearchState(
-            messages=[HumanMessage(content=user_question)]
+            messages=[HumanMessage(content=user_question)],
+            plan=None,
+            drafts=None,
+            report=None,
         )
 
         # 直接调用节点函数以保持流式输出
-        # 步骤1: 计划节点
-        plan_result = await plan_node(initial_state, websocket)
+        if EXECUTION_MODE == "pipeline":
+            # 步骤1+2: 规划与研究流水线并行
+            with observe_duration(STAGE_DURATION, stage="plan_research", model=router.model_name("plan")), _budget_stage("plan_research"):
+                pipeline_result = await plan_research_pipeline(initial_state, websocket)
 
-        # 更新状态
-        initial_state["plan"] = plan_result["plan"]
-        initial_state["messages"] = plan_result["messages"]
+            initial_state["plan"] = pipeline_result["plan"]
+            initial_state["drafts"] = pipeline_result["drafts"]
+            initial_state["messages"] = pipeline_result["messages"]
+        else:
+            # 步骤1: 计划节点
+            with observe_duration(STAGE_DURATION, stage="plan", model=router.model_name("plan")), _budget_stage("plan"):
+                plan_result = await plan_node(initial_state, websocket)
 
-        # 步骤2: 研究节点
-        research_result = await research_node(initial_state, websocket)
+            # 更新状态
+            initial_state["plan"] = plan_result["plan"]
+            initial_state["messages"] = plan_result["messages"]
 
-        # 更新状态
-        initial_state["drafts"] = research_result["drafts"]
-        initial_state["messages"] = research_result["messages"]
+            # 步骤2: 研究节点
+            with observe_duration(STAGE_DURATION, stage="research", model=router.model_name("research")), _budget_stage("research"):
+                research_result = await research_node(initial_state, websocket)
+
+            # 更新状态（延迟预算不足时计划会被缩减）
+            initial_state["plan"] = research_result.get("plan", initial_state["plan"])
+            initial_state["drafts"] = research_result["drafts"]
+            initial_state["messages"] = research_result["messages"]
 
         # 步骤3: 报告节点
-        report_result = await report_node(initial_state, websocket)
+        with observe_duration(STAGE_DURATION, stage="report", model=router.model_name("report")), _budget_stage("report"):
+            report_result = await report_node(initial_state, websocket)
+
+        initial_state["report"] = report_result.get("report")
+        initial_state["messages"] = report_result["messages"]
 
         # 发送完成消息
-        if websocket:
-            await websocket.send_text(json.dumps({
-                "type": "complete",
-                "content": "研究完成！",
-                "stage": "complete"
-            }))
+        complete = {
+            "type": "complete",
+            "content": "研究完成！",
+            "stage": "complete",
+            "stats": stats
+        }
+        if budget is not None:
+            complete["budget"] = budget.summary()
+        await send_frame(websocket, complete)
+
+        result = _result_dict(initial_state)
+        result["stats"] = stats
+        if budget is not None:
+            result["budget"] = complete["budget"]
+        return result
 
     except Exception as e:
         # 发送错误消息
-        if websocket:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "content": f"研究过程中发生错误: {str(e)}",
-                "stage": "error"
-            }))
+        await send_frame(websocket, {
+            "type": "error",
+            "content": f"研究过程中发生错误: {str(e)}",
+            "stage": "error"
+        })
         raise
+    finally:
+        _request_budget.reset(budget_token)
+        _run_checkpoint.reset(checkpoint_token)
+        _request_stats.reset(stats_token)
 
 # 非WebSocket版本的同步接口（保持兼容性）
 def conduct_research_sync(user_question: str) -> Dict[str, Any]:
     """
-    同步版本的研究接口，用于REST API
-    """
-    initial_state = ResearchState(
-        messages=[HumanMessage(content=user_question)]
-    )
+    同步版本的研究接口，用于脚本等没有事件循环的场景。
 
-    result = app.invoke(initial_state)
-    return {
-        "plan": result["plan"].dict() if result["plan"] else None,
-        "drafts": result["drafts"],
-        "report": result["report"],
-        "messages": [msg.content for msg in result["messages"]]
-    }
\ No newline at end of file
+    注意：内部会启动新的事件循环，不能在 async 函数中调用；
+    Web 服务请使用 conduct_research_stream 或 jobs 模块的异步任务接口。
+    """
+    return asyncio.run(conduct_research_stream(user_question))
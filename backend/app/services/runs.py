@@ -0,0 +1,222 @@
+import os
+import uuid
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, Any, Optional, Set, Tuple
+
+from .cache import normalize_text
+from .research import conduct_research_stream
+from .checkpoints import checkpoint_store
+
+logger = logging.getLogger(__name__)
+
+# 每个研究运行保留的最近帧数（事件日志上限），用于断线续传和后加入订阅者的回放
+RUN_EVENT_LOG_MAX_FRAMES = max(1, int(os.getenv("RUN_EVENT_LOG_MAX_FRAMES", "10000")))
+# 客户端断线后研究继续运行、等待续传的宽限时间（秒）；运行结束后同样保留这段时间
+RUN_RESUME_GRACE_SECONDS = float(os.getenv("RUN_RESUME_GRACE_SECONDS", "60"))
+
+
+class ResearchRun:
+    """
+    一次可被多个客户端共享的研究运行（single-flight）。
+
+    作为 conduct_research_stream 的帧接收方，为每帧分配递增的序号（seq）并追加到
+    有界事件日志，同时广播给每个订阅者；start 帧额外携带 run_id。后加入或断线
+    续传的订阅者会先收到日志中指定序号之后的帧，再接收实时帧。流结束时向订阅队列投递 None。
+    """
+
+    def __init__(self, key: str, question: str, max_frames: int = RUN_EVENT_LOG_MAX_FRAMES,
+                 run_id: Optional[str] = None, deadline_ms: Optional[int] = None):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.key = key
+        self.question = question
+        self.deadline_ms = deadline_ms
+        self.frames: Deque[Dict[str, Any]] = deque(maxlen=max_frames)
+        self.seq = 0
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+        self.finished = False
+        self.task: Optional[asyncio.Task] = None
+        self.idle_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def first_seq(self) -> int:
+        """事件日志中最早一帧的序号，日志为空时为下一帧的序号。"""
+        return self.frames[0]["seq"] if self.frames else self.seq + 1
+
+    @property
+    def truncated(self) -> bool:
+        """事件日志是否已丢弃最早的帧。"""
+        return self.first_seq > 1
+
+    async def send_frame(self, frame: Dict[str, Any]):
+        self.seq += 1
+        frame = dict(frame, seq=self.seq)
+        if frame.get("type") == "start":
+            frame["run_id"] = self.run_id
+        self.frames.append(frame)
+        for queue in self.subscribers:
+            queue.put_nowait(frame)
+
+    def subscribe(self, after_seq: int = 0) -> asyncio.Queue:
+        """订阅运行，先回放序号大于 after_seq 的帧。"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for frame in self.frames:
+            if frame["seq"] > after_seq:
+                queue.put_nowait(frame)
+        if self.finished:
+            queue.put_nowait(None)
+        else:
+            self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> bool:
+        """移除订阅者，返回是否已没有订阅者。"""
+        self.subscribers.discard(queue)
+        return not self.subscribers
+
+    async def execute(self):
+        try:
+            self.result = await conduct_research_stream(self.question, self, run_id=self.run_id,
+                                                        deadline_ms=self.deadline_ms)
+        except asyncio.CancelledError:
+            logger.info(f"共享研究已取消: {self.run_id}")
+            raise
+        except Exception as e:
+            logger.error(f"共享研究 {self.run_id} 失败: {e}")
+            self.error = e
+        finally:
+            self.finished = True
+            for queue in self.subscribers:
+                queue.put_nowait(None)
+            self.subscribers.clear()
+
+
+def _run_key(question: str, deadline_ms: Optional[int]) -> str:
+    """合并相同问题的登记键：带延迟预算的运行只与相同 deadline_ms 的运行合并。"""
+    key = normalize_text(question)
+    return key if deadline_ms is None else f"{key}@{deadline_ms}ms"
+
+
+class RunRegistry:
+    """
+    进行中研究的登记表：相同（归一化后）问题的并发请求挂到同一个运行上。
+
+    最后一个订阅者离开时可以立即取消运行，也可以保留一段宽限时间等待断线的客户端
+    通过 run_id 续传；运行结束后从问题登记中移除（之后的相同问题会发起新的运行，
+    通常由缓存直接命中），但在宽限时间内仍可按 run_id 续传。
+    """
+
+    def __init__(self, grace_seconds: float = RUN_RESUME_GRACE_SECONDS):
+        self.grace_seconds = grace_seconds
+        self.runs: Dict[str, ResearchRun] = {}
+        self.runs_by_id: Dict[str, ResearchRun] = {}
+
+    def attach(self, question: str, deadline_ms: Optional[int] = None) -> Tuple[ResearchRun, asyncio.Queue]:
+        """
+        订阅问题对应的运行，不存在时创建并启动。
+
+        带延迟预算的请求只与相同问题、相同 deadline_ms 的运行合并。
+        """
+        key = _run_key(question, deadline_ms)
+        run = self.runs.get(key)
+        if run is not None and run.truncated:
+            # 事件日志已截断，新订阅者无法得到完整回放，改为发起新的运行
+            logger.info(f"研究运行 {run.run_id} 的事件日志已截断，不再合并相同问题")
+            run = None
+        if run is None:
+            run = self._start(ResearchRun(key, question, deadline_ms=deadline_ms))
+            self.runs[key] = run
+            logger.info(f"发起新的研究运行: {run.run_id}")
+        else:
+            logger.info(f"相同问题合并到进行中的研究运行: {run.run_id}，已有 {len(run.subscribers)} 个订阅者")
+        return run, self._subscribe(run)
+
+    def resume(self, run_id: str, last_seq: int) -> Tuple[ResearchRun, asyncio.Queue]:
+        """
+        续传指定运行，回放 last_seq 之后的帧并接收实时帧。
+
+        运行不存在（或已过宽限期）时抛出 KeyError；所需的帧已被事件日志丢弃时抛出 ValueError。
+        """
+        run = self.runs_by_id.get(run_id)
+        if run is None:
+            raise KeyError(run_id)
+        if last_seq + 1 < run.first_seq:
+            raise ValueError(f"事件日志只保留序号 {run.first_seq} 之后的帧")
+        logger.info(f"续传研究运行: {run_id}，从序号 {last_seq + 1} 开始")
+        return run, self._subscribe(run, last_seq)
+
+    async def retry(self, run_id: str) -> Tuple[ResearchRun, asyncio.Queue]:
+        """
+        以相同 run_id 重新执行已结束（通常是失败）的运行，检查点中已完成的阶段直接复用。
+
+        运行仍在进行时直接订阅它；运行不在内存中时（如进程重启后）从检查点读取问题与 deadline_ms。
+        重试沿用原运行的延迟预算。
+        找不到运行及其检查点时抛出 KeyError。
+        """
+        run = self.runs_by_id.get(run_id)
+        if run is not None and not run.finished:
+            return run, self._subscribe(run)
+
+        if run is not None:
+            question, deadline_ms = run.question, run.deadline_ms
+        else:
+            values = await checkpoint_store.load(run_id)
+            question, deadline_ms = values.get("question"), values.get("deadline_ms")
+        if question is None:
+            raise KeyError(run_id)
+        run = self._start(ResearchRun(_run_key(question, deadline_ms), question, run_id=run_id,
+                                      deadline_ms=deadline_ms))
+        self.runs.setdefault(run.key, run)
+        logger.info(f"重试研究运行: {run_id}")
+        return run, self._subscribe(run)
+
+    def detach(self, run: ResearchRun, queue: asyncio.Queue, grace: float = 0):
+        """取消订阅；运行未结束且已无订阅者时，在 grace 秒后（仍无人续传时）取消运行。"""
+        if not run.unsubscribe(queue) or run.finished or run.task is None:
+            return
+        if grace <= 0:
+            self.cancel_if_idle(run)
+            return
+        logger.info(f"研究运行已无订阅者，{grace:.0f} 秒内未续传将取消: {run.run_id}")
+        run.idle_handle = asyncio.get_running_loop().call_later(grace, self.cancel_if_idle, run)
+
+    def cancel_if_idle(self, run: ResearchRun):
+        """运行未结束且没有订阅者时立即取消。"""
+        if run.idle_handle is not None:
+            run.idle_handle.cancel()
+            run.idle_handle = None
+        if not run.subscribers and not run.finished and run.task is not None:
+            logger.info(f"研究运行已无订阅者，取消: {run.run_id}")
+            run.task.cancel()
+
+    def _start(self, run: ResearchRun) -> ResearchRun:
+        self.runs_by_id[run.run_id] = run
+        run.task = asyncio.create_task(run.execute())
+        run.task.add_done_callback(lambda _task, run=run: self._forget(run))
+        return run
+
+    def _subscribe(self, run: ResearchRun, after_seq: int = 0) -> asyncio.Queue:
+        if run.idle_handle is not None:
+            run.idle_handle.cancel()
+            run.idle_handle = None
+        return run.subscribe(after_seq)
+
+    def _forget(self, run: ResearchRun):
+        if self.runs.get(run.key) is run:
+            del self.runs[run.key]
+        if run.idle_handle is not None:
+            run.idle_handle.cancel()
+            run.idle_handle = None
+        # 结束的运行在宽限时间内仍可续传，之后释放事件日志
+        asyncio.get_running_loop().call_later(self.grace_seconds, self._expire, run)
+
+    def _expire(self, run: ResearchRun):
+        # 同一 run_id 可能已被重试的新运行占用
+        if self.runs_by_id.get(run.run_id) is run:
+            del self.runs_by_id[run.run_id]
+
+
+run_registry = RunRegistry()
@@ -0,0 +1,261 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, Deque, List, Optional
+
+from .streaming import send_frame
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# 全局同时进行的上游 LLM 调用上限
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "8")))
+# 每分钟 token 预算（输入 + 输出，估算值），0 表示不限制
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+# 每次调用预估的输出 token 数，准入时与输入一起预占预算，调用结束后按实际用量修正
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "1000"))
+# 排队等待的调用数上限，超出时直接拒绝
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "100"))
+
+# 当前调用所属的客户端（连接或后台任务），用于按客户端公平排队
+current_client_id: ContextVar[str] = ContextVar("llm_client_id", default="anonymous")
+
+
+class LLMOverloadedError(Exception):
+    """LLM 调用队列已满，请求被拒绝。"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文约 1~1.5 字符/token，英文约 4 字符/token，取折中。"""
+    return max(1, len(text) // 2)
+
+
+def estimate_message_tokens(messages) -> int:
+    return sum(estimate_tokens(str(m.content)) for m in messages)
+
+
+class _Waiter:
+    def __init__(self, client_id: str, tokens: int):
+        self.client_id = client_id
+        self.tokens = tokens
+        self.granted = False
+        self.entry: Optional[List] = None
+        self.updated = asyncio.Event()
+
+
+class LLMSlot:
+    """一次已准入的 LLM 调用，调用方通过 record_output 记录输出以修正 token 用量。"""
+
+    def __init__(self, reserved_tokens: int, queue_wait: float = 0.0):
+        self.reserved_tokens = reserved_tokens
+        self.queue_wait = queue_wait
+        self.input_tokens = reserved_tokens - LLM_EXPECTED_OUTPUT_TOKENS
+        self.output_chars = 0
+        self.usage_tokens: Optional[int] = None
+
+    def record_output(self, text: str, usage: Optional[dict] = None):
+        self.output_chars += len(text)
+        if usage and usage.get("total_tokens"):
+            self.usage_tokens = usage["total_tokens"]
+
+    def used_tokens(self) -> int:
+        if self.usage_tokens is not None:
+            return self.usage_tokens
+        return self.input_tokens + self.output_chars // 2
+
+
+class LLMScheduler:
+    """
+    上游 LLM 调用的全局准入控制。
+
+    - 全局并发上限与每分钟 token 预算（滑动 60 秒窗口）
+    - 按客户端轮转的公平队列：每个客户端一个 FIFO，依次从各客户端取一个请求放行，
+      单个客户端的大量并行调用不会饿死其他客户端
+    - 排队期间向调用方推送 status 帧告知排队位置；队列超过上限时抛出 LLMOverloadedError
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 max_queue_depth: int = LLM_MAX_QUEUE_DEPTH):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue_depth = max_queue_depth
+        self.active = 0
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._waiting = 0
+        # 滑动窗口内的 token 记录：[时间, token 数]，调用结束后原地修正为实际用量
+        self._ledger: Deque[List] = deque()
+        self._retry_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self, input_tokens: int, websocket=None, client_id: Optional[str] = None):
+        """
+        在准入后执行一次 LLM 调用：
+
+            async with llm_scheduler.slot(tokens, websocket) as slot:
+                ...
+        """
+        reserved = input_tokens + LLM_EXPECTED_OUTPUT_TOKENS
+        started = time.monotonic()
+        entry = await self._acquire(reserved, websocket, client_id or current_client_id.get())
+        slot = LLMSlot(reserved, time.monotonic() - started)
+        try:
+            yield slot
+        finally:
+            self._release(entry, slot.used_tokens())
+
+    def try_admit(self, tokens: int) -> Optional[Callable[[], None]]:
+        """
+        不排队的准入（用于对冲请求）：当前有空闲名额和 token 预算、且没有排队的调用时立即占用一个名额，
+        返回释放函数（按预占的 token 数记账，可重复调用）；否则返回 None，调用方应放弃这次额外请求。
+        """
+        if self._queues or self.active >= self.max_concurrency or not self._has_budget(tokens):
+            return None
+        entry = self._admit(tokens)
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._release(entry, tokens)
+
+        return release
+
+    async def _acquire(self, tokens: int, websocket, client_id: str) -> Optional[List]:
+        if not self._queues and self.active < self.max_concurrency and self._has_budget(tokens):
+            return self._admit(tokens)
+
+        if self._waiting >= self.max_queue_depth:
+            logger.warning(f"LLM 调用队列已满 ({self._waiting})，拒绝客户端 {client_id} 的请求")
+            raise LLMOverloadedError(f"服务繁忙：模型调用排队已达上限（{self.max_queue_depth}），请稍后重试")
+
+        waiter = _Waiter(client_id, tokens)
+        self._queues.setdefault(client_id, deque()).append(waiter)
+        self._waiting += 1
+        self._dispatch()
+
+        last_position = None
+        try:
+            while not waiter.granted:
+                position = self._position(waiter)
+                if position != last_position:
+                    last_position = position
+                    await send_frame(websocket, {
+                        "type": "status",
+                        "content": f"模型调用排队中，当前位置 {position}",
+                        "stage": "queue",
+                        "queue_position": position
+                    })
+                    continue
+                waiter.updated.clear()
+                await waiter.updated.wait()
+        except BaseException:
+            if waiter.granted:
+                self._release(waiter.entry, 0)
+            else:
+                self._remove(waiter)
+            raise
+        return waiter.entry
+
+    def _admit(self, tokens: int) -> Optional[List]:
+        self.active += 1
+        if not self.tokens_per_minute:
+            return None
+        entry = [time.monotonic(), tokens]
+        self._ledger.append(entry)
+        return entry
+
+    def _release(self, entry: Optional[List], used: int):
+        self.active -= 1
+        if entry is not None:
+            # 用实际用量修正预占的 token 数
+            entry[1] = used
+        self._dispatch()
+
+    def _has_budget(self, tokens: int) -> bool:
+        if not self.tokens_per_minute:
+            return True
+        used = self._used_tokens()
+        # 单次请求超过整个预算时，窗口为空即放行，避免永久阻塞
+        return used + tokens <= self.tokens_per_minute or not self._ledger
+
+    def _used_tokens(self) -> int:
+        cutoff = time.monotonic() - 60
+        while self._ledger and self._ledger[0][0] < cutoff:
+            self._ledger.popleft()
+        return sum(tokens for _, tokens in self._ledger)
+
+    def _dispatch(self):
+        """按客户端轮转放行排队的调用，并通知仍在排队者位置变化。"""
+        while self._queues and self.active < self.max_concurrency:
+            client_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if not self._has_budget(waiter.tokens):
+                self._schedule_retry()
+                break
+            queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(client_id)
+            else:
+                del self._queues[client_id]
+            waiter.entry = self._admit(waiter.tokens)
+            waiter.granted = True
+            waiter.updated.set()
+
+        for queue in self._queues.values():
+            for waiter in queue:
+                waiter.updated.set()
+
+    def _schedule_retry(self):
+        """token 预算不足时，等最早的记录滑出窗口后再尝试放行。"""
+        if self._retry_handle is not None or not self._ledger:
+            return
+        delay = max(self._ledger[0][0] + 60 - time.monotonic(), 0.05)
+
+        def retry():
+            self._retry_handle = None
+            self._dispatch()
+
+        self._retry_handle = asyncio.get_running_loop().call_later(delay, retry)
+
+    def _position(self, waiter: _Waiter) -> int:
+        """估算排队位置：轮转调度下排在该请求之前会被放行的调用数 + 1。"""
+        index = self._queues[waiter.client_id].index(waiter)
+        ahead = 0
+        before_own = True
+        for client_id, queue in self._queues.items():
+            if client_id == waiter.client_id:
+                before_own = False
+                ahead += index
+                continue
+            # 每轮每个客户端放行一个；排在本客户端之前的客户端在同一轮中还会先放行一个
+            ahead += min(len(queue), index)
+            if before_own and len(queue) > index:
+                ahead += 1
+        return ahead + 1
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.client_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._waiting -= 1
+        if not queue:
+            del self._queues[waiter.client_id]
+        self._dispatch()
+
+
+llm_scheduler = LLMScheduler()
+
+registry.gauge("llm_active_calls", "正在进行的上游 LLM 调用数", lambda: llm_scheduler.active)
+registry.gauge("llm_queued_calls", "排队等待准入的 LLM 调用数", lambda: llm_scheduler.waiting)
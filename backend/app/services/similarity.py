@@ -0,0 +1,112 @@
+import os
+import random
+import hashlib
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from .cache import normalize_text
+
+# 是否启用相似子问题草稿复用
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "1").lower() not in ("0", "false", "no")
+# 复用所需的最小相似度（MinHash 估计的字符 shingle Jaccard 相似度）
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+# 索引最多保留的子问题数，超出时淘汰最早加入的
+NEAR_DUP_MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", "5000"))
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def shingles(text: str, size: int = 2) -> Set[str]:
+    """归一化后按字符切分 n-gram，中文无需分词；过短的文本整体作为一个 shingle。"""
+    text = normalize_text(text).replace(" ", "")
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHashLSHIndex:
+    """
+    基于 MinHash 签名与分段 LSH 的近似重复索引。
+
+    签名长度 = bands * rows。两个文本只要有一个分段完全相同即成为候选，
+    再用签名估计的 Jaccard 相似度与阈值比较。默认 16 段 × 4 行时，
+    相似度 0.8 的文本成为候选的概率约为 99.98%。
+    """
+
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD, bands: int = 16, rows: int = 4,
+                 max_entries: int = NEAR_DUP_MAX_ENTRIES, seed: int = 1):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.max_entries = max_entries
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(bands * rows)
+        ]
+        # entry_id -> (scope, text, signature, payload)
+        self._entries: "OrderedDict[int, Tuple[str, str, Tuple[int, ...], str]]" = OrderedDict()
+        self._buckets: List[Dict[Tuple[str, Tuple[int, ...]], Set[int]]] = [defaultdict(set) for _ in range(bands)]
+        self._by_text: Dict[Tuple[str, str], int] = {}
+        self._next_id = 0
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+            for s in shingles(text)
+        ] or [0]
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in self._perms
+        )
+
+    def add(self, scope: str, text: str, payload: str):
+        """加入一条文本及其关联数据（如草稿）；scope 用于隔离不同模型/提示词版本。"""
+        if (scope, text) in self._by_text:
+            self._remove(self._by_text[(scope, text)])
+
+        signature = self.signature(text)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (scope, text, signature, payload)
+        self._by_text[(scope, text)] = entry_id
+        for band, key in enumerate(self._band_keys(scope, signature)):
+            self._buckets[band][key].add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def query(self, scope: str, text: str) -> Optional[Tuple[str, str, float]]:
+        """返回 (相似文本, 关联数据, 相似度) 中相似度最高且不低于阈值的一条。"""
+        signature = self.signature(text)
+        candidates: Set[int] = set()
+        for band, key in enumerate(self._band_keys(scope, signature)):
+            candidates |= self._buckets[band].get(key, set())
+
+        best = None
+        for entry_id in candidates:
+            _, other_text, other_signature, payload = self._entries[entry_id]
+            similarity = sum(a == b for a, b in zip(signature, other_signature)) / len(signature)
+            if similarity >= self.threshold and (best is None or similarity > best[2]):
+                best = (other_text, payload, similarity)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield scope, signature[band * self.rows:(band + 1) * self.rows]
+
+    def _remove(self, entry_id: int):
+        scope, text, signature, _ = self._entries.pop(entry_id)
+        del self._by_text[(scope, text)]
+        for band, key in enumerate(self._band_keys(scope, signature)):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band][key]
+
+
+near_dup_index = MinHashLSHIndex()
@@ -0,0 +1,140 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+from .protocol import JsonFrameEncoder, MERGEABLE_FRAME_TYPES
+from .metrics import WS_SEND_LATENCY, observe_duration
+
+logger = logging.getLogger(__name__)
+
+# 合并 token 帧的时间窗口（毫秒），设为 0 关闭合并、每个 chunk 单独发送
+WS_FLUSH_INTERVAL_MS = float(os.getenv("WS_FLUSH_INTERVAL_MS", "40"))
+# 缓冲内容达到该字节数时立即发送
+WS_FLUSH_BYTES = int(os.getenv("WS_FLUSH_BYTES", "4096"))
+
+
+async def send_frame(websocket, frame: Dict[str, Any]):
+    """
+    向 websocket 发送一帧消息。
+
+    接收方实现了 send_frame 时直接传递 dict（如 BufferedFrameWriter、后台任务），
+    否则序列化为 JSON 后调用 send_text。
+    """
+    if not websocket:
+        return
+    sender = getattr(websocket, "send_frame", None)
+    if sender is not None:
+        await sender(frame)
+    else:
+        await websocket.send_text(json.dumps(frame, ensure_ascii=False))
+
+
+class BufferedFrameWriter:
+    """
+    包装 WebSocket 的缓冲写入器。
+
+    连续到达的、同一会话、同一类型、同一 question_index 的内容帧在时间窗口内合并为一帧，
+    窗口到期或缓冲超过字节上限时发送；键不同的内容帧或非内容帧（status/complete/error 等）
+    会先发送缓冲内容再处理自身，因此帧的先后顺序与产生顺序完全一致。
+    合并帧只包含序号（seq）连续的帧，seq 取其中最后一帧的序号，客户端以收到的最大 seq
+    续传既不会丢失也不会重复内容。帧的线上格式由 encoder 决定（见 protocol.py）。
+    """
+
+    def __init__(self, websocket, flush_interval_ms: float = WS_FLUSH_INTERVAL_MS,
+                 flush_bytes: int = WS_FLUSH_BYTES, encoder: Optional[JsonFrameEncoder] = None):
+        self.websocket = websocket
+        self.encoder = encoder or JsonFrameEncoder()
+        self.flush_interval = max(flush_interval_ms, 0) / 1000
+        self.flush_bytes = flush_bytes
+        self._pending: Optional[Dict[str, Any]] = None
+        self._pending_key: Optional[Tuple[Any, Any, Any]] = None
+        self._pending_bytes = 0
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+        self._closed = False
+
+    async def send_frame(self, frame: Dict[str, Any]):
+        # 定时发送失败（如连接已断开）时，让后续调用方尽快感知到异常
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise RuntimeError("写入器已关闭")
+
+        async with self._lock:
+            if self.flush_interval and frame.get("type") in MERGEABLE_FRAME_TYPES:
+                key = (frame.get("session_id"), frame.get("type"), frame.get("question_index"))
+                content = frame.get("content") or ""
+                if self._pending is not None and key != self._pending_key:
+                    await self._flush_locked()
+                if self._pending is None:
+                    self._pending = dict(frame, content=content)
+                    self._pending_key = key
+                else:
+                    self._pending["content"] += content
+                    if "seq" in frame:
+                        self._pending["seq"] = frame["seq"]
+                self._pending_bytes += len(content.encode("utf-8"))
+
+                if self._pending_bytes >= self.flush_bytes:
+                    await self._flush_locked()
+                elif self._timer is None:
+                    self._timer = asyncio.create_task(self._flush_later())
+            else:
+                await self._flush_locked()
+                await self._write(frame)
+
+    async def send_text(self, data: str):
+        """兼容直接发送文本的调用方：先发送缓冲内容，再原样发送。"""
+        async with self._lock:
+            await self._flush_locked()
+            await self.websocket.send_text(data)
+
+    async def flush(self):
+        """立即发送所有缓冲内容。"""
+        async with self._lock:
+            await self._flush_locked()
+
+    async def aclose(self):
+        """连接断开时调用：取消定时发送并丢弃缓冲内容（已无法送达，续传时从事件日志补发）。"""
+        self._closed = True
+        timer, self._timer = self._timer, None
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+            await asyncio.gather(timer, return_exceptions=True)
+        self._pending = None
+        self._pending_key = None
+        self._pending_bytes = 0
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+            async with self._lock:
+                self._timer = None
+                await self._flush_locked()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"缓冲帧发送失败: {e}")
+            self._error = e
+
+    async def _flush_locked(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+
+        pending, self._pending = self._pending, None
+        self._pending_key = None
+        self._pending_bytes = 0
+        if pending is not None:
+            await self._write(pending)
+
+    async def _write(self, frame: Dict[str, Any]):
+        with observe_duration(WS_SEND_LATENCY, stage=frame.get("stage", "")):
+            for payload in self.encoder.encode(frame):
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
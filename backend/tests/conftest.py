@@ -0,0 +1,14 @@
+import os
+import sys
+
+# 测试使用离线假模型，关闭持久化缓存、近似复用和检查点，避免读写本地文件；须在导入 app 之前设置
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("RESEARCH_CACHE_ENABLED", "0")
+os.environ.setdefault("NEAR_DUP_ENABLED", "0")
+os.environ.setdefault("RUN_CHECKPOINT_ENABLED", "0")
+os.environ.setdefault("FAKE_LLM_TTFT_MS", "5")
+os.environ.setdefault("FAKE_LLM_TOKENS_PER_SECOND", "2000")
+os.environ.setdefault("FAKE_LLM_OUTPUT_TOKENS", "40")
+os.environ.setdefault("FAKE_LLM_SEED", "7")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
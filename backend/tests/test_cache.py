@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from app.services import research
+from app.services.cache import ResearchCache
+
+
+def disk_rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT key FROM cache ORDER BY expires_at").fetchall()
+
+
+@pytest.mark.asyncio
+async def test_writes_prune_expired_rows_and_cap_the_table(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    # 写入即过期的条目：首次写入时的清理只删除了第一条，之后在清理间隔内不再清理
+    stale = ResearchCache(path=path, ttl_seconds=-1, enabled=True, prune_interval=3600)
+    for index in range(5):
+        await stale.set("plan", f"stale-{index}", {"index": index})
+    assert len(disk_rows(path)) == 4
+
+    cache = ResearchCache(path=path, ttl_seconds=60, enabled=True, max_rows=3, prune_interval=0)
+    for index in range(5):
+        await cache.set("plan", f"fresh-{index}", {"index": index})
+
+    # 过期行在首次写入时删除，之后最早写入的行因超出上限被删除
+    assert disk_rows(path) == [("fresh-2",), ("fresh-3",), ("fresh-4",)]
+
+
+@pytest.mark.asyncio
+async def test_prune_runs_at_most_once_per_interval(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResearchCache(path=path, ttl_seconds=60, enabled=True, max_rows=2, prune_interval=3600)
+    for index in range(4):
+        await cache.set("plan", f"key-{index}", index)
+
+    assert len(disk_rows(path)) == 4
+
+
+def test_plan_cache_key_depends_on_the_plan_prompt(monkeypatch):
+    keys = {}
+    for plan_mode, execution_mode in [("dual", "staged"), ("single", "staged"), ("dual", "pipeline")]:
+        monkeypatch.setattr(research, "PLAN_MODE", plan_mode)
+        monkeypatch.setattr(research, "EXECUTION_MODE", execution_mode)
+        keys[(plan_mode, execution_mode)] = research._plan_cache_key("同一个问题")
+
+    assert keys[("dual", "staged")] != keys[("single", "staged")]
+    # 流水线模式总是使用单次调用的规划提示词
+    assert keys[("single", "staged")] == keys[("dual", "pipeline")]
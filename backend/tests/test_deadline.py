@@ -0,0 +1,124 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app.services import deadline, research
+from app.services.cache import ResearchCache
+from app.services.deadline import ResearchBudget, parse_deadline_ms
+from app.services.fake_llm import FakeChatModel
+from app.services.models import ModelRouter
+
+
+@pytest.fixture
+def slow_plan_model(monkeypatch):
+    """
+    每 10 ms 输出 2 个字的假模型：规划说明的第一个子问题行约 220 ms 结束，
+    2000 ms 预算的规划截止时间（15%，300 ms）落在第二个子问题行中间。
+    """
+    model = FakeChatModel(ttft_ms=0, tokens_per_second=100, output_tokens=60, seed="1")
+    monkeypatch.setattr(research, "_model_router", ModelRouter(model, "fake"))
+    monkeypatch.setattr(research, "PLAN_MODE", "single")
+    return model
+
+
+async def run_with_budget(node, deadline_ms: int):
+    budget = ResearchBudget(deadline_ms, research.RESEARCH_MAX_CONCURRENCY)
+    token = research._request_budget.set(budget)
+    try:
+        state = research.ResearchState(messages=[HumanMessage(content="截止时间截断测试")],
+                                       plan=None, drafts=None, report=None)
+        return budget, await node(state)
+    finally:
+        research._request_budget.reset(token)
+
+
+def assert_complete_questions(questions):
+    assert questions, "截断前已完整输出的子问题应当保留"
+    for question in questions:
+        # 假模型的子问题行以 "（四位数）" 结尾，半截的行不会带有完整的括号
+        assert question.endswith("）"), f"截断的半行被当作子问题: {question!r}"
+
+
+@pytest.mark.asyncio
+async def test_truncated_plan_drops_partial_line_in_staged_mode(slow_plan_model):
+    budget, result = await run_with_budget(research.plan_node, 2000)
+
+    assert budget.truncated_plan
+    assert_complete_questions(result["plan"].questions)
+    assert len(result["plan"].questions) == 1
+
+
+@pytest.mark.asyncio
+async def test_truncated_plan_drops_partial_line_in_pipeline_mode(slow_plan_model):
+    budget, result = await run_with_budget(research.plan_research_pipeline, 2000)
+
+    assert budget.truncated_plan
+    assert_complete_questions(result["plan"].questions)
+    assert len(result["drafts"]) == len(result["plan"].questions)
+
+
+@pytest.mark.asyncio
+async def test_research_drafts_stop_at_research_deadline(monkeypatch):
+    # 输出很慢的模型：草稿在研究截止时间被截断，整次研究仍在截止时间附近完成
+    model = FakeChatModel(ttft_ms=0, tokens_per_second=20, output_tokens=400, seed="2")
+    monkeypatch.setattr(research, "_model_router", ModelRouter(model, "fake"))
+
+    result = await research.conduct_research_stream("截止时间测试", deadline_ms=3000)
+    budget = result["budget"]
+
+    assert budget["truncated_drafts"] > 0 or budget["skipped_drafts"] > 0
+    assert budget["elapsed_ms"] < 3000 + 500
+    assert result["report"]
+
+
+@pytest.mark.parametrize("value", [0, -5, 1.5, "abc", True])
+def test_parse_deadline_ms_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        parse_deadline_ms(value)
+
+
+def test_parse_deadline_ms_accepts_positive_integers():
+    assert parse_deadline_ms(None) is None
+    assert parse_deadline_ms("1500") == 1500
+    assert parse_deadline_ms(2000.0) == 2000
+
+
+def test_question_limit_fits_draft_waves_into_the_research_window(monkeypatch):
+    monkeypatch.setattr(deadline, "DEADLINE_MIN_DRAFT_SECONDS", 5)
+    # 62 s 预算：研究截止时间在 65%（40.3 s），规划占 15%（9.3 s）
+    budget = ResearchBudget(62_000, concurrency=2)
+
+    assert budget.question_limit(planned=True) == 2 * 8
+    assert budget.question_limit(planned=False) == 2 * 6
+    assert ResearchBudget(1000, concurrency=3).question_limit() == 1, "时间再紧也至少研究一个子问题"
+
+
+def test_max_tokens_follows_the_remaining_time_with_a_floor(monkeypatch):
+    monkeypatch.setattr(deadline, "DEADLINE_TOKENS_PER_SECOND", 40)
+    monkeypatch.setattr(deadline, "DEADLINE_MIN_OUTPUT_TOKENS", 64)
+    budget = ResearchBudget(30_000)
+
+    assert 1100 <= budget.max_tokens() <= 1200
+    assert budget.max_tokens(budget.started) == 64
+
+
+@pytest.mark.asyncio
+async def test_output_capped_by_the_budget_is_not_served_to_unbudgeted_requests(monkeypatch):
+    # 截止时间很宽松，但输出速率估计极低：max_tokens 取下限，草稿和报告在达到上限时被截断
+    monkeypatch.setattr(deadline, "DEADLINE_TOKENS_PER_SECOND", 0.1)
+    monkeypatch.setattr(deadline, "DEADLINE_MIN_OUTPUT_TOKENS", 16)
+    model = FakeChatModel(ttft_ms=0, tokens_per_second=5000, output_tokens=120, seed="3")
+    monkeypatch.setattr(research, "_model_router", ModelRouter(model, "fake"))
+    monkeypatch.setattr(research, "research_cache", ResearchCache(path=None, enabled=True))
+
+    budgeted = await research.conduct_research_stream("按预算截断的问题", deadline_ms=60_000)
+    budget = budgeted["budget"]
+    assert budget["truncated_plan"]
+    assert budget["truncated_drafts"] == len(budgeted["drafts"])
+    assert budget["truncated_report"]
+
+    unbudgeted = await research.conduct_research_stream("按预算截断的问题")
+    assert len(unbudgeted["drafts"]) == len(budgeted["drafts"])
+    for capped, full in zip(budgeted["drafts"], unbudgeted["drafts"]):
+        assert len(capped) == 16 * 2
+        assert len(full) == 120 * 2, "不带截止时间的请求拿到了被截断的缓存草稿"
+    assert len(unbudgeted["report"]) > len(budgeted["report"])
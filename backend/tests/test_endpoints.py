@@ -0,0 +1,184 @@
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+from app.services import endpoints
+from app.services.endpoints import EndpointPool, EndpointSpec, retryable
+from app.services.fake_llm import FakeLLMError
+
+
+def status_error(status: int) -> openai.APIStatusError:
+    request = httpx.Request("POST", "http://upstream/v1/chat/completions")
+    response = httpx.Response(status, request=request)
+    return openai.APIStatusError(f"HTTP {status}", response=response, body=None)
+
+
+class ScriptedClient:
+    """按脚本输出 chunk，之后抛出给定的异常（error 为 None 时正常结束）。"""
+
+    def __init__(self, chunks=(), error=None):
+        self.chunks = list(chunks)
+        self.error = error
+        self.calls = 0
+
+    async def astream(self, messages, **kwargs):
+        self.calls += 1
+        for content in self.chunks:
+            yield AIMessageChunk(content=content)
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def fresh_health(monkeypatch):
+    monkeypatch.setattr(endpoints, "_health", {})
+
+
+def pool(*clients):
+    specs = [EndpointSpec(f"http://endpoint-{i}:8000/v1", "key", "model") for i in range(len(clients))]
+    return EndpointPool(list(zip(specs, clients)), "model")
+
+
+@pytest.mark.parametrize("error", [
+    status_error(500), status_error(503), status_error(429),
+    httpx.ConnectError("refused"), httpx.ReadTimeout("slow"), TimeoutError(),
+    openai.APIConnectionError(request=httpx.Request("POST", "http://upstream")),
+    FakeLLMError("假模型模拟的上游错误"),
+])
+def test_transient_errors_are_retryable(error):
+    assert retryable(error)
+
+
+@pytest.mark.parametrize("error", [
+    status_error(400), status_error(401), status_error(403), status_error(404), status_error(422),
+    ValueError("bad request"),
+])
+def test_client_errors_are_not_retryable(error):
+    assert not retryable(error)
+
+
+@pytest.mark.asyncio
+async def test_client_error_raises_without_failover_or_breaker(fresh_health):
+    first = ScriptedClient(error=status_error(400))
+    second = ScriptedClient(error=status_error(400))
+    endpoint_pool = pool(first, second)
+
+    with pytest.raises(openai.APIStatusError):
+        async for _ in endpoint_pool.astream([HumanMessage(content="你好")]):
+            pass
+
+    assert first.calls + second.calls == 1
+    for health, _ in endpoint_pool.endpoints:
+        assert health.failures == 0
+        assert health.consecutive_failures == 0
+        assert not health.trial_in_flight
+
+
+@pytest.mark.asyncio
+async def test_server_error_fails_over_and_continues_midstream(fresh_health):
+    broken = ScriptedClient(chunks=["前半"], error=status_error(502))
+    healthy = ScriptedClient(chunks=["后半"])
+    endpoint_pool = pool(broken, healthy)
+    # 固定先选中故障端点
+    endpoint_pool.choose = lambda tried, _order=iter(endpoint_pool.endpoints): next(_order)
+
+    text = "".join([chunk.content async for chunk in endpoint_pool.astream([HumanMessage(content="你好")])])
+
+    assert text == "前半后半"
+    broken_health, healthy_health = (health for health, _ in endpoint_pool.endpoints)
+    assert broken_health.failures == 1
+    assert healthy_health.failures == 0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(endpoints.time, "monotonic", clock)
+    monkeypatch.setattr(endpoints, "LLM_ENDPOINT_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(endpoints, "LLM_ENDPOINT_COOLDOWN_SECONDS", 30)
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    health = endpoints.EndpointHealth("endpoint")
+    health.record_failure()
+    health.record_failure()
+    assert health.state == "closed" and health.available()
+
+    health.record_success()
+    health.record_failure()
+    health.record_failure()
+    assert health.state == "closed", "成功会清零连续失败次数"
+
+    health.record_failure()
+    assert health.state == "open" and not health.available()
+
+
+def test_half_open_admits_a_single_trial_and_closes_on_success(clock):
+    health = endpoints.EndpointHealth("endpoint")
+    for _ in range(3):
+        health.record_failure()
+    clock.now += 29
+    assert health.state == "open"
+
+    clock.now += 1
+    assert health.state == "half_open" and health.available()
+    health.begin()
+    assert not health.available(), "半开状态只放行一次试探请求"
+
+    health.record_success(0.2)
+    health.end()
+    assert health.state == "closed" and health.available()
+    assert health.consecutive_failures == 0
+
+
+def test_failed_trial_reopens_the_breaker(clock):
+    health = endpoints.EndpointHealth("endpoint")
+    for _ in range(3):
+        health.record_failure()
+    clock.now += 30
+    health.begin()
+    health.record_failure()
+    health.end()
+
+    assert health.state == "open"
+    clock.now += 29
+    assert not health.available()
+    clock.now += 1
+    assert health.state == "half_open"
+
+
+def test_cancelled_trial_frees_the_half_open_slot(clock):
+    health = endpoints.EndpointHealth("endpoint")
+    for _ in range(3):
+        health.record_failure()
+    clock.now += 30
+    health.begin()
+    health.end()
+
+    assert health.state == "half_open" and health.available()
+
+
+@pytest.mark.asyncio
+async def test_open_endpoints_are_skipped_by_routing(fresh_health, clock):
+    broken = ScriptedClient(error=status_error(503))
+    healthy = ScriptedClient(chunks=["正常"])
+    endpoint_pool = pool(broken, healthy)
+    broken_health = endpoint_pool.endpoints[0][0]
+    for _ in range(3):
+        broken_health.record_failure()
+
+    for _ in range(20):
+        text = "".join([chunk.content async for chunk in endpoint_pool.astream([HumanMessage(content="你好")])])
+        assert text == "正常"
+
+    assert broken.calls == 0 and healthy.calls == 20
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from app.services.hedging import hedged_stream
+from app.services.scheduler import LLMScheduler
+
+
+class SlowStarts:
+    """每次 start() 返回一个流；第 n 次调用的首个 chunk 在 delays[n] 秒后到达。"""
+
+    def __init__(self, scheduler: LLMScheduler, *delays: float):
+        self.scheduler = scheduler
+        self.delays = delays
+        self.started = 0
+        self.peak_active = 0
+
+    def __call__(self):
+        delay = self.delays[self.started]
+        role = "primary" if self.started == 0 else "hedge"
+        self.started += 1
+
+        async def stream():
+            self.peak_active = max(self.peak_active, self.scheduler.active)
+            await asyncio.sleep(delay)
+            for index in range(3):
+                self.peak_active = max(self.peak_active, self.scheduler.active)
+                yield f"{role}-{index}"
+
+        return stream()
+
+
+async def collect(scheduler: LLMScheduler, starts: SlowStarts):
+    async with scheduler.slot(10) as slot:
+        stream = hedged_stream(starts, 0.02, "research", "fake",
+                               lambda: scheduler.try_admit(slot.input_tokens))
+        return [chunk async for chunk in stream]
+
+
+@pytest.mark.asyncio
+async def test_hedge_takes_its_own_admission_and_releases_it_after_the_race():
+    scheduler = LLMScheduler(max_concurrency=2)
+    starts = SlowStarts(scheduler, 0.5, 0.0)
+
+    chunks = await collect(scheduler, starts)
+
+    assert chunks == ["hedge-0", "hedge-1", "hedge-2"]
+    assert starts.started == 2
+    assert starts.peak_active == 2
+    assert scheduler.active == 0
+
+
+@pytest.mark.asyncio
+async def test_hedge_is_skipped_when_no_slot_is_free():
+    scheduler = LLMScheduler(max_concurrency=1)
+    starts = SlowStarts(scheduler, 0.05, 0.0)
+
+    chunks = await collect(scheduler, starts)
+
+    assert chunks == ["primary-0", "primary-1", "primary-2"]
+    assert starts.started == 1
+    assert starts.peak_active == 1
+    assert scheduler.active == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_hedged_calls_never_exceed_the_cap():
+    scheduler = LLMScheduler(max_concurrency=3)
+    peaks = []
+
+    async def sample():
+        while True:
+            peaks.append(scheduler.active)
+            await asyncio.sleep(0.001)
+
+    sampler = asyncio.create_task(sample())
+    try:
+        await asyncio.gather(*(collect(scheduler, SlowStarts(scheduler, 0.1, 0.01)) for _ in range(6)))
+    finally:
+        sampler.cancel()
+
+    assert max(peaks) <= 3
+    assert scheduler.active == 0 and scheduler.waiting == 0
+
+
+def test_try_admit_never_exceeds_the_cap_and_releases_once():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = scheduler.try_admit(10)
+    assert release is not None and scheduler.active == 1
+    assert scheduler.try_admit(10) is None
+    release()
+    release()
+    assert scheduler.active == 0
+
+
+@pytest.mark.asyncio
+async def test_first_chunk_does_not_wait_for_a_slow_loser_to_close():
+    scheduler = LLMScheduler(max_concurrency=2)
+    loser_closed = asyncio.Event()
+
+    def start():
+        async def slow_to_cancel():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                # 模拟关闭上游连接很慢的落败方
+                await asyncio.sleep(0.3)
+                loser_closed.set()
+                raise
+            yield "primary"
+
+        async def fast():
+            yield "hedge-0"
+            yield "hedge-1"
+
+        start.calls += 1
+        return slow_to_cancel() if start.calls == 1 else fast()
+
+    start.calls = 0
+    async with scheduler.slot(10) as slot:
+        stream = hedged_stream(start, 0.02, "research", "fake",
+                               lambda: scheduler.try_admit(slot.input_tokens))
+        started = asyncio.get_running_loop().time()
+        first = await stream.__anext__()
+        first_after = asyncio.get_running_loop().time() - started
+        assert first == "hedge-0"
+        assert not loser_closed.is_set()
+        assert first_after < 0.2, f"首个 chunk 等待了落败方关闭（{first_after * 1000:.0f} ms）"
+
+        rest = [chunk async for chunk in stream]
+        assert rest == ["hedge-1"]
+        assert loser_closed.is_set()
+        assert scheduler.active == 1, "落败方关闭后对冲请求的名额已释放"
+    assert scheduler.active == 0
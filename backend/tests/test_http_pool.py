@@ -0,0 +1,21 @@
+import asyncio
+
+from app.services import http_pool
+
+
+def test_client_survives_pool_close_and_new_event_loops():
+    client = http_pool.llm_http_client()
+
+    async def current_transport():
+        transport = http_pool._transport.current()
+        await http_pool.close_llm_http_pool()
+        return transport
+
+    first = asyncio.run(current_transport())
+    second = asyncio.run(current_transport())
+
+    # 每个事件循环使用自己的连接池，关闭连接池不会关闭共享客户端
+    assert first is not second
+    assert not client.is_closed
+    assert http_pool.llm_http_client() is client
+    assert http_pool._transport.transports() == []
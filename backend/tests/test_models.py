@@ -0,0 +1,35 @@
+import time
+import asyncio
+
+import pytest
+
+from app.services import research
+from app.services.fake_llm import FakeChatModel
+
+
+@pytest.mark.asyncio
+async def test_first_request_builds_the_router_off_the_event_loop(monkeypatch):
+    def slow_build():
+        # 模拟导入 langchain_deepseek / openai 的耗时
+        time.sleep(0.3)
+        return FakeChatModel(ttft_ms=0, tokens_per_second=5000, output_tokens=10)
+
+    monkeypatch.setattr(research, "_model_router", None)
+    monkeypatch.setattr(research, "_build_default_model", slow_build)
+    lags = []
+
+    async def heartbeat():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    ticker = asyncio.create_task(heartbeat())
+    try:
+        results = await asyncio.gather(*(research.conduct_research_stream(f"问题 {i}") for i in range(3)))
+    finally:
+        ticker.cancel()
+
+    assert all(result["report"] for result in results)
+    assert research._model_router is not None
+    assert max(lags) < 0.1, f"事件循环被阻塞了 {max(lags) * 1000:.0f} ms"
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from app.services import jobs, research, runs
+from app.services.checkpoints import CheckpointStore
+from app.services.fake_llm import FakeChatModel
+from app.services.models import ModelRouter
+from app.services.runs import RunRegistry
+
+
+@pytest.fixture
+def recorded_calls(monkeypatch):
+    """替换研究函数：记录每次调用的参数，第一次调用失败，之后成功。"""
+    calls = []
+
+    async def fake_research(question, sink, run_id=None, deadline_ms=None):
+        calls.append({"question": question, "run_id": run_id, "deadline_ms": deadline_ms})
+        await sink.send_frame({"type": "start", "content": "开始", "stage": "start"})
+        if len(calls) == 1:
+            raise RuntimeError("上游失败")
+        await sink.send_frame({"type": "complete", "content": "完成", "stage": "complete"})
+        return {"report": "报告"}
+
+    monkeypatch.setattr(runs, "conduct_research_stream", fake_research)
+    return calls
+
+
+async def drain(queue: asyncio.Queue):
+    frames = []
+    while (frame := await queue.get()) is not None:
+        frames.append(frame)
+    return frames
+
+
+@pytest.mark.asyncio
+async def test_retry_keeps_the_deadline_of_the_failed_run(recorded_calls):
+    registry = RunRegistry(grace_seconds=0)
+    run, queue = registry.attach("有截止时间的问题", deadline_ms=1500)
+    await drain(queue)
+    assert run.error is not None
+
+    retried, queue = await registry.retry(run.run_id)
+    await drain(queue)
+
+    assert retried.run_id == run.run_id
+    assert retried.key == run.key
+    assert [call["deadline_ms"] for call in recorded_calls] == [1500, 1500]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_restart_reads_the_deadline_from_the_checkpoint(recorded_calls, monkeypatch, tmp_path):
+    store = CheckpointStore(path=str(tmp_path / "checkpoints.sqlite3"), enabled=True)
+    monkeypatch.setattr(runs, "checkpoint_store", store)
+    checkpoint = await store.open("run-1", "重启前的问题", 2500)
+    assert not checkpoint.restored
+
+    # 新的注册表模拟进程重启：运行不在内存中，只能从检查点恢复
+    retried, queue = await RunRegistry(grace_seconds=0).retry("run-1")
+    await drain(queue)
+
+    assert recorded_calls == [{"question": "重启前的问题", "run_id": "run-1", "deadline_ms": 2500}]
+    assert retried.key.endswith("@2500ms")
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = FakeChatModel(ttft_ms=1, tokens_per_second=2000, output_tokens=40)
+    monkeypatch.setattr(research, "_model_router", ModelRouter(model, "fake"))
+    return model
+
+
+@pytest.mark.asyncio
+async def test_resume_after_disconnect_replays_every_missed_frame_once(fake_model):
+    registry = RunRegistry(grace_seconds=60)
+    run, queue = registry.attach("断线续传的问题")
+    received = [await queue.get() for _ in range(5)]
+    registry.detach(run, queue, grace=60)
+
+    # 断线期间运行继续进行
+    await asyncio.sleep(0.05)
+    resumed_run, queue = registry.resume(run.run_id, received[-1]["seq"])
+    received += await drain(queue)
+
+    assert resumed_run is run and run.error is None
+    assert [frame["seq"] for frame in received] == list(range(1, run.seq + 1))
+    assert received == list(run.frames)
+    assert received[-1]["type"] == "complete"
+
+
+@pytest.mark.asyncio
+async def test_resume_fails_once_the_missed_frames_were_dropped(fake_model):
+    registry = RunRegistry(grace_seconds=60)
+    run = registry._start(runs.ResearchRun("key", "事件日志很短的问题", max_frames=5))
+    await run.task
+
+    assert run.truncated
+    with pytest.raises(ValueError):
+        registry.resume(run.run_id, 0)
+    queue = registry.resume(run.run_id, run.first_seq - 1)[1]
+    assert [frame["seq"] for frame in await drain(queue)] == list(range(run.first_seq, run.seq + 1))
+    with pytest.raises(KeyError):
+        registry.resume("unknown", 0)
+
+
+@pytest.mark.asyncio
+async def test_retried_job_keeps_its_deadline_when_the_checkpoint_expired(recorded_calls, monkeypatch):
+    monkeypatch.setattr(jobs, "run_registry", RunRegistry(grace_seconds=0))
+    manager = jobs.JobManager()
+    failed = manager.submit("检查点已过期的问题", deadline_ms=3000)
+    await failed.task
+    assert failed.status == "failed"
+
+    # 原运行已结束且不在检查点中：重试回退为重新发起研究
+    retried = manager.submit(failed.question, retry_run_id="expired-run", deadline_ms=failed.deadline_ms)
+    await retried.task
+
+    assert retried.status == "completed"
+    assert retried.to_dict()["deadline_ms"] == 3000
+    assert 2900 <= recorded_calls[-1]["deadline_ms"] <= 3000
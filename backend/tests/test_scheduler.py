@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app.services import research, scheduler
+from app.services.fake_llm import FakeChatModel
+from app.services.models import ModelRouter
+from app.services.scheduler import LLMOverloadedError, LLMScheduler
+
+
+async def hold(llm: LLMScheduler, release: asyncio.Event, admitted: list, client_id: str = "c"):
+    async with llm.slot(10, client_id=client_id):
+        admitted.append(client_id)
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_concurrency_never_exceeds_the_cap():
+    llm = LLMScheduler(max_concurrency=2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with llm.slot(10):
+            peak = max(peak, llm.active)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(call() for _ in range(8)))
+
+    assert peak == 2
+    assert llm.active == 0 and llm.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_holder_releases_its_slot_to_the_queue():
+    llm = LLMScheduler(max_concurrency=1)
+    release, admitted = asyncio.Event(), []
+    holder = asyncio.create_task(hold(llm, release, admitted, "a"))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold(llm, release, admitted, "b"))
+    await asyncio.sleep(0)
+    assert admitted == ["a"] and llm.waiting == 1
+
+    holder.cancel()
+    await asyncio.gather(holder, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert admitted == ["a", "b"]
+    assert llm.active == 1 and llm.waiting == 0
+    release.set()
+    await waiter
+    assert llm.active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    llm = LLMScheduler(max_concurrency=1)
+    release, admitted = asyncio.Event(), []
+    holder = asyncio.create_task(hold(llm, release, admitted, "a"))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold(llm, release, admitted, "b"))
+    await asyncio.sleep(0)
+    assert llm.waiting == 1
+
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert llm.waiting == 0
+
+    release.set()
+    await holder
+    assert admitted == ["a"]
+    assert llm.active == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_new_calls():
+    llm = LLMScheduler(max_concurrency=1, max_queue_depth=1)
+    release, admitted = asyncio.Event(), []
+    tasks = [asyncio.create_task(hold(llm, release, admitted, name)) for name in ("a", "b")]
+    await asyncio.sleep(0)
+
+    with pytest.raises(LLMOverloadedError):
+        await hold(llm, release, admitted, "c")
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert admitted == ["a", "b"] and llm.active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelling_a_fake_llm_stream_releases_the_global_slot(monkeypatch):
+    llm = LLMScheduler(max_concurrency=1)
+    monkeypatch.setattr(research, "llm_scheduler", llm)
+    monkeypatch.setattr(scheduler, "llm_scheduler", llm)
+    model = FakeChatModel(ttft_ms=0, tokens_per_second=50, output_tokens=200)
+    monkeypatch.setattr(research, "_model_router", ModelRouter(model, "fake"))
+    started = asyncio.Event()
+
+    async def consume():
+        async for _ in research._astream([HumanMessage(content="你好")], stage="research"):
+            started.set()
+
+    task = asyncio.create_task(consume())
+    await started.wait()
+    assert llm.active == 1
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert llm.active == 0
+    # 名额已归还：下一次调用无需排队
+    chunks = [chunk async for chunk in research._astream([HumanMessage(content="再来")], stage="research",
+                                                         max_tokens=4)]
+    assert chunks and llm.waiting == 0
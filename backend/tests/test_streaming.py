@@ -0,0 +1,86 @@
+import json
+import random
+import asyncio
+
+import pytest
+
+from app.services.runs import ResearchRun
+from app.services.streaming import BufferedFrameWriter
+
+
+class RecordingSocket:
+    """记录发送的文本帧的假 WebSocket。"""
+
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, data: str):
+        self.frames.append(json.loads(data))
+
+
+def interleaved_chunks(count: int, seed: int = 1):
+    """q0 与 q1 的内容 chunk 成段交错，段长随机，模拟并发研究的子问题交替输出。"""
+    rng = random.Random(seed)
+    chunks, index = [], 0
+    while len(chunks) < count:
+        for _ in range(rng.randint(1, 6)):
+            chunks.append((index, f"q{index}-{len(chunks)}|"))
+        index = 1 - index
+    return chunks[:count]
+
+
+def rebuild(frames):
+    text = {}
+    for frame in frames:
+        if frame.get("type") == "research":
+            text[frame["question_index"]] = text.get(frame["question_index"], "") + frame["content"]
+    return text
+
+
+@pytest.mark.asyncio
+async def test_resume_from_highest_seq_does_not_duplicate_merged_content():
+    run = ResearchRun("key", "question")
+    socket = RecordingSocket()
+    writer = BufferedFrameWriter(socket, flush_interval_ms=10_000, flush_bytes=1 << 20)
+
+    for index, content in interleaved_chunks(400):
+        await run.send_frame({"type": "research", "stage": "research", "question_index": index, "content": content})
+    queue = run.subscribe()
+    while not queue.empty():
+        await writer.send_frame(queue.get_nowait())
+    await writer.flush()
+
+    expected = rebuild(run.frames)
+    assert len(socket.frames) < len(run.frames), "相邻的同键内容帧应当被合并"
+    assert rebuild(socket.frames) == expected
+
+    # 在每个可能的断点续传：已收到的内容 + 事件日志中 last_seq 之后的帧 应与完整内容逐字节一致
+    for received in range(1, len(socket.frames) + 1):
+        seen = socket.frames[:received]
+        last_seq = max(frame["seq"] for frame in seen)
+        replay = run.subscribe(last_seq)
+        replayed = []
+        while not replay.empty():
+            replayed.append(replay.get_nowait())
+        rebuilt = rebuild(seen + replayed)
+        assert rebuilt == expected, f"从 seq={last_seq} 续传后内容不一致"
+
+
+class ClosedSocket:
+    async def send_text(self, data: str):
+        raise RuntimeError("连接已关闭")
+
+
+@pytest.mark.asyncio
+async def test_aclose_cancels_pending_flush_timer(caplog):
+    writer = BufferedFrameWriter(ClosedSocket(), flush_interval_ms=20)
+    await writer.send_frame({"type": "report", "stage": "report", "content": "片段"})
+    assert writer._timer is not None
+
+    await writer.aclose()
+    await asyncio.sleep(0.05)
+
+    assert writer._timer is None
+    assert "缓冲帧发送失败" not in caplog.text
+    with pytest.raises(RuntimeError):
+        await writer.send_frame({"type": "report", "stage": "report", "content": "之后的片段"})
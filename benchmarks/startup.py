@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+后端启动耗时基准
+
+每轮在新进程中测量：
+- 导入耗时：import app.main 的耗时（不含解释器自身启动）
+- 首个请求耗时（time-to-first-request）：从启动 uvicorn 到 /api/health 首次返回 200
+- 就绪耗时：从启动 uvicorn 到 /api/ready 返回 200（模型客户端已创建、上游连接已预热）
+
+默认使用离线假模型，不需要 API Key：
+
+    python benchmarks/startup.py --runs 5
+
+测量真实模型配置（会向上游发送预热请求），并列出导入最慢的模块：
+
+    python benchmarks/startup.py --env LLM_PROVIDER=deepseek --env DEEPSEEK_API_KEY=sk-... --top 15
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = PROJECT_ROOT / "backend"
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import app.main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_env(extra_env: Dict[str, str]) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "LLM_PROVIDER": "fake",
+        "RESEARCH_CACHE_ENABLED": "0",
+        "NEAR_DUP_ENABLED": "0",
+    })
+    env.update(extra_env)
+    return env
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Tuple[float, str]]:
+    """用 python -X importtime 列出累计导入耗时最长的模块（秒，模块名）。"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    ).stderr
+    modules = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        modules.append((int(parts[1]) / 1_000_000, parts[2].rstrip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def probe(url: str) -> Tuple[Optional[int], Dict]:
+    """请求 url，返回 (状态码, JSON)；连接失败时状态码为 None。"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.loads(response.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+    except OSError:
+        return None, {}
+
+
+def measure_server(env: Dict[str, str], timeout: float, interval: float) -> Dict:
+    """启动 uvicorn，测量首个请求与就绪耗时。"""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    result: Dict = {"first_request": None, "ready": None, "ready_status": None, "error": None}
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline and result["first_request"] is None:
+            if proc.poll() is not None:
+                result["error"] = f"后端服务退出（退出码 {proc.returncode}）"
+                return result
+            status, _ = probe(f"{base}/api/health")
+            if status == 200:
+                result["first_request"] = time.perf_counter() - started
+            else:
+                time.sleep(interval)
+
+        while time.perf_counter() < deadline and result["first_request"] is not None:
+            status, body = probe(f"{base}/api/ready")
+            result["ready_status"] = body.get("status")
+            if status == 200:
+                result["ready"] = time.perf_counter() - started
+                break
+            if body.get("status") == "failed":
+                result["error"] = f"初始化失败: {body.get('error')}"
+                break
+            time.sleep(interval)
+        else:
+            result["error"] = result["error"] or "等待超时"
+        return result
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def summarize(values: List[float]) -> str:
+    if not values:
+        return "-"
+    ordered = sorted(values)
+    median = ordered[len(ordered) // 2]
+    return f"median={median * 1000:8.1f}ms  min={ordered[0] * 1000:8.1f}ms  max={ordered[-1] * 1000:8.1f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后端启动耗时基准")
+    parser.add_argument("--runs", type=int, default=5, help="测量轮数")
+    parser.add_argument("--env", action="append", default=[], help="附加的环境变量，如 LLM_PROVIDER=deepseek")
+    parser.add_argument("--timeout", type=float, default=60, help="单轮等待就绪的超时（秒）")
+    parser.add_argument("--interval", type=float, default=0.01, help="探测间隔（秒）")
+    parser.add_argument("--top", type=int, default=0, help="列出导入最慢的 N 个模块")
+    parser.add_argument("--json", dest="json_path", default=None, help="把原始结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    env = server_env(dict(item.split("=", 1) for item in args.env))
+    imports: List[float] = []
+    servers: List[Dict] = []
+    for run in range(1, args.runs + 1):
+        imports.append(measure_import(env))
+        server = measure_server(env, args.timeout, args.interval)
+        servers.append(server)
+        first = f"{server['first_request'] * 1000:.0f}ms" if server["first_request"] is not None else "-"
+        ready = f"{server['ready'] * 1000:.0f}ms" if server["ready"] is not None else "-"
+        print(f"第 {run} 轮: 导入 {imports[-1] * 1000:.0f}ms  首个请求 {first}  就绪 {ready}"
+              + (f"  ❌ {server['error']}" if server["error"] else ""))
+
+    print("=" * 72)
+    print(f"导入 app.main   {summarize(imports)}")
+    print(f"首个请求        {summarize([s['first_request'] for s in servers if s['first_request'] is not None])}")
+    print(f"就绪            {summarize([s['ready'] for s in servers if s['ready'] is not None])}")
+
+    slowest = slowest_imports(env, args.top) if args.top > 0 else []
+    if slowest:
+        print(f"导入最慢的 {len(slowest)} 个模块（累计耗时）:")
+        for seconds, module in slowest:
+            print(f"  {seconds * 1000:8.1f}ms  {module.strip()}")
+
+    if args.json_path:
+        report = {
+            "runs": args.runs,
+            "import": imports,
+            "first_request": [s["first_request"] for s in servers],
+            "ready": [s["ready"] for s in servers],
+            "errors": [s["error"] for s in servers if s["error"]],
+            "slowest_imports": [{"module": m.strip(), "seconds": t} for t, m in slowest],
+        }
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已写入 {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+本地 OpenAI 兼容的上游桩服务，用于测试端点池（LLM_ENDPOINTS）的路由、熔断与故障转移
+
+实现 POST /v1/chat/completions：流式请求按 SSE 逐 token 返回；带 tools 的请求
+（结构化输出）按 JSON Schema 填充示例参数返回一次工具调用。延迟与故障均可配置：
+
+    python benchmarks/stub_llm_server.py --port 9001 --ttft-ms 200
+    python benchmarks/stub_llm_server.py --port 9002 --ttft-ms 1500 --midstream-fail-rate 0.5
+
+然后启动后端：
+
+    LLM_ENDPOINTS=http://127.0.0.1:9001/v1,http://127.0.0.1:9002/v1 DEEPSEEK_API_KEY=stub \\
+        uvicorn app.main:app --port 8000
+
+GET /stats 返回本桩服务收到的请求数与注入的故障数。
+"""
+
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FILLER = "这是本地桩服务生成的示例文本，用于测试上游端点池的路由与故障转移。"
+
+
+class StubConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.name = args.name or f"stub-{args.port}"
+        self.ttft = args.ttft_ms / 1000
+        self.token_interval = 1 / args.tokens_per_second if args.tokens_per_second > 0 else 0
+        self.output_tokens = args.output_tokens
+        self.fail_rate = args.fail_rate
+        self.midstream_fail_rate = args.midstream_fail_rate
+        self.random = random.Random(args.seed)
+        self.stats = {"requests": 0, "errors": 0, "midstream_errors": 0}
+
+
+def sample_value(schema: Dict[str, Any], name: str = "") -> Any:
+    """按 JSON Schema 生成示例值（结构化输出用）。"""
+    kind = schema.get("type")
+    if kind == "array":
+        return [sample_value(schema.get("items", {}), name) for _ in range(3)]
+    if kind == "object":
+        return {key: sample_value(value, key) for key, value in schema.get("properties", {}).items()}
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    return f"示例{name or '内容'}：{FILLER[:10]}（{uuid.uuid4().hex[:4]}）"
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/stats")
+    async def stats():
+        return {"name": config.name, **config.stats}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        config.stats["requests"] += 1
+        await asyncio.sleep(config.ttft)
+
+        if config.random.random() < config.fail_rate:
+            config.stats["errors"] += 1
+            return JSONResponse(status_code=503, content={"error": {"message": f"{config.name} 模拟的上游错误"}})
+
+        model = body.get("model", "stub")
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if body.get("tools"):
+            function = body["tools"][0]["function"]
+            arguments = sample_value(function.get("parameters", {}))
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{
+                    "index": 0, "finish_reason": "tool_calls",
+                    "message": {"role": "assistant", "content": None, "tool_calls": [{
+                        "id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+                        "function": {"name": function["name"], "arguments": json.dumps(arguments, ensure_ascii=False)},
+                    }]},
+                }],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+            }
+
+        max_tokens = body.get("max_tokens") or config.output_tokens
+        tokens = [f"[{config.name}]"] + [
+            FILLER[(i * 2) % len(FILLER):(i * 2) % len(FILLER) + 2] for i in range(min(config.output_tokens, max_tokens))
+        ]
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": len(tokens), "total_tokens": 10 + len(tokens)},
+            }
+
+        fail_at = (config.random.randrange(1, len(tokens))
+                   if len(tokens) > 1 and config.random.random() < config.midstream_fail_rate else None)
+
+        async def events():
+            for i, token in enumerate(tokens):
+                if i == fail_at:
+                    config.stats["midstream_errors"] += 1
+                    # 直接中断响应，客户端表现为连接意外关闭
+                    raise RuntimeError(f"{config.name} 模拟的流式中断")
+                if i:
+                    await asyncio.sleep(config.token_interval)
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": len(tokens), "total_tokens": 10 + len(tokens)},
+            }
+            yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地上游桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--name", help="返回内容中的端点标识，默认 stub-<port>")
+    parser.add_argument("--ttft-ms", type=float, default=200, help="首 token 延迟")
+    parser.add_argument("--tokens-per-second", type=float, default=100)
+    parser.add_argument("--output-tokens", type=int, default=100)
+    parser.add_argument("--fail-rate", type=float, default=0, help="请求直接返回 503 的概率")
+    parser.add_argument("--midstream-fail-rate", type=float, default=0, help="流式输出中途断开的概率")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(StubConfig(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
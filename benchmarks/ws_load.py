@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+/ws/research WebSocket 压测脚本
+
+同时打开 N 个 WebSocket 客户端提问，统计：
+- 首帧时间（time-to-first-frame）与首个内容帧时间的 p50/p95/p99
+- 各阶段（plan/research/report）耗时与端到端耗时
+- 帧吞吐（frames/sec）
+- 服务端进程 CPU 与 RSS（读取 /proc，仅 Linux）
+
+配合离线假模型使用，不消耗真实 token：
+
+    python benchmarks/ws_load.py --spawn --clients 50
+
+或压测已在运行的服务：
+
+    python benchmarks/ws_load.py --url ws://localhost:8000/ws/research --server-pid 12345
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import websockets
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+CONTENT_TYPES = {"plan", "research", "report"}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize(values: List[float]) -> str:
+    if not values:
+        return "-"
+    return (f"p50={percentile(values, 50) * 1000:8.1f}ms  "
+            f"p95={percentile(values, 95) * 1000:8.1f}ms  "
+            f"p99={percentile(values, 99) * 1000:8.1f}ms")
+
+
+class ClientResult:
+    def __init__(self):
+        self.first_frame: Optional[float] = None
+        self.first_content: Optional[float] = None
+        self.total: Optional[float] = None
+        self.frames = 0
+        self.stage_spans: Dict[str, List[float]] = {}
+        self.error: Optional[str] = None
+
+
+async def run_client(url: str, question: str, subprotocol: Optional[str], timeout: float) -> ClientResult:
+    result = ClientResult()
+    # v2 协议中内容帧只携带流 ID，需要记录流声明帧里的帧类型
+    streams: Dict[int, str] = {}
+    kwargs = {"subprotocols": [subprotocol]} if subprotocol else {}
+
+    try:
+        async with websockets.connect(url, max_size=None, **kwargs) as ws:
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "question", "content": question}))
+
+            while True:
+                raw = await asyncio.wait_for(ws.recv(), timeout)
+                now = time.perf_counter() - started
+                if isinstance(raw, bytes):
+                    import msgpack
+                    frame = msgpack.unpackb(raw, raw=False)
+                else:
+                    frame = json.loads(raw)
+
+                frame_type = frame.get("type")
+                if frame_type in ("hello", "pong"):
+                    continue
+                if frame_type == "stream":
+                    streams[frame["id"]] = frame.get("stream_type")
+                    continue
+
+                result.frames += 1
+                if result.first_frame is None:
+                    result.first_frame = now
+
+                stage = streams.get(frame["s"]) if "s" in frame else frame_type
+                if "s" in frame or frame_type in CONTENT_TYPES:
+                    if result.first_content is None:
+                        result.first_content = now
+                    span = result.stage_spans.setdefault(stage, [now, now])
+                    span[1] = now
+
+                if frame_type == "complete":
+                    result.total = now
+                    break
+                if frame_type == "error":
+                    result.error = frame.get("content")
+                    break
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+    return result
+
+
+class ProcessSampler:
+    """周期性读取 /proc/<pid> 采样服务端 CPU 与 RSS。"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_samples: List[float] = []
+        self.rss_samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_ticks = int(fields[11]) + int(fields[12])
+        with open(f"/proc/{self.pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        return cpu_ticks / os.sysconf("SC_CLK_TCK"), rss_kb / 1024
+
+    async def _loop(self):
+        last_cpu, _ = self._read()
+        last_time = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            cpu, rss = self._read()
+            now = time.perf_counter()
+            self.cpu_samples.append((cpu - last_cpu) / (now - last_time) * 100)
+            self.rss_samples.append(rss)
+            last_cpu, last_time = cpu, now
+
+    def start(self):
+        if os.path.exists(f"/proc/{self.pid}/stat"):
+            self._task = asyncio.create_task(self._loop())
+        else:
+            print(f"⚠️ 无法读取 /proc/{self.pid}，跳过服务端资源采样")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, OSError):
+                pass
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(port: int, extra_env: Dict[str, str]) -> subprocess.Popen:
+    """以离线假模型启动后端服务，并等待健康检查通过。"""
+    env = dict(os.environ)
+    env.update({
+        "LLM_PROVIDER": "fake",
+        "RESEARCH_CACHE_ENABLED": "0",
+        "NEAR_DUP_ENABLED": "0",
+        # 不写入 SQLite 检查点：避免磁盘写入影响测得的延迟与 CPU，也不在默认路径留下压测数据
+        "RUN_CHECKPOINT_ENABLED": "0",
+    })
+    env.update(extra_env)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=PROJECT_ROOT / "backend",
+        env=env,
+    )
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("后端服务启动失败")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("等待后端服务启动超时")
+
+
+async def main_async(args) -> Dict:
+    sampler = ProcessSampler(args.server_pid) if args.server_pid else None
+    if sampler:
+        sampler.start()
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        run_client(
+            args.url,
+            args.question if args.same_question else f"{args.question} #{i}",
+            args.subprotocol,
+            args.timeout,
+        )
+        for i in range(args.clients)
+    ))
+    wall = time.perf_counter() - started
+
+    if sampler:
+        await sampler.stop()
+
+    ok = [r for r in results if r.error is None]
+    errors = [r.error for r in results if r.error is not None]
+    stages: Dict[str, List[float]] = {}
+    for r in ok:
+        for stage, (begin, end) in r.stage_spans.items():
+            stages.setdefault(stage, []).append(end - begin)
+    total_frames = sum(r.frames for r in results)
+
+    print("\n" + "=" * 72)
+    print(f"📊 {args.clients} 个客户端，成功 {len(ok)}，失败 {len(errors)}，总耗时 {wall:.2f}s")
+    print("=" * 72)
+    print(f"首帧时间        {summarize([r.first_frame for r in ok if r.first_frame is not None])}")
+    print(f"首个内容帧时间  {summarize([r.first_content for r in ok if r.first_content is not None])}")
+    for stage in ("plan", "research", "report"):
+        print(f"阶段 {stage:<10} {summarize(stages.get(stage, []))}")
+    print(f"端到端耗时      {summarize([r.total for r in ok if r.total is not None])}")
+    print(f"帧吞吐          {total_frames / wall:.1f} frames/s（共 {total_frames} 帧）")
+    if sampler and sampler.cpu_samples:
+        print(f"服务端 CPU      avg={sum(sampler.cpu_samples) / len(sampler.cpu_samples):.1f}%  "
+              f"max={max(sampler.cpu_samples):.1f}%")
+        print(f"服务端 RSS      max={max(sampler.rss_samples):.1f}MB")
+    for error in errors[:5]:
+        print(f"❌ {error}")
+
+    return {
+        "clients": args.clients,
+        "succeeded": len(ok),
+        "failed": len(errors),
+        "wall_seconds": wall,
+        "first_frame": [r.first_frame for r in ok],
+        "first_content": [r.first_content for r in ok],
+        "total": [r.total for r in ok],
+        "stages": stages,
+        "frames": total_frames,
+        "frames_per_second": total_frames / wall,
+        "server_cpu_percent": sampler.cpu_samples if sampler else [],
+        "server_rss_mb": sampler.rss_samples if sampler else [],
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/ws/research WebSocket 压测")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws/research")
+    parser.add_argument("--clients", type=int, default=20, help="并发客户端数")
+    parser.add_argument("--question", default="请分析未来 5 年中国大模型产业的发展机会和挑战")
+    parser.add_argument("--same-question", action="store_true", help="所有客户端使用相同问题（测试请求合并）")
+    parser.add_argument("--subprotocol", default=None, help="协商的协议，如 research.v2.json")
+    parser.add_argument("--timeout", type=float, default=120, help="单帧等待超时（秒）")
+    parser.add_argument("--server-pid", type=int, default=None, help="采样该进程的 CPU/RSS")
+    parser.add_argument("--spawn", action="store_true", help="以离线假模型自动启动后端服务")
+    parser.add_argument("--env", action="append", default=[], help="--spawn 时附加的环境变量，如 FAKE_LLM_TTFT_MS=500")
+    parser.add_argument("--json", dest="json_path", default=None, help="把原始结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    proc = None
+    if args.spawn:
+        port = free_port()
+        extra_env = dict(item.split("=", 1) for item in args.env)
+        print(f"🚀 启动后端服务（假模型）: 127.0.0.1:{port}")
+        proc = spawn_server(port, extra_env)
+        args.url = f"ws://127.0.0.1:{port}/ws/research"
+        args.server_pid = args.server_pid or proc.pid
+
+    try:
+        report = asyncio.run(main_async(args))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已写入 {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,12 @@ class ResearchAssistant {
         this.ws = null;
         this.isConnected = false;
         this.currentStageMessage = null;
+        // 按阶段键缓存消息框，并行研究时不同子问题的帧会交错到达
+        this.stageMessages = {};
         this.messageHistory = [];
+        // 进行中研究的 run_id 与已收到的最大帧序号，断线重连后据此续传
+        this.runId = null;
+        this.lastSeq = 0;
 
         // DOM 元素
         this.elements = {
@@ -45,12 +50,25 @@ class ResearchAssistant {
             this.ws.onopen = () => {
                 this.isConnected = true;
                 this.updateConnectionStatus('已连接', 'connected');
-                this.enableInput();
+
+                if (this.runId) {
+                    // 断线前有进行中的研究：请求补发缺失的帧并继续接收
+                    this.ws.send(JSON.stringify({
+                        type: 'resume',
+                        run_id: this.runId,
+                        last_seq: this.lastSeq
+                    }));
+                } else {
+                    this.enableInput();
+                }
             };
 
             this.ws.onmessage = (event) => {
                 try {
                     const data = JSON.parse(event.data);
+                    if (data.seq) {
+                        this.lastSeq = Math.max(this.lastSeq, data.seq);
+                    }
                     this.handleServerMessage(data);
                 } catch (error) {
                     console.error('解析服务器消息失败:', error);
@@ -116,6 +134,9 @@ class ResearchAssistant {
 
     // 开始研究
     handleStartMessage(data) {
+        this.runId = data.run_id || null;
+        this.lastSeq = data.seq || 0;
+        this.stageMessages = {};
         this.showProgress();
         this.addStageMessage('start', '🚀', '研究开始', data.content);
     }
@@ -140,10 +161,7 @@ class ResearchAssistant {
 
     // 研究计划消息 (修复版本)
     handlePlanMessage(data) {
-        // 如果当前没有计划阶段的消息框，或者阶段不匹配，创建新的
-        if (!this.currentStageMessage || this.currentStageMessage.stage !== 'plan') {
-            this.currentStageMessage = this.addStageMessage('plan', '📋', '制定研究计划', '');
-        }
+        this.currentStageMessage = this.getStageMessage('plan', '📋', '制定研究计划');
 
         // 追加内容到现有的计划消息框
         this.appendToStageMessage(this.currentStageMessage, data.content);
@@ -155,10 +173,8 @@ class ResearchAssistant {
         const stageKey = `research_${data.question_index}`;
         const stageTitle = data.question ? `分析子问题 ${data.question_index}: ${data.question}` : '深度分析';
 
-        // 如果当前没有对应的研究阶段消息框，创建新的
-        if (!this.currentStageMessage || this.currentStageMessage.stage !== stageKey) {
-            this.currentStageMessage = this.addStageMessage(stageKey, '🔍', stageTitle, '');
-        }
+        // 每个子问题对应独立的消息框，交错到达的帧追加到各自的框中
+        this.currentStageMessage = this.getStageMessage(stageKey, '🔍', stageTitle);
 
         // 追加内容到现有的研究消息框
         this.appendToStageMessage(this.currentStageMessage, data.content);
@@ -167,10 +183,7 @@ class ResearchAssistant {
 
     // 报告生成消息 (修复版本)
     handleReportMessage(data) {
-        // 如果当前没有报告阶段的消息框，创建新的
-        if (!this.currentStageMessage || this.currentStageMessage.stage !== 'report') {
-            this.currentStageMessage = this.addStageMessage('report', '📄', '生成研究报告', '');
-        }
+        this.currentStageMessage = this.getStageMessage('report', '📄', '生成研究报告');
 
         // 追加内容到现有的报告消息框
         this.appendToStageMessage(this.currentStageMessage, data.content);
@@ -179,6 +192,7 @@ class ResearchAssistant {
 
     // 完成消息
     handleCompleteMessage(data) {
+        this.runId = null;
         this.hideProgress();
         this.enableInput();
         this.showCompletionMessage();
@@ -186,6 +200,7 @@ class ResearchAssistant {
 
     // 错误消息
     handleErrorMessage(data) {
+        this.runId = null;
         this.addMessage('error', data.content);
         this.hideProgress();
         this.enableInput();
@@ -269,6 +284,14 @@ class ResearchAssistant {
         };
     }
 
+    // 获取阶段消息框，不存在时创建
+    getStageMessage(stageKey, icon, title) {
+        if (!this.stageMessages[stageKey]) {
+            this.stageMessages[stageKey] = this.addStageMessage(stageKey, icon, title, '');
+        }
+        return this.stageMessages[stageKey];
+    }
+
     // 追加内容到阶段消息 (修复版本)
     appendToStageMessage(stageMessage, content) {
         if (stageMessage && stageMessage.contentDiv) {